@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import random
+import sys
+import time
+from llama_index.core.ingestion.pipeline import arun_transformations
+from embedding_provider import has_embedding_cache
+from global_settings import (INGESTION_BATCH_SIZE, INGESTION_MAX_IN_FLIGHT,
+                             INGESTION_REQUESTS_PER_MINUTE, INGESTION_TOKENS_PER_MINUTE,
+                             INGESTION_MAX_RETRIES, INGESTION_BACKOFF_SECONDS)
+
+# Questo modulo implementa la modalità asincrona della pipeline di acquisizione
+# (attivata da INGESTION_ASYNC in global_settings.py).
+#
+# Nella modalità sincrona IngestionPipeline.run esegue SummaryExtractor e l'embedding
+# un nodo (o un lotto) alla volta: il tempo totale è circa (numero di nodi × durata di
+# una chiamata al LLM). Qui invece:
+# - i nodi vengono suddivisi in lotti di INGESTION_BATCH_SIZE nodi;
+# - all'interno di un lotto le chiamate al LLM (una per nodo) e all'embedding (una per
+#   gruppo di embed_batch_size nodi) sono concorrenti, con al più INGESTION_MAX_IN_FLIGHT
+#   richieste contemporanee per fase;
+# - le due fasi si sovrappongono: mentre viene calcolato l'embedding del lotto N, il LLM
+#   sta già riassumendo il lotto N+1;
+# - un limitatore rispetta i budget di richieste e token al minuto delle API, e in caso di
+#   errore 429 (limite superato) solo la singola richiesta viene ripetuta, con attesa esponenziale.
+# I risultati vengono salvati nello stesso archivio della cache della modalità sincrona
+# (IngestionCache), ma con chiavi diverse: qui ogni chiave corrisponde a una singola richiesta
+# (un nodo per il LLM, un gruppo di nodi per l'embedding), nella modalità sincrona all'intero
+# lotto di documenti. Cambiando modalità, i risultati già presenti nella cache non vengono
+# quindi riutilizzati; con la modalità asincrona, invece, un file modificato riutilizza i
+# riassunti e gli embedding dei suoi nodi rimasti uguali.
+
+
+# Limitatore a finestra mobile di 60 secondi per richieste e token al minuto.
+# acquire() attende finché la richiesta non rientra nel budget dell'ultimo minuto.
+class RateLimiter:
+    def __init__(self, requests_per_minute, tokens_per_minute, period=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.period = period
+        self._events = collections.deque()
+        self._requests = 0
+        self._tokens = 0
+        self._lock = asyncio.Lock()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= self.period:
+            _, requests, tokens = self._events.popleft()
+            self._requests -= requests
+            self._tokens -= tokens
+
+    async def acquire(self, requests=1, tokens=0):
+        # Una singola richiesta più grande del budget non potrebbe mai essere servita:
+        # viene limitata al budget, in modo da attendere al più un periodo intero.
+        requests = min(requests, self.requests_per_minute)
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if (self._requests + requests <= self.requests_per_minute
+                        and self._tokens + tokens <= self.tokens_per_minute):
+                    self._events.append((now, requests, tokens))
+                    self._requests += requests
+                    self._tokens += tokens
+                    return
+                await asyncio.sleep(self._events[0][0] + self.period - now)
+
+
+# Riconosce gli errori dovuti al superamento dei limiti di frequenza (HTTP 429),
+# sia del client di OpenAI sia dei sostituti locali (mock_backends.py).
+def _is_rate_limit_error(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# Esegue la coroutine prodotta da make_call, ripetendola in caso di errore 429 con attesa
+# esponenziale (più una componente casuale), o rispettando l'header Retry-After se presente.
+async def with_backoff(make_call, max_retries=INGESTION_MAX_RETRIES, base_delay=1.0):
+    for attempt in range(max_retries + 1):
+        try:
+            return await make_call()
+        except Exception as e:
+            if attempt == max_retries or not _is_rate_limit_error(e):
+                raise
+            delay = _retry_after(e) or base_delay * 2 ** attempt
+            delay += random.uniform(0, base_delay)
+            print(f"Limite di frequenza raggiunto, nuovo tentativo fra {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+# Stima approssimativa dei token di un insieme di nodi (circa 4 caratteri per token).
+def _estimate_tokens(nodes):
+    return sum(len(node.get_content()) for node in nodes) // 4 + 1
+
+
+# Esegue una singola richiesta (un nodo per il LLM, un lotto di embed_batch_size nodi per
+# l'embedding): attende un posto fra le richieste in corso e il budget del limitatore,
+# quindi applica la trasformazione passando dalla cache, ripetendola in caso di errore 429.
+async def _run_request(nodes, transform, limiter, semaphore, cache,
+                       max_retries, backoff_seconds):
+    async with semaphore:
+        await limiter.acquire(requests=1, tokens=_estimate_tokens(nodes))
+        return await with_backoff(
+            lambda: arun_transformations(list(nodes), [transform], cache=cache),
+            max_retries=max_retries, base_delay=backoff_seconds,
+        )
+
+
+# Applica una fase a un lotto, suddividendolo in richieste di request_size nodi eseguite
+# in modo concorrente. L'ordine dei nodi viene mantenuto.
+async def _run_stage(batch, transform, request_size, limiter, semaphore, cache,
+                     max_retries, backoff_seconds):
+    requests = [batch[i:i + request_size] for i in range(0, len(batch), request_size)]
+    outputs = await asyncio.gather(*[
+        _run_request(request, transform, limiter, semaphore, cache,
+                     max_retries, backoff_seconds)
+        for request in requests
+    ])
+    return [node for output in outputs for node in output]
+
+
+# Esegue in modalità asincrona le trasformazioni della pipeline di acquisizione:
+# - local_transformations: trasformazioni locali, senza chiamate alle API (ad es. TokenTextSplitter);
+# - extractor: estrattore di metadati basato sul LLM (ad es. SummaryExtractor);
+# - embed_model: modello di embedding (ad es. OpenAIEmbedding).
+# Restituisce i nodi elaborati, nello stesso ordine della modalità sincrona.
+async def arun_ingestion(documents, local_transformations, extractor, embed_model,
+                         cache=None, batch_size=INGESTION_BATCH_SIZE,
+                         max_in_flight=INGESTION_MAX_IN_FLIGHT,
+                         requests_per_minute=INGESTION_REQUESTS_PER_MINUTE,
+                         tokens_per_minute=INGESTION_TOKENS_PER_MINUTE,
+                         max_retries=INGESTION_MAX_RETRIES,
+                         backoff_seconds=INGESTION_BACKOFF_SECONDS):
+    print(f"### arun_ingestion({len(documents)} documenti)")
+    nodes = await arun_transformations(
+        list(documents), local_transformations, cache=cache)
+
+    # LLM ed embedding hanno budget separati presso il fornitore, e ciascuna fase
+    # ha al più max_in_flight richieste in corso.
+    llm_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    embed_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    llm_semaphore = asyncio.Semaphore(max_in_flight)
+    embed_semaphore = asyncio.Semaphore(max_in_flight)
+    # Un modello con una propria cache (CachedEmbedding) salva già ogni embedding.
+    embed_cache = None if has_embedding_cache(embed_model) else cache
+
+    batches = [nodes[i:i + batch_size] for i in range(0, len(nodes), batch_size)]
+    # La coda ha dimensione 1: il riassunto può portarsi avanti al più di un lotto
+    # rispetto all'embedding, così i nodi in attesa restano pochi.
+    queue = asyncio.Queue(maxsize=1)
+    results = []
+
+    async def summarise():
+        for batch in batches:
+            # Il riassunto è basato sul solo nodo (summaries=['self']): una richiesta per nodo.
+            summarised = await _run_stage(
+                batch, extractor, 1, llm_limiter, llm_semaphore, cache,
+                max_retries, backoff_seconds)
+            await queue.put(summarised)
+        await queue.put(None)
+
+    async def embed():
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            results.extend(await _run_stage(
+                batch, embed_model, embed_model.embed_batch_size, embed_limiter,
+                embed_semaphore, embed_cache, max_retries, backoff_seconds))
+
+    await asyncio.gather(summarise(), embed())
+    return results
+
+
+# Benchmark senza accesso alla rete: confronta IngestionPipeline.run con arun_ingestion
+# utilizzando i sostituti locali del LLM e dell'embedding con latenza simulata.
+# Esempio: python async_ingestion.py Libri 0.2
+if __name__ == "__main__":
+    from llama_index.core import SimpleDirectoryReader
+    from llama_index.core.extractors import SummaryExtractor
+    from llama_index.core.ingestion import IngestionPipeline
+    from llama_index.core.node_parser import TokenTextSplitter
+    from mock_backends import LatencyMockLLM, LatencyMockEmbedding
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else "Libri"
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    docs = SimpleDirectoryReader(folder, filename_as_id=True).load_data()
+
+    def make_stages(failure_rate=0.0):
+        return (TokenTextSplitter(chunk_size=256, chunk_overlap=20),
+                SummaryExtractor(summaries=["self"], language="it",
+                                 llm=LatencyMockLLM(latency=latency,
+                                                    failure_rate=failure_rate),
+                                 num_workers=1, show_progress=False),
+                LatencyMockEmbedding(latency=latency, embed_batch_size=10,
+                                     failure_rate=failure_rate))
+
+    splitter, summary, embedding = make_stages()
+    start = time.perf_counter()
+    sync_nodes = IngestionPipeline(
+        transformations=[splitter, summary, embedding]).run(documents=docs)
+    sync_time = time.perf_counter() - start
+
+    splitter, summary, embedding = make_stages(failure_rate=0.05)
+    start = time.perf_counter()
+    async_nodes = asyncio.run(arun_ingestion(
+        docs, [splitter], summary, embedding, backoff_seconds=latency))
+    async_time = time.perf_counter() - start
+
+    print(f"Nodi: {len(sync_nodes)} / {len(async_nodes)}, latenza simulata {latency}s")
+    print(f"Pipeline sincrona: {sync_time:.2f}s")
+    print(f"Pipeline asincrona (con 5% di errori 429 simulati): {async_time:.2f}s")
@@ -0,0 +1,154 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from nltk.stem.snowball import SnowballStemmer
+from global_settings import INDEX_STORAGE, BM25_INDEX_FILE, BM25_K1, BM25_B, STORAGE_BACKEND
+from namespaces import user_path, namespace_lock
+
+# Questo modulo implementa un indice invertito per la ricerca per parole chiave (BM25)
+# sui nodi acquisiti, pensato per i testi in italiano.
+#
+# La ricerca vettoriale trova i contenuti semanticamente simili alla domanda, ma tende a
+# mancare le corrispondenze esatte: nomi dei personaggi, termini specifici, titoli.
+# L'indice BM25 complementa la ricerca vettoriale (vedi hybrid_retriever.py): le parole
+# vengono ridotte alla radice con lo stemmer Snowball per l'italiano (così "principessa"
+# e "principesse" coincidono) e le parole vuote (articoli, preposizioni...) vengono scartate.
+#
+# L'indice viene aggiornato da index_builder.build_index, dopo il salvataggio dell'indice
+# vettoriale, e salvato nella sua stessa cartella (BM25_INDEX_FILE), accanto agli altri file.
+# Con STORAGE_BACKEND = "redis" viene invece salvato in Redis, nello stesso archivio
+# chiave-valore dell'indice vettoriale (storage_factory.open_index_kvstore): i processi su
+# altre macchine lo leggono da lì, come il resto dell'indice.
+
+# Collezione dell'archivio chiave-valore dell'indice in cui è salvato l'indice BM25.
+_KV_COLLECTION = "bm25"
+
+_STOPWORDS = set("""
+a ad al allo ai agli all agl alla alle con col coi da dal dallo dai dagli dall dagl
+dalla dalle di del dello dei degli dell degl della delle in nel nello nei negli nell
+negl nella nelle su sul sullo sui sugli sull sugl sulla sulle per tra fra contro io tu
+lui lei noi voi loro mio mia miei mie tuo tua tuoi tue suo sua suoi sue nostro nostra
+nostri nostre vostro vostra vostri vostre mi ti ci vi si lo la li le gli ne il un uno
+una ma ed se perché anche come dov dove che chi cui non più quale quanto quanti quanta
+quante quello quelli quella quelle questo questi questa queste si tutto tutti e è o
+sono sei era erano ero essere stato stata ha hanno ho hai abbiamo avete aveva avevano
+c l d quando poi già molto
+""".split())
+
+_stemmer = SnowballStemmer("italian")
+_token_pattern = re.compile(r"\w+", re.UNICODE)
+
+
+# Suddivide un testo in termini: minuscole, senza parole vuote né numeri, ridotti alla radice.
+def tokenize(text):
+    return [_stemmer.stem(token) for token in _token_pattern.findall(text.lower())
+            if token not in _STOPWORDS and not token.isdigit()]
+
+
+class BM25Index:
+    def __init__(self, postings=None, doc_lengths=None, ref_doc_ids=None):
+        # termine -> {node_id: frequenza del termine nel nodo}
+        self.postings = postings or {}
+        # node_id -> numero di termini del nodo
+        self.doc_lengths = doc_lengths or {}
+        # node_id -> ref_doc_id, per eliminare i nodi dei documenti modificati o rimossi
+        self.ref_doc_ids = ref_doc_ids or {}
+        self._total_length = sum(self.doc_lengths.values())
+
+    @classmethod
+    def load(cls, persist_dir=None):
+        persist_dir = persist_dir or user_path(INDEX_STORAGE)
+        if STORAGE_BACKEND == "redis":
+            data = _open_kvstore(persist_dir).get(BM25_INDEX_FILE, collection=_KV_COLLECTION)
+            if data is None:
+                return cls()
+        else:
+            try:
+                with open(os.path.join(persist_dir, BM25_INDEX_FILE), "r") as file:
+                    data = json.load(file)
+            except FileNotFoundError:
+                return cls()
+        return cls(data["postings"], data["doc_lengths"], data["ref_doc_ids"])
+
+    def persist(self, persist_dir=None):
+        persist_dir = persist_dir or user_path(INDEX_STORAGE)
+        data = {
+            "postings": self.postings,
+            "doc_lengths": self.doc_lengths,
+            "ref_doc_ids": self.ref_doc_ids,
+        }
+        if STORAGE_BACKEND == "redis":
+            _open_kvstore(persist_dir).put(BM25_INDEX_FILE, data, collection=_KV_COLLECTION)
+            return
+        os.makedirs(persist_dir, exist_ok=True)
+        path = os.path.join(persist_dir, BM25_INDEX_FILE)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(data, file)
+        os.replace(f"{path}.tmp", path)
+
+    # Aggiunge i nodi all'indice. I nodi già presenti degli stessi documenti (ref_doc_id)
+    # vengono prima eliminati: l'aggiornamento è un upsert, come in index_builder.build_index.
+    def add_nodes(self, nodes):
+        self.delete_ref_docs({node.ref_doc_id for node in nodes})
+        for node in nodes:
+            terms = Counter(tokenize(node.get_content()))
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[node.node_id] = frequency
+            length = sum(terms.values())
+            self.doc_lengths[node.node_id] = length
+            self.ref_doc_ids[node.node_id] = node.ref_doc_id
+            self._total_length += length
+
+    def delete_ref_docs(self, ref_doc_ids):
+        ref_doc_ids = set(ref_doc_ids)
+        removed = {node_id for node_id, ref in self.ref_doc_ids.items() if ref in ref_doc_ids}
+        if not removed:
+            return
+        for node_id in removed:
+            self._total_length -= self.doc_lengths.pop(node_id, 0)
+            del self.ref_doc_ids[node_id]
+        for term in list(self.postings):
+            posting = self.postings[term]
+            for node_id in removed.intersection(posting):
+                del posting[node_id]
+            if not posting:
+                del self.postings[term]
+
+    # Restituisce i top_k nodi più pertinenti per la query, come lista di (node_id, punteggio).
+    def search(self, query, top_k=10):
+        count = len(self.doc_lengths)
+        if count == 0:
+            return []
+        average_length = self._total_length / count
+        scores = Counter()
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for node_id, frequency in posting.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[node_id] / average_length)
+                scores[node_id] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return scores.most_common(top_k)
+
+
+# storage_factory carica llama_index e il client Redis: viene importato solo quando serve.
+def _open_kvstore(persist_dir):
+    from storage_factory import open_index_kvstore
+    return open_index_kvstore(persist_dir)
+
+
+# Aggiorna l'indice BM25 salvato: elimina i documenti obsoleti (file modificati o rimossi)
+# e aggiunge i nuovi nodi. Con rebuild=True l'indice viene invece ricostruito dai soli nodi,
+# come l'indice vettoriale appena creato. Viene chiamata da index_builder.build_index.
+def update_bm25_index(nodes, stale_doc_ids, persist_dir=None, rebuild=False):
+    print("### update_bm25_index()")
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    with namespace_lock(os.path.join(persist_dir, BM25_INDEX_FILE)):
+        bm25_index = BM25Index() if rebuild else BM25Index.load(persist_dir)
+        bm25_index.delete_ref_docs(stale_doc_ids)
+        bm25_index.add_nodes(nodes)
+        bm25_index.persist(persist_dir)
+    return bm25_index
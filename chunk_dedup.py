@@ -0,0 +1,116 @@
+import re
+import zlib
+from typing import Any, Sequence
+import numpy as np
+from llama_index.core.schema import BaseNode, TransformComponent
+from global_settings import (DEDUP_THRESHOLD, DEDUP_NUM_PERM, DEDUP_BANDS,
+                             DEDUP_SHINGLE_SIZE)
+from tracing import count
+
+# Questo modulo implementa una fase della pipeline di acquisizione (document_uploader.py) che
+# elimina i nodi quasi identici prodotti da TokenTextSplitter: lo stesso racconto caricato due
+# volte con nomi diversi, ristampe, pagine ripetute. Ogni nodo eliminato risparmia una chiamata
+# al LLM (SummaryExtractor), un embedding e spazio nell'indice, e non occupa i primi posti
+# dei risultati della ricerca con copie dello stesso testo.
+#
+# La somiglianza fra due nodi è la somiglianza di Jaccard fra gli insiemi delle sequenze di
+# DEDUP_SHINGLE_SIZE parole (shingle), stimata con le firme MinHash (DEDUP_NUM_PERM valori per
+# nodo). Per non confrontare tutte le coppie, le firme sono divise in DEDUP_BANDS bande
+# (Locality Sensitive Hashing): vengono confrontati solo i nodi con almeno una banda uguale.
+# I nodi con somiglianza stimata di almeno DEDUP_THRESHOLD formano un gruppo, di cui viene
+# mantenuto il primo nodo; nei suoi metadati vengono registrati:
+# - duplicate_count: il numero di nodi eliminati perché uguali a questo;
+# - duplicate_files: gli altri file da cui provenivano i nodi eliminati.
+# Questi metadati non fanno parte del testo usato per gli embedding e per il LLM.
+#
+# Il confronto avviene fra i nodi di ogni singola chiamata (un lotto di file acquisiti
+# insieme): i nodi già presenti nell'indice non vengono considerati.
+
+DUPLICATE_KEYS = ["duplicate_count", "duplicate_files"]
+
+# Numero primo maggiore di 2^32, per le permutazioni (a * x + b) % _PRIME degli hash.
+_PRIME = 4294967311
+
+
+def _shingles(text, size):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class NearDuplicateFilter(TransformComponent):
+    threshold: float = DEDUP_THRESHOLD
+    num_perm: int = DEDUP_NUM_PERM
+    bands: int = DEDUP_BANDS
+    shingle_size: int = DEDUP_SHINGLE_SIZE
+    seed: int = 0
+
+    # Firme MinHash dei testi: una riga di num_perm valori per testo.
+    def signatures(self, texts):
+        rng = np.random.default_rng(self.seed)
+        a = rng.integers(1, 2 ** 31, self.num_perm, dtype=np.uint64)
+        b = rng.integers(0, 2 ** 31, self.num_perm, dtype=np.uint64)
+        signatures = np.full((len(texts), self.num_perm), _PRIME, dtype=np.uint64)
+        for row, text in enumerate(texts):
+            shingles = _shingles(text, self.shingle_size)
+            if not shingles:
+                continue
+            hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles],
+                              dtype=np.uint64)
+            signatures[row] = ((np.outer(a, hashes) + b[:, None]) % _PRIME).min(axis=1)
+        return signatures
+
+    # Restituisce, per ogni testo, l'indice del primo testo del suo gruppo di quasi duplicati.
+    def groups(self, texts):
+        signatures = self.signatures(texts)
+        parent = list(range(len(texts)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        rows = self.num_perm // self.bands
+        buckets = {}
+        for row, signature in enumerate(signatures):
+            if signature[0] == _PRIME:
+                continue  # testo vuoto
+            for band in range(self.bands):
+                key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+                for other in buckets.setdefault(key, []):
+                    first, second = find(other), find(row)
+                    if (first != second and np.mean(signatures[other] == signature)
+                            >= self.threshold):
+                        parent[max(first, second)] = min(first, second)
+                buckets[key].append(row)
+        return [find(i) for i in range(len(texts))]
+
+    def __call__(self, nodes: Sequence[BaseNode], **kwargs: Any) -> Sequence[BaseNode]:
+        groups = self.groups([node.get_content() for node in nodes])
+        kept = []
+        # Il primo nodo di ogni gruppo precede sempre gli altri, quindi i suoi metadati
+        # sono già inizializzati quando si incontrano i duplicati.
+        for index, (node, group) in enumerate(zip(nodes, groups)):
+            if group == index:
+                node.metadata.setdefault("duplicate_count", 0)
+                node.metadata.setdefault("duplicate_files", [])
+                for key in DUPLICATE_KEYS:
+                    if key not in node.excluded_embed_metadata_keys:
+                        node.excluded_embed_metadata_keys.append(key)
+                    if key not in node.excluded_llm_metadata_keys:
+                        node.excluded_llm_metadata_keys.append(key)
+                kept.append(node)
+                continue
+            representative = nodes[group].metadata
+            representative["duplicate_count"] += 1
+            file_name = node.metadata.get("file_name")
+            if (file_name and file_name != representative.get("file_name")
+                    and file_name not in representative["duplicate_files"]):
+                representative["duplicate_files"].append(file_name)
+        removed = len(nodes) - len(kept)
+        if removed:
+            print(f"### NearDuplicateFilter -> eliminati {removed} nodi quasi identici su {len(nodes)}")
+        count("near_duplicates_removed", removed)
+        return kept
@@ -0,0 +1,114 @@
+import math
+import re
+from collections import Counter
+from typing import List, Optional
+from llama_index.core import Settings
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from global_settings import CONTEXT_TOKEN_BUDGET
+from tracing import count
+
+# Questo modulo implementa la compressione del contesto recuperato dal motore study_materials
+# (index_registry.get_query_engine con compress_context=True).
+#
+# Senza compressione, ogni risposta della chat invia al LLM i nodi recuperati per intero
+# (blocchi fino a 1024 token), anche se la domanda riguarda una sola frase. ContextCompressor
+# riceve più candidati (CONTEXT_CANDIDATES) e:
+# 1) divide i nodi in frasi e assegna a ogni frase un punteggio di pertinenza rispetto alla
+#    domanda (BM25 sui trigrammi di caratteri, calcolato sulle frasi candidate: funziona
+#    anche sui PDF estratti con le lettere separate da spazi, e non richiede chiamate alle API);
+# 2) riordina i nodi secondo la loro frase migliore;
+# 3) sceglie le frasi con il punteggio più alto finché non si raggiunge CONTEXT_TOKEN_BUDGET
+#    token (contati con il tokenizzatore di llama_index), e le restituisce nell'ordine
+#    originale, raggruppate per nodo. Le frasi omesse sono indicate con "[...]".
+# I nodi restituiti sono copie: quelli dell'indice, condiviso fra le sessioni, non cambiano.
+# I token del contesto prima e dopo la compressione vengono contati nello span corrente
+# (tracing.py): context_tokens_in e context_tokens_out.
+#
+# Valutazione offline rispetto al contesto non compresso: python context_eval.py
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+_K1 = 1.2
+_B = 0.75
+
+
+def split_sentences(text):
+    return [sentence for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+
+
+# Trigrammi di caratteri del testo, ignorando maiuscole, spazi e punteggiatura.
+def _trigrams(text):
+    letters = re.sub(r"\W+", "", text.lower())
+    return Counter(letters[i:i + 3] for i in range(len(letters) - 2))
+
+
+def count_tokens(text):
+    return len(Settings.tokenizer(text))
+
+
+class ContextCompressor(BaseNodePostprocessor):
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextCompressor"
+
+    # Punteggio BM25 di ciascuna frase rispetto ai trigrammi della domanda.
+    def score_sentences(self, query, sentences):
+        query_grams = set(_trigrams(query))
+        grams = [_trigrams(sentence) for sentence in sentences]
+        lengths = [sum(sentence_grams.values()) for sentence_grams in grams]
+        average = (sum(lengths) / len(lengths)) or 1
+        frequency = Counter(gram for sentence_grams in grams
+                            for gram in query_grams & sentence_grams.keys())
+        scores = []
+        for sentence_grams, length in zip(grams, lengths):
+            score = 0.0
+            for gram in query_grams & sentence_grams.keys():
+                idf = math.log(1 + (len(sentences) - frequency[gram] + 0.5) / (frequency[gram] + 0.5))
+                tf = sentence_grams[gram]
+                score += idf * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * length / average))
+            scores.append(score)
+        return scores
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if not nodes or query_bundle is None:
+            return nodes
+        # (posizione del nodo, testo della frase) per tutte le frasi dei candidati.
+        sentences = [(position, sentence) for position, node in enumerate(nodes)
+                     for sentence in split_sentences(node.node.get_content())]
+        if not sentences:
+            return nodes
+        scores = self.score_sentences(query_bundle.query_str,
+                                      [sentence for _, sentence in sentences])
+        tokens = [count_tokens(sentence) for _, sentence in sentences]
+
+        # Sceglie le frasi migliori entro il budget (almeno una).
+        selected, used = set(), 0
+        for index in sorted(range(len(sentences)), key=lambda i: -scores[i]):
+            if selected and used + tokens[index] > self.token_budget:
+                continue
+            selected.add(index)
+            used += tokens[index]
+
+        # Ricompone i nodi con le frasi scelte, ordinati secondo la loro frase migliore.
+        best = {}
+        parts = {}
+        for index, (position, sentence) in enumerate(sentences):
+            if index in selected:
+                best[position] = max(best.get(position, 0.0), scores[index])
+                parts.setdefault(position, []).append(sentence)
+            elif parts.get(position, [None])[-1] != "[...]":
+                parts.setdefault(position, []).append("[...]")
+        compressed = []
+        for position in sorted(best, key=lambda position: (-best[position], position)):
+            node = nodes[position].node.model_copy()
+            node.set_content(" ".join(parts[position]).strip())
+            compressed.append(NodeWithScore(node=node, score=best[position]))
+
+        count("context_tokens_in", sum(tokens))
+        count("context_tokens_out", used)
+        print(f"### ContextCompressor -> contesto da {sum(tokens)} a {used} token, "
+              f"{len(compressed)}/{len(nodes)} nodi")
+        return compressed
@@ -0,0 +1,112 @@
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+from llama_index.core import Settings
+from llama_index.core.schema import QueryBundle
+from global_settings import RETRIEVAL_TOP_K, CONTEXT_CANDIDATES, CONTEXT_TOKEN_BUDGET
+from mock_backends import LatencyMockLLM, LatencyMockEmbedding
+
+# Valutazione offline della compressione del contesto (context_compressor.py).
+#
+# Sul corpus Libri vengono poste alcune domande con risposta nota; per ciascuna viene
+# confrontato il contesto inviato al LLM dal motore study_materials senza compressione
+# (RETRIEVAL_TOP_K nodi interi) e con compressione (CONTEXT_CANDIDATES nodi ridotti a
+# CONTEXT_TOKEN_BUDGET token):
+# - token del contesto;
+# - copertura: la frazione delle parole della risposta attesa presenti nel contesto. Il LLM
+#   può rispondere correttamente solo se la risposta è nel contesto, per cui la copertura è
+#   un limite superiore della qualità della risposta, misurabile senza chiamare le API.
+# Con --openai le risposte vengono generate anche dal LLM di OpenAI (richiede la chiave e la
+# rete) e viene misurata la copertura delle risposte stesse.
+# Il confronto ignora maiuscole e spazi: i PDF di Libri sono estratti con le lettere separate.
+#
+# Esempio: python context_eval.py
+
+# (domanda, parole della risposta attesa)
+QUESTIONS = [
+    ("Come si chiama il paese dove vive Alessandra?", ["sonnolento"]),
+    ("Di che colore sono i capelli di Alessandra?", ["rossi"]),
+    ("Quale animale guida Alessandra fino al vecchio pozzo?", ["lucciola"]),
+    ("Come si chiama il drago che minaccia la Terra di Altrove?", ["sfida"]),
+    ("Come si chiama l'albero amico di Chloe?", ["alby"]),
+    ("Quale desiderio confida l'albero a Chloe?", ["bambino"]),
+    ("Come si chiama il villaggio di Paolo l'inventore?", ["ingenioso"]),
+    ("Quale problema deve risolvere Paolo per il villaggio?", ["pompa", "acqua"]),
+    ("Che tipo di dinosauro è Dino?", ["triceratopo"]),
+    ("Cosa succede ai brufoli di Dino durante il temporale?", ["brillare", "esplosero"]),
+]
+
+
+def _normalize(text):
+    return re.sub(r"\W+", "", text.lower())
+
+
+def coverage(text, keywords):
+    normalized = _normalize(text)
+    return sum(_normalize(keyword) in normalized for keyword in keywords) / len(keywords)
+
+
+def evaluate(engine, use_llm):
+    from context_compressor import count_tokens
+    rows = []
+    for question, keywords in QUESTIONS:
+        nodes = engine.retrieve(QueryBundle(question))
+        context = "\n".join(node.node.get_content() for node in nodes)
+        row = {"tokens": count_tokens(context), "coverage": coverage(context, keywords)}
+        if use_llm:
+            row["answer_coverage"] = coverage(str(engine.query(question)), keywords)
+        rows.append(row)
+    return rows
+
+
+def _mean(rows, key):
+    return sum(row[key] for row in rows) / len(rows)
+
+
+if __name__ == "__main__":
+    from pipeline_benchmark import prepare_corpus
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Valutazione della compressione del contesto")
+    parser.add_argument("--corpus", default=os.path.join(repo_dir, "Libri"))
+    parser.add_argument("--openai", action="store_true",
+                        help="genera le risposte con il LLM di OpenAI")
+    args = parser.parse_args()
+    corpus_dir = os.path.abspath(args.corpus)
+
+    if not args.openai:
+        Settings.llm = LatencyMockLLM()
+    Settings.embed_model = LatencyMockEmbedding()
+    work_dir = tempfile.mkdtemp(prefix="learny-context-eval-")
+    os.chdir(work_dir)
+    try:
+        from document_uploader import ingest_documents
+        from index_builder import build_index
+        from index_registry import get_query_engine
+        prepare_corpus(corpus_dir, 1)
+        build_index(*ingest_documents())
+        results = {
+            "senza compressione": evaluate(
+                get_query_engine(similarity_top_k=RETRIEVAL_TOP_K), args.openai),
+            "con compressione": evaluate(
+                get_query_engine(similarity_top_k=CONTEXT_CANDIDATES, compress_context=True),
+                args.openai),
+        }
+    finally:
+        os.chdir(repo_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n{len(QUESTIONS)} domande, budget {CONTEXT_TOKEN_BUDGET} token")
+    for name, rows in results.items():
+        line = (f"  {name:20} token medi {_mean(rows, 'tokens'):7.1f}   "
+                f"copertura del contesto {_mean(rows, 'coverage'):.0%}")
+        if args.openai:
+            line += f"   copertura delle risposte {_mean(rows, 'answer_coverage'):.0%}"
+        print(line)
+    for number, (question, _) in enumerate(QUESTIONS):
+        plain, compressed = (results[name][number] for name in results)
+        print(f"  {question[:55]:55} {plain['tokens']:5} -> {compressed['tokens']:4} token   "
+              f"copertura {plain['coverage']:.0%} -> {compressed['coverage']:.0%}")
+    sys.exit(0)
@@ -1,11 +1,18 @@
+import time
 import streamlit as st
-from llama_index.core import load_index_from_storage
-from llama_index.core import StorageContext
-from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from llama_index.agent.openai import OpenAIAgent
-from llama_index.core.storage.chat_store import SimpleChatStore
-from global_settings import INDEX_STORAGE, CONVERSATION_FILE
+from global_settings import (CONVERSATION_FILE, LEGACY_CONVERSATION_FILE, RETRIEVAL_TOP_K,
+                             CHAT_STREAMING, CHAT_METRICS_HISTORY, CHAT_PAGE_SIZE,
+                             SEMANTIC_CACHE, TRACE_SIDEBAR, CONTEXT_COMPRESSION,
+                             CONTEXT_CANDIDATES, STORAGE_BACKEND)
+from jsonl_chat_store import JsonlChatStore
+from redis_stores import RedisChatStore, redis_key
+from rolling_memory import RollingSummaryMemory
+from namespaces import user_path
+from semantic_cache import SemanticCacheQueryEngine, get_semantic_cache
+from index_registry import get_query_engine, read_generation
+from tracing import span, get_trace
 
 # Questo modulo gestisce il pannello per la chat, fornendo le risposte alle domande degli utenti.
 # Il "motore di conversazione" è in grado di comprendere l'argomento, è consapevole del contesto attuale e
@@ -23,56 +30,103 @@ from global_settings import INDEX_STORAGE, CONVERSATION_FILE
 # sessioni precedenti. Viene utilizzata una chiave chat_store_key="0" generica: in
 # uno scenario multiutente, questa chiave potrebbe essere utilizzata per archiviare
 # conversazioni per diversi utenti nello stesso archivio chat.
-# load_chat_store crea (o recupera) un'istanza di SimpleChatStore e la restituisce.
-# SimpleChatStore è una classe progettata per memorizzare una conversazione.
+# load_chat_store crea (o recupera) un'istanza di JsonlChatStore e la restituisce.
+# JsonlChatStore (jsonl_chat_store.py) memorizza la conversazione in un registro in sola
+# aggiunta: ad ogni turno vengono scritti solo i nuovi messaggi.
 def load_chat_store():
     print("### load_chat_store()")
-    # Tenta di recuperare la cronologia delle conversazioni dal file di archiviazione locale.
-    # Se il file non esiste, viene creato un nuovo chat_store vuoto.
-    try:
-        chat_store = SimpleChatStore.from_persist_path(CONVERSATION_FILE)
-    except FileNotFoundError:
-        chat_store = SimpleChatStore()
+    # L'archivio già caricato viene conservato nella sessione di Streamlit: l'agent
+    # memorizzato da initialize_chatbot vi fa riferimento, e rileggere il file ad ogni
+    # esecuzione dello script creerebbe un'istanza diversa da quella usata dall'agent.
+    if '_chat_store' in st.session_state:
+        return st.session_state['_chat_store']
+    # Con STORAGE_BACKEND = "redis" la conversazione è salvata in Redis (redis_stores.py) ed è
+    # condivisa da tutti i processi dell'applicazione.
+    if STORAGE_BACKEND == "redis":
+        chat_store = RedisChatStore(redis_key(user_path(CONVERSATION_FILE)))
+        st.session_state['_chat_store'] = chat_store
+        return chat_store
+    # Recupera la cronologia delle conversazioni dal file di archiviazione locale.
+    # Se il file non esiste viene importata la conversazione salvata nel formato JSON
+    # precedente, se presente; altrimenti il chat_store parte vuoto.
+    # I file della conversazione si trovano nello spazio dell'utente (namespaces.py).
+    chat_store = JsonlChatStore.from_persist_path(
+        user_path(CONVERSATION_FILE), legacy_path=user_path(LEGACY_CONVERSATION_FILE))
+    st.session_state['_chat_store'] = chat_store
     return chat_store
 
 
-# Questa funzione è responsabile della visualizzazione dell'intera cronologia delle
+# Questa funzione è responsabile della visualizzazione della cronologia delle
 # conversazioni nell'interfaccia Streamlit. Richiede un archivio di chat e un contenitore
-# Streamlit come argomenti: estrae tutti i messaggi dall'archivio utilizzando get_messages()
-# e li visualizza nel container Streamlit, aggiungendo automaticamente l'icona corrispondente
-# a ciascun ruolo (utente o assistente).
+# Streamlit come argomenti: estrae i messaggi dall'archivio e li visualizza nel container
+# Streamlit, aggiungendo automaticamente l'icona corrispondente a ciascun ruolo
+# (utente o assistente).
+# Per non ridisegnare ad ogni esecuzione l'intera conversazione vengono mostrate solo le
+# ultime pagine di CHAT_PAGE_SIZE messaggi; il pulsante in cima ne carica altre.
 def display_messages(chat_store, container):
     print("### display_messages()")
+    pages = st.session_state.get('_chat_pages', 1)
     with container:
-        for message in chat_store.get_messages(key="0"):
-            if message.role != "tool" and message.content != None:
-                with st.chat_message(message.role):
-                    st.markdown(message.content)
+        if len(chat_store.get_messages(key="0")) > pages * CHAT_PAGE_SIZE:
+            if st.button("Mostra messaggi precedenti"):
+                pages += 1
+                st.session_state['_chat_pages'] = pages
+        for page in reversed(range(pages)):
+            for message in chat_store.get_messages_page("0", page, CHAT_PAGE_SIZE):
+                if message.role != "tool" and message.content != None:
+                    with st.chat_message(message.role):
+                        st.markdown(message.content)
 
 
 # Inizializza l'agent OpenAIAgent e lo restituisce.
+# L'agent viene costruito una sola volta per sessione e conservato in st.session_state:
+# viene ricreato solo se cambiano utente, argomento, contesto o la generazione dell'indice
+# (cioè quando index_builder.build_index ha salvato una nuova versione dell'indice).
 def initialize_chatbot(user_name, study_subject,
                        chat_store, container, context):
     print("### initialize_chatbot(...)")
 
-    # Utilizzando chat_store, crea un buffer di memoria per la chat (ChatMemoryBuffer)
-    # con un limite di 3000 token.
-    memory = ChatMemoryBuffer.from_defaults(
-        token_limit=3000,
+    chatbot_key = (user_name, study_subject, context, read_generation())
+    cached = st.session_state.get('_chatbot')
+    if cached is not None and cached[0] == chatbot_key:
+        agent = cached[1]
+    else:
+        agent = _build_agent(user_name, study_subject, chat_store, context)
+        st.session_state['_chatbot'] = (chatbot_key, agent)
+
+    # Visualizza i messaggi memorizzati nel chat_store (cioè la conversazione).
+    display_messages(chat_store, container)
+    return agent
+
+
+def _build_agent(user_name, study_subject, chat_store, context):
+    print("### _build_agent(...)")
+
+    # Utilizzando chat_store, crea la memoria per la chat (rolling_memory.py): gli ultimi
+    # messaggi entro CHAT_MEMORY_TOKEN_LIMIT token, più un riassunto dei precedenti
+    # aggiornato in background.
+    memory = RollingSummaryMemory.from_defaults(
         chat_store=chat_store,
         chat_store_key="0"
     )
-    # Carica il contesto di archiviazione dalla cartella INDEX_STORAGE
-    storage_context = StorageContext.from_defaults(
-        persist_dir=INDEX_STORAGE
-    )
-    # Carica l'indice vettoriale dallo StorageContext.
-    vector_index = load_index_from_storage(
-        storage_context, index_id="vector"
-    )
-    # Crea un motore di query dall'indice caricato.
-    # Il motore di query provvederà al recupero dei 3 risultati più simili.
-    study_materials_engine = vector_index.as_query_engine(similarity_top_k=3)
+    # Recupera dal registro condiviso (index_registry.py) il motore di query costruito
+    # sull'indice vettoriale "vector": l'indice viene caricato da INDEX_STORAGE una sola
+    # volta per processo e condiviso con il generatore di quiz.
+    # Il motore di query provvederà al recupero dei RETRIEVAL_TOP_K risultati più pertinenti:
+    # con la ricerca ibrida (vettoriale + parole chiave) ne bastano meno, e il prompt è più breve.
+    # Con CONTEXT_COMPRESSION vengono invece recuperati CONTEXT_CANDIDATES nodi, ridotti alle
+    # sole frasi pertinenti alla domanda entro CONTEXT_TOKEN_BUDGET token (context_compressor.py).
+    if CONTEXT_COMPRESSION:
+        engine_config = {"similarity_top_k": CONTEXT_CANDIDATES, "compress_context": True}
+    else:
+        engine_config = {"similarity_top_k": RETRIEVAL_TOP_K}
+    study_materials_engine = get_query_engine(**engine_config)
+    # Con SEMANTIC_CACHE le domande quasi identiche a quelle già servite (anche da altri
+    # studenti) ricevono la risposta salvata, senza nuovo recupero né sintesi (semantic_cache.py).
+    # Le risposte sono riutilizzate solo da motori con la stessa configurazione.
+    if SEMANTIC_CACHE:
+        study_materials_engine = SemanticCacheQueryEngine(study_materials_engine,
+                                                          config=engine_config)
 
     # Crea un Tool (QueryEngineTool), che incapsula il motore di query creato in
     # precedenza e fornisce un accesso in sola lettura ai dati.
@@ -108,8 +162,6 @@ def initialize_chatbot(user_name, study_subject,
             f"particolare il seguente contenuto: {context}"
         )
     )
-    # Visualizza i messaggi memorizzati nel chat_store (cioè la conversazione).
-    display_messages(chat_store, container)
     return agent
 
 
@@ -117,19 +169,93 @@ def initialize_chatbot(user_name, study_subject,
 # generando una risposta dall'agent. Salva la conversazione dopo ciascuna
 # interazione. Se l'utente termina la sessione corrente, la conversazione
 # riprenderà da quel punto.
+# Con CHAT_STREAMING la risposta viene scritta nella chat man mano che i token arrivano
+# (stream_chat), invece di attendere la risposta completa con la pagina bloccata.
+# Per ogni turno vengono registrati il tempo al primo token e la latenza totale.
+# Ogni turno è inoltre una traccia (tracing.py), con le chiamate al LLM, al tool e alla
+# cache semantica; con TRACE_SIDEBAR il dettaglio dell'ultimo turno è mostrato nella barra laterale.
 def chat_interface(agent, chat_store, container):
     print("### chat_interface(...)")
     # visualizza un widget di input della chat utilizzando il metodo chat_input() di Streamlit.
     prompt = st.chat_input("Scrivi la tua domanda:")
     if prompt:
-        with container:
+        with container, span("chat_request", prompt_chars=len(prompt)) as request_span:
             # Visualizza il prompt nella chat con il ruolo di "assistant".
             with st.chat_message("user"):
                 st.markdown(prompt)
-            # Invoca il metodo chat() dell'agent per generare una risposta alla domanda dell'utente.
-            response = str(agent.chat(prompt))
+            start = time.perf_counter()
+            timings = {}
             # Visualizza la risposta nella chat con il ruolo di "assistant".
             with st.chat_message("assistant"):
-                st.markdown(response)
+                if CHAT_STREAMING:
+                    # Invoca il metodo stream_chat() dell'agent: le eventuali chiamate al tool
+                    # study_materials vengono eseguite prima, poi la risposta arriva un token
+                    # alla volta. L'agent salva la risposta completa nella memoria (e quindi
+                    # nel chat_store) al termine dello stream.
+                    response = agent.stream_chat(prompt)
+                    st.write_stream(_timed_stream(response.response_gen, start, timings))
+                else:
+                    # Invoca il metodo chat() dell'agent per generare una risposta alla domanda dell'utente.
+                    response = str(agent.chat(prompt))
+                    timings["first_token"] = time.perf_counter() - start
+                    st.markdown(response)
+            metrics = _record_metrics(start, timings)
+            request_span.set(**metrics)
+            st.session_state['_last_trace'] = request_span.trace_id
+            caption = (f"Primo token: {metrics['first_token']:.2f}s · "
+                       f"risposta completa: {metrics['total']:.2f}s")
+            if CONTEXT_COMPRESSION and 'context_tokens_in' in request_span.attributes:
+                caption += (f" · contesto: {request_span.attributes['context_tokens_in']} → "
+                            f"{request_span.attributes['context_tokens_out']} token")
+            if SEMANTIC_CACHE:
+                cache_stats = get_semantic_cache().stats()
+                caption += (f" · cache: {cache_stats['hit_rate']:.0%} risposte riutilizzate, "
+                            f"{cache_stats['saved_seconds']:.1f}s risparmiati")
+            st.caption(caption)
+        # I messaggi sono già stati accodati al registro dall'agent: persist li rende
+        # durevoli su disco (fsync) ed eventualmente compatta il registro.
         print("### chat_interface -> chat_store.persist(CONVERSATION_FILE)")
-        chat_store.persist(CONVERSATION_FILE)
+        chat_store.persist(user_path(CONVERSATION_FILE))
+    if TRACE_SIDEBAR and '_last_trace' in st.session_state:
+        display_trace(st.session_state['_last_trace'])
+
+
+# Inoltra i token dello stream registrando l'istante in cui arriva il primo.
+def _timed_stream(tokens, start, timings):
+    for token in tokens:
+        if "first_token" not in timings:
+            timings["first_token"] = time.perf_counter() - start
+        yield token
+
+
+# Registra le metriche di latenza del turno (in secondi) nella sessione di Streamlit,
+# conservando solo gli ultimi CHAT_METRICS_HISTORY turni.
+def _record_metrics(start, timings):
+    total = time.perf_counter() - start
+    metrics = {"first_token": timings.get("first_token", total), "total": total}
+    print(f"### chat_interface -> primo token {metrics['first_token']:.2f}s, "
+          f"totale {metrics['total']:.2f}s")
+    history = st.session_state.setdefault('_chat_metrics', [])
+    history.append(metrics)
+    del history[:-CHAT_METRICS_HISTORY]
+    return metrics
+
+
+# Mostra nella barra laterale la durata di ciascuna fase di una traccia (ad esempio l'ultimo
+# turno della chat), con i token utilizzati e i risultati letti dalle cache.
+def display_trace(trace_id):
+    spans = get_trace(trace_id)
+    if not spans:
+        return
+    depth = {}
+    rows = []
+    for trace_span in spans:
+        depth[trace_span.span_id] = depth.get(trace_span.parent_id, -1) + 1
+        details = ", ".join(f"{key}={value}" for key, value in trace_span.attributes.items()
+                            if "tokens" in key or key.endswith(("hits", "misses", "tool", "nodes",
+                                                               "window", "summarized")))
+        rows.append({"fase": "· " * depth[trace_span.span_id] + trace_span.name,
+                     "ms": round(trace_span.duration * 1000, 1),
+                     "dettagli": details})
+    with st.sidebar.expander("Tempi dell'ultima risposta"):
+        st.dataframe(rows, hide_index=True, use_container_width=True)
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from llama_index.core import SimpleDirectoryReader
+from global_settings import LOADER_WORKERS, LOADER_BATCH_FILES, LOADER_MAX_BATCH_MB
+
+# Questo modulo legge i file caricati dallo studente in parallelo e li restituisce
+# man mano che sono pronti, in lotti di dimensione limitata.
+#
+# L'estrazione del testo dai PDF è un'operazione che impegna la CPU: con un solo
+# SimpleDirectoryReader(...).load_data() i file vengono letti uno alla volta e l'intero
+# contenuto resta in memoria prima che la pipeline di acquisizione possa iniziare.
+# Qui ogni file viene invece letto da un processo separato (ProcessPoolExecutor) e i
+# documenti vengono raggruppati in lotti: non appena un lotto raggiunge LOADER_BATCH_FILES
+# file (o LOADER_MAX_BATCH_MB di testo) viene consegnato alla pipeline, mentre i processi
+# continuano a leggere i file successivi. In memoria restano al più un lotto e i file in
+# lettura (uno per processo).
+#
+# I file vengono consegnati nell'ordine ricevuto, qualunque sia l'ordine in cui i processi
+# terminano, e i documenti di ogni lotto sono ordinati per nome del file: a parità di file,
+# lotti e ordine dei nodi sono sempre gli stessi, e così i risultati letti dalla cache
+# della pipeline. Ricordare che i nodi quasi identici (chunk_dedup.py) vengono cercati
+# all'interno di ciascun lotto.
+
+
+# Legge un singolo file. Viene eseguita nei processi del pool, quindi deve essere una
+# funzione di modulo (serializzabile). Gli identificativi dei documenti sono gli stessi
+# prodotti da SimpleDirectoryReader(..., filename_as_id=True) sull'intera cartella.
+def _load_file(file_path):
+    reader = SimpleDirectoryReader(input_files=[file_path], filename_as_id=True)
+    return reader.load_data()
+
+
+def _documents_size(documents):
+    return sum(len(doc.text.encode("utf-8")) for doc in documents)
+
+
+# Ordina i documenti di un lotto per nome del file, mantenendo l'ordine delle pagine.
+def _sorted_batch(batch):
+    return sorted(batch, key=lambda doc: doc.metadata.get("file_path", ""))
+
+
+# Restituisce (generatore) i documenti ricavati da file_paths, in lotti (liste di Document).
+# - max_workers: numero di processi di lettura; con 1 i file vengono letti nel processo corrente.
+# - batch_files: numero massimo di file in un lotto consegnato al chiamante;
+# - max_batch_mb: dimensione massima, in MB di testo, di un lotto (con 0 ogni file viene
+#   consegnato appena letto).
+# Tutte le pagine di uno stesso file finiscono sempre nello stesso lotto.
+def iter_document_batches(file_paths, max_workers=LOADER_WORKERS,
+                          batch_files=LOADER_BATCH_FILES, max_batch_mb=LOADER_MAX_BATCH_MB):
+    print(f"### iter_document_batches({len(file_paths)} file, {max_workers} processi)")
+    max_batch_bytes = max_batch_mb * 1024 * 1024
+    # Non ha senso avviare più processi dei file da leggere.
+    max_workers = min(max_workers, len(file_paths))
+
+    batch, batch_files_count, batch_bytes = [], 0, 0
+    for documents in _iter_files(file_paths, max_workers):
+        batch.extend(documents)
+        batch_files_count += 1
+        batch_bytes += _documents_size(documents)
+        if batch_files_count >= batch_files or batch_bytes >= max_batch_bytes:
+            yield _sorted_batch(batch)
+            batch, batch_files_count, batch_bytes = [], 0, 0
+    if batch:
+        yield _sorted_batch(batch)
+
+
+# Restituisce i documenti di ciascun file, nell'ordine di file_paths.
+def _iter_files(file_paths, max_workers):
+    if max_workers <= 1:
+        for file_path in file_paths:
+            yield _load_file(file_path)
+        return
+
+    pending_paths = iter(file_paths)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Mantiene in lettura al più un file per processo, così la memoria occupata
+        # dai risultati non ancora consegnati resta limitata.
+        running = deque(executor.submit(_load_file, file_path)
+                        for _, file_path in zip(range(max_workers), pending_paths))
+        while running:
+            documents = running.popleft().result()
+            next_path = next(pending_paths, None)
+            if next_path is not None:
+                running.append(executor.submit(_load_file, next_path))
+            yield documents
+
+
+# Micro-benchmark: confronta la lettura sequenziale di una cartella (come avveniva con
+# SimpleDirectoryReader) con la lettura parallela di questo modulo.
+# Esempio: python document_loader.py Libri 4
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else "Libri"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else LOADER_WORKERS
+    paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+             if os.path.isfile(os.path.join(folder, name))]
+
+    start = time.perf_counter()
+    sequential = SimpleDirectoryReader(input_files=paths, filename_as_id=True).load_data()
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    first_batch_time = None
+    parallel = []
+    for documents in iter_document_batches(paths, max_workers=workers, batch_files=1):
+        if first_batch_time is None:
+            first_batch_time = time.perf_counter() - start
+        parallel.extend(documents)
+    parallel_time = time.perf_counter() - start
+
+    print(f"File: {len(paths)}, documenti: {len(sequential)} / {len(parallel)}")
+    print(f"Lettura sequenziale: {sequential_time:.2f}s")
+    print(f"Lettura parallela ({workers} processi): {parallel_time:.2f}s "
+          f"(primo lotto dopo {first_batch_time:.2f}s)")
+    print(f"Speedup: {sequential_time / parallel_time:.2f}x")
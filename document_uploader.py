@@ -1,68 +1,87 @@
 # ingest uploaded documents
-from global_settings import STORAGE_PATH, CACHE_FILE
-from llama_index.core import SimpleDirectoryReader
+import asyncio
+import os
+from global_settings import STORAGE_PATH, CACHE_FILE, INGESTION_CACHE_DB, INGESTION_ASYNC
+from async_ingestion import arun_ingestion
+from ingestion_manifest import detect_changes
+from document_loader import iter_document_batches
+from sqlite_kv_store import import_json_cache
+from storage_factory import open_cache_store
+from namespaces import user_path
+from text_cleaner import BoilerplateCleaner
+from chunk_dedup import NearDuplicateFilter
+from tracing import traced, span
+from embedding_provider import has_embedding_cache
 from llama_index.core.ingestion import IngestionPipeline, IngestionCache
+from llama_index.core.ingestion.pipeline import run_transformations
 from llama_index.core.node_parser import TokenTextSplitter
 from llama_index.core.extractors import SummaryExtractor
-from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.core import Settings
 # from llama_index.readers.file.docs.base import PDFReader
 
+# Metadati che dipendono dalla copia del file (date del file system), e non dal suo contenuto.
+_FILE_DATE_METADATA = ("creation_date", "last_modified_date", "last_accessed_date")
 
-# Filtro per le frasi da escludere dall'ingestion
-def rimuovi_frasi_indesiderate(testo, frasi_da_escludere):
-    for frase in frasi_da_escludere:
-        testo = testo.replace(frase, "")
-    return testo
+
+# Rende i metadati e l'identificativo di un documento indipendenti dallo spazio dell'utente
+# (namespaces.py) e dalle date del file. La cache della pipeline è indicizzata dal testo dei
+# nodi insieme a tutti i loro metadati (MetadataMode.ALL): con il percorso completo
+# (users/<spazio>/...) o le date, lo stesso file caricato da due studenti avrebbe chiavi
+# diverse, e verrebbe riassunto e trasformato in embedding una volta per ciascuno.
+# Il percorso diventa relativo alla cartella dei materiali ed è escluso, come il nome del
+# file, dal testo usato per l'embedding e dal LLM.
+def _normalize_document(doc, storage_path):
+    doc.id_ = os.path.relpath(doc.id_, storage_path)
+    doc.metadata["file_path"] = os.path.relpath(doc.metadata["file_path"], storage_path)
+    for key in _FILE_DATE_METADATA:
+        doc.metadata.pop(key, None)
+    for excluded_keys in (doc.excluded_embed_metadata_keys, doc.excluded_llm_metadata_keys):
+        if "file_path" not in excluded_keys:
+            excluded_keys.append("file_path")
 
 
 # ingest_documents() è responsabile della gestione del processo di acquisizione (ingestion):
 # carica tutti i documenti leggibili, disponibili nella cartella STORAGE_PATH, ed esegue una
 # pipeline di trasformazioni, che effettua la suddivisione del testo in blocchi più piccoli,
 # un'estrazione di un breve sommario e l'embedding, restituendo infine i nodi elaborati .
+# L'acquisizione è incrementale: grazie al manifesto (ingestion_manifest.py) vengono elaborati
+# solo i file nuovi o modificati. Insieme ai nodi viene restituito il dizionario delle modifiche,
+# che index_builder.build_index utilizza per aggiornare l'indice e il manifesto.
+# Ogni lotto di documenti elaborato dalla pipeline è misurato da uno span (tracing.py), con il
+# numero di documenti, di nodi prodotti e di risultati letti dalla cache della pipeline.
+@traced("ingest_documents")
 def ingest_documents():
     print("### ingest_documents()")
-    # Crea un lettore di directory di tipo SimpleDirectoryReader, che
-    # si adatta automaticamente a differenti tipi di files.
-    # Utilizza i nomi dei file come identificatori unici per i documenti creati.
-    reader = SimpleDirectoryReader(STORAGE_PATH, filename_as_id=True)
-
-    # Carica il contenuto della directory in in una lista di oggetti Document di Llamaindex.
-    # La classe Document è un container con diversi attributi, fra cui:
-    # text: contiene il contenuto testuale del documento
-    # metadata: informazioni addizionali, come il nome del file.
-    # id: identificativo univoco per ciascun documento.
-    documents = reader.load_data()
-    for doc in documents:
-        print(doc.id_)
-
-    # Controlla se esiste un file di cache per la pipeline di acquisizione.
-    # Se il file di cache esiste, viene utilizzato; altrimenti, viene eseguita l'elaborazione senza cache.
-    try:
-        cached_hashes = IngestionCache.from_persist_path(CACHE_FILE)
-        print("Trovato il file di cache della Pipeline di acquisizione. Continuo con la cache...")
-    except:
-        cached_hashes = ""
-        print("File di cache della Pipeline di acquisizione non trovato. Continuo senza cache...")
-
-    # Definisce la lista delle frasi da non acquisire, utilizzata dal filtro
-    frasi_da_escludere = [
-        "Ricevi una favola al giorno gratuitamente: iscriviti su https://365favole.com/",
-        "365favole.com",
-        "3 6 5 f a v o l e",
-        "3 6 5 f a v o l e . c o m",
-        "i s c r i v i t i\ns u\nh t t p s : / / 3 6 5 f a v o l e . c o m ",
-        "R i c e v i\nu n a\nf a v o l a\na l\ng i o r n o\ng r a t u i t a m e n t e"
-    ]
-
-    # Applica il filtro ai documenti
-    for doc in documents:
-        doc.text = rimuovi_frasi_indesiderate(doc.text, frasi_da_escludere)
+    # Confronta gli hash dei file presenti in STORAGE_PATH con quelli già acquisiti.
+    changes = detect_changes()
+    if not changes["changed"]:
+        print("Nessun file nuovo o modificato da acquisire.")
+        return [], changes
+
+    # Elenco dei file nuovi o modificati da leggere, nello spazio dell'utente (namespaces.py).
+    storage_path = user_path(STORAGE_PATH)
+    file_paths = [os.path.join(storage_path, filename) for filename in changes["changed"]]
+
+    # Apre la cache della pipeline di acquisizione, salvata in un database SQLite
+    # (sqlite_kv_store.py): i risultati vengono letti solo quando servono e scritti
+    # man mano, senza caricare e riscrivere l'intera cache ad ogni acquisizione.
+    # Se esiste il file di cache JSON delle versioni precedenti, viene importato.
+    # La cache è condivisa fra tutti gli utenti: gli stessi documenti, caricati da più
+    # studenti, vengono elaborati (riassunti e embedding) una sola volta (_normalize_document).
+    # Con STORAGE_BACKEND = "redis" la cache è invece salvata in Redis (storage_factory.py).
+    cache_store = open_cache_store(INGESTION_CACHE_DB)
+    import_json_cache(CACHE_FILE, cache_store)
+    cached_hashes = IngestionCache(cache=cache_store)
 
     # Definisce la pipeline di acquisizione.
     # Se gli hash nel file di cache corrispondono a quelli dei file da acquisire, non è necessaria
     # alcuna elaborazione: i valori verranno caricati direttamente dalla cache.
     pipeline = IngestionPipeline(
         transformations=[
+            # 0) Elimina dal testo le frasi da escludere (BOILERPLATE_PHRASES) e le righe che si
+            # ripetono in molte pagine dello stesso documento (intestazioni, piè di pagina,
+            # anche con il numero di pagina) (text_cleaner.py).
+            BoilerplateCleaner(),
             # 1) Suddivide il testo in blocchi più piccoli (chunk) basati su token (parole, segni di punteggiatura, spazi).
             # TokenTextSplitter suddivide il testo rispettando i limiti della frase.
             # Questi blocchi vengono poi utilizzati per creare nodi. Ogni nodo rappresenta un'unità
@@ -80,6 +99,12 @@ def ingest_documents():
                 chunk_overlap=20  # default
             ),
 
+            # Elimina i nodi quasi identici (lo stesso testo caricato più volte, pagine ripetute)
+            # prima delle fasi costose: per ciascuno si risparmiano un riassunto e un embedding.
+            # Il nodo mantenuto registra nei metadati i file da cui provenivano i duplicati
+            # (chunk_dedup.py).
+            NearDuplicateFilter(),
+
             # 2) Generazione, tramite un estrattore di metadati, di un breve riassunto per ciascun
             # nodo, basato sul contenuto del nodo stesso. Ciò è utile per fornire una panoramica
             # rapida e concisa del contenuto del nodo senza dover leggere l'intero testo.
@@ -99,7 +124,10 @@ def ingest_documents():
             # semantico del testo contenuto nei nodi e li rappresentano come vettori numerici.
             # in un sistema RAG (Retrieval-Augmented Generation), gli embedding possono essere
             # utilizzati per trovare nodi rilevanti per una query specifica.
-            OpenAIEmbedding()
+            # Viene usato il modello di embedding globale (Settings.embed_model, per impostazione
+            # predefinita OpenAIEmbedding), lo stesso usato per le interrogazioni dell'indice:
+            # i benchmark (pipeline_benchmark.py) possono così sostituirlo con un modello locale.
+            Settings.embed_model
         ],
 
         # La cache viene utilizzata per evitare di ripetere elaborazioni costose (tokenizzazione,
@@ -111,18 +139,73 @@ def ingest_documents():
         cache=cached_hashes
     )
 
-    # Elabora i documenti utilizzando la pipeline di acquisizione
-    nodes = pipeline.run(documents=documents)
-
-    # Salva su file i dati della Pipeline di acquisizione
-    pipeline.cache.persist(CACHE_FILE)
-
-    # Restituisce i nodi elaborati
-    return nodes
+    # Legge i file in parallelo (document_loader.py) e li elabora a lotti: la pipeline
+    # inizia a lavorare sul primo lotto mentre i file successivi sono ancora in lettura,
+    # e in memoria non viene mai mantenuto il testo di tutti i file contemporaneamente.
+    # Ogni lotto è una lista di oggetti Document di Llamaindex.
+    # La classe Document è un container con diversi attributi, fra cui:
+    # text: contiene il contenuto testuale del documento
+    # metadata: informazioni addizionali, come il nome del file.
+    # id: identificativo univoco per ciascun documento (basato sul nome del file).
+    nodes = []
+    for documents in iter_document_batches(file_paths):
+        for doc in documents:
+            _normalize_document(doc, storage_path)
+            print(doc.id_)
+            # Registra quali documenti sono stati ricavati da ciascun file, per poterli
+            # sostituire o eliminare dall'indice quando il file cambia o viene rimosso.
+            changes["doc_ids"].setdefault(
+                doc.metadata["file_name"], []).append(doc.id_)
+
+        # Elabora i documenti del lotto utilizzando la pipeline di acquisizione.
+        # In modalità asincrona (INGESTION_ASYNC) le stesse trasformazioni vengono eseguite da
+        # async_ingestion.arun_ingestion: riassunti ed embedding procedono in parallelo, nel
+        # rispetto dei limiti di frequenza delle API. I risultati sono salvati nello stesso
+        # archivio della cache, ma con chiavi per singolo nodo (async_ingestion.py).
+        with span("ingest.pipeline", documents=len(documents)) as batch_span:
+            if INGESTION_ASYNC:
+                batch_nodes = asyncio.run(arun_ingestion(
+                    documents,
+                    local_transformations=pipeline.transformations[:-2],
+                    extractor=pipeline.transformations[-2],
+                    embed_model=pipeline.transformations[-1],
+                    cache=pipeline.cache,
+                ))
+            elif has_embedding_cache(pipeline.transformations[-1]):
+                # Il modello di embedding ha una propria cache (embedding_provider.CachedEmbedding):
+                # l'embedding viene calcolato fuori dalla cache della pipeline, che altrimenti
+                # salverebbe i vettori una seconda volta, insieme ai nodi.
+                *stages, embed_model = pipeline.transformations
+                batch_nodes = embed_model(
+                    run_transformations(documents, stages, cache=pipeline.cache))
+            else:
+                batch_nodes = pipeline.run(documents=documents)
+            batch_span.set(nodes=len(batch_nodes))
+        nodes.extend(batch_nodes)
+
+    # I dati della Pipeline di acquisizione sono già stati salvati nella cache.
+    cache_store.close()
+
+    # Riepilogo dei nodi quasi identici eliminati e, per ogni file, dei file nei cui nodi
+    # sono confluiti i suoi duplicati: se uno di questi viene modificato o rimosso, il file
+    # va acquisito di nuovo (ingestion_manifest.detect_changes).
+    changes["duplicates_removed"] = sum(node.metadata.get("duplicate_count", 0) for node in nodes)
+    for node in nodes:
+        for filename in node.metadata.get("duplicate_files", []):
+            merged_into = changes["merged_into"].setdefault(filename, [])
+            if node.metadata["file_name"] not in merged_into:
+                merged_into.append(node.metadata["file_name"])
+    if changes["duplicates_removed"]:
+        print(f"Nodi quasi identici eliminati: {changes['duplicates_removed']} "
+              f"({changes['duplicates_removed']} riassunti del LLM e "
+              f"{changes['duplicates_removed']} embedding risparmiati).")
+
+    # Restituisce i nodi elaborati e le modifiche rilevate
+    return nodes, changes
 
 
 if __name__ == "__main__":
-    embedded_nodes = ingest_documents()
+    embedded_nodes, _ = ingest_documents()
 
     for node in embedded_nodes:
         print("--------------------")
@@ -0,0 +1,242 @@
+import asyncio
+import base64
+import hashlib
+import importlib.util
+import threading
+from typing import Any, List
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from global_settings import (EMBEDDING_PROVIDER, EMBEDDING_CACHE, EMBEDDING_CACHE_DB,
+                             LOCAL_EMBEDDING_MODEL, LOCAL_EMBEDDING_DEVICE,
+                             LOCAL_EMBEDDING_MAX_BATCH, LOCAL_EMBEDDING_MAX_BATCH_TOKENS,
+                             LOCAL_EMBEDDING_MAX_LENGTH)
+from storage_factory import open_cache_store
+from tracing import count
+
+# Questo modulo sceglie il modello di embedding usato dall'applicazione, sia durante
+# l'acquisizione dei materiali (document_uploader.py) sia per le domande della chat e del quiz
+# (Settings.embed_model).
+#
+# EMBEDDING_PROVIDER indica il modello:
+# - "openai": OpenAIEmbedding, una richiesta HTTP per ogni lotto di testi e per ogni domanda;
+# - "local": LocalTransformersEmbedding, un modello di transformers (LOCAL_EMBEDDING_MODEL)
+#   eseguito sulla CPU, senza rete e senza costi. Richiede torch e transformers, che non sono
+#   fra i requisiti dell'applicazione: pip install torch transformers.
+#   I testi vengono ordinati per lunghezza e raggruppati in lotti dinamici, limitati sia nel
+#   numero di testi (LOCAL_EMBEDDING_MAX_BATCH) sia nel numero totale di token
+#   (LOCAL_EMBEDDING_MAX_BATCH_TOKENS): i testi brevi (domande) finiscono in lotti grandi,
+#   quelli lunghi (chunk da 1024 token) in lotti piccoli, con poco riempimento (padding).
+#
+# Con EMBEDDING_CACHE il modello è avvolto da CachedEmbedding: ogni embedding viene salvato
+# nella cache della pipeline (storage_factory.open_cache_store, collezione "embeddings"), con chiave
+# l'hash del modello e del testo. Gli stessi chunk riacquisiti (anche da altri utenti) e le
+# domande già poste non vengono mai ricalcolati. La pipeline di acquisizione non salva quindi
+# gli embedding anche nella propria cache (has_embedding_cache). Con SQLite la cache condivide
+# con gli altri risultati la dimensione massima INGESTION_CACHE_MAX_MB, oltre la quale vengono
+# eliminate le voci lette meno di recente; con Redis il limite è quello del server (maxmemory).
+#
+# Cambiare modello cambia la dimensione degli embedding: l'indice esistente va ricreato
+# (ad esempio avviando una nuova sessione, che elimina i materiali e l'indice).
+
+EMBEDDING_COLLECTION = "embeddings"
+
+
+# Suddivide i testi (indicati dalla loro lunghezza in token) in lotti: restituisce liste di
+# indici, con i testi in ordine di lunghezza, di al più max_batch testi e max_tokens token
+# (contando il riempimento fino al testo più lungo del lotto).
+def dynamic_batches(lengths, max_batch, max_tokens):
+    batches, batch = [], []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # I testi sono in ordine crescente: il più lungo del lotto è l'ultimo aggiunto.
+        if batch and (len(batch) >= max_batch
+                      or (len(batch) + 1) * lengths[index] > max_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class LocalTransformersEmbedding(BaseEmbedding):
+    device: str = LOCAL_EMBEDDING_DEVICE
+    max_batch: int = LOCAL_EMBEDDING_MAX_BATCH
+    max_batch_tokens: int = LOCAL_EMBEDDING_MAX_BATCH_TOKENS
+    max_length: int = LOCAL_EMBEDDING_MAX_LENGTH
+    _tokenizer: Any = PrivateAttr(default=None)
+    _model: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, **kwargs: Any) -> None:
+        # torch e transformers vengono importati solo al primo embedding, ma la loro assenza
+        # viene segnalata subito, alla scelta del modello.
+        missing = [name for name in ("torch", "transformers")
+                   if importlib.util.find_spec(name) is None]
+        if missing:
+            raise ImportError(f"EMBEDDING_PROVIDER = \"local\" richiede {' e '.join(missing)}: "
+                              f"pip install torch transformers")
+        super().__init__(model_name=model_name, embed_batch_size=LOCAL_EMBEDDING_MAX_BATCH * 4,
+                         **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalTransformersEmbedding"
+
+    # Il modello viene caricato al primo utilizzo, una sola volta.
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                print(f"### LocalTransformersEmbedding -> carico {self.model_name}")
+                from transformers import AutoModel, AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self._model = AutoModel.from_pretrained(self.model_name).to(self.device).eval()
+        return self._tokenizer, self._model
+
+    def _embed(self, texts):
+        import torch
+        tokenizer, model = self._load()
+        lengths = [len(ids) for ids in tokenizer(
+            texts, truncation=True, max_length=self.max_length)["input_ids"]]
+        embeddings = [None] * len(texts)
+        for batch in dynamic_batches(lengths, self.max_batch, self.max_batch_tokens):
+            encoded = tokenizer([texts[i] for i in batch], padding=True, truncation=True,
+                                max_length=self.max_length, return_tensors="pt").to(self.device)
+            with torch.inference_mode():
+                output = model(**encoded).last_hidden_state
+            # Media dei token (esclusi quelli di riempimento), normalizzata.
+            mask = encoded["attention_mask"].unsqueeze(-1).to(output.dtype)
+            pooled = (output * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            pooled = torch.nn.functional.normalize(pooled, dim=-1)
+            for i, vector in zip(batch, pooled.cpu().tolist()):
+                embeddings[i] = vector
+        return embeddings
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query])[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return (await asyncio.to_thread(self._embed, [query]))[0]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self._embed, texts)
+
+
+def _encode(vector):
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode(value):
+    return np.frombuffer(base64.b64decode(value), dtype=np.float32).tolist()
+
+
+# Modello di embedding che legge dalla cache gli embedding già calcolati e delega al
+# modello avvolto solo i testi mai visti.
+class CachedEmbedding(BaseEmbedding):
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: Any = PrivateAttr()
+
+    def __init__(self, embed_model, cache=None, **kwargs: Any) -> None:
+        super().__init__(model_name=f"cached:{embed_model.model_name}",
+                         embed_batch_size=embed_model.embed_batch_size, **kwargs)
+        self._embed_model = embed_model
+        self._cache = cache or open_cache_store(EMBEDDING_CACHE_DB)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    # La chiave distingue gli embedding delle domande (kind="query") da quelli dei testi:
+    # alcuni modelli li calcolano in modo diverso.
+    def _key(self, text, kind):
+        model = f"{self._embed_model.class_name()}:{self._embed_model.model_name}"
+        return hashlib.sha256(f"{model}\n{kind}\n{text}".encode("utf-8")).hexdigest()
+
+    # Restituisce gli embedding dalla cache (None per quelli mancanti) e le chiavi dei testi.
+    def _lookup(self, texts, kind="text"):
+        keys = [self._key(text, kind) for text in texts]
+        cached = [self._cache.get(key, collection=EMBEDDING_COLLECTION) for key in keys]
+        embeddings = [_decode(value["embedding"]) if value else None for value in cached]
+        hits = sum(embedding is not None for embedding in embeddings)
+        count("embedding_cache_hits", hits)
+        count("embedding_cache_misses", len(texts) - hits)
+        return embeddings, keys
+
+    def _store(self, embeddings, keys, missing, computed):
+        for i, embedding in zip(missing, computed):
+            embeddings[i] = embedding
+        self._cache.put_all([(keys[i], {"embedding": _encode(embeddings[i])}) for i in missing],
+                            collection=EMBEDDING_COLLECTION)
+        return embeddings
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        embeddings, keys = self._lookup([query], kind="query")
+        if embeddings[0] is None:
+            self._store(embeddings, keys, [0], [self._embed_model.get_query_embedding(query)])
+        return embeddings[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings, keys = self._lookup(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self._embed_model.get_text_embedding_batch([texts[i] for i in missing])
+            self._store(embeddings, keys, missing, computed)
+        return embeddings
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        embeddings, keys = self._lookup([query], kind="query")
+        if embeddings[0] is None:
+            self._store(embeddings, keys, [0],
+                        [await self._embed_model.aget_query_embedding(query)])
+        return embeddings[0]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings, keys = self._lookup(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = await self._embed_model.aget_text_embedding_batch(
+                [texts[i] for i in missing])
+            self._store(embeddings, keys, missing, computed)
+        return embeddings
+
+
+# Restituisce True se embed_model salva già i propri embedding (CachedEmbedding): la pipeline
+# di acquisizione non deve salvarli una seconda volta nella sua cache, insieme ai nodi.
+def has_embedding_cache(embed_model):
+    return isinstance(embed_model, CachedEmbedding)
+
+
+# Crea il modello di embedding indicato da EMBEDDING_PROVIDER, con la cache se EMBEDDING_CACHE.
+def get_embed_model(provider=EMBEDDING_PROVIDER, cache=EMBEDDING_CACHE):
+    print(f"### get_embed_model({provider})")
+    if provider == "local":
+        embed_model = LocalTransformersEmbedding()
+    elif provider == "openai":
+        from llama_index.embeddings.openai import OpenAIEmbedding
+        embed_model = OpenAIEmbedding()
+    else:
+        raise ValueError(f"EMBEDDING_PROVIDER non valido: {provider}")
+    return CachedEmbedding(embed_model) if cache else embed_model
+
+
+_configured = False
+_configured_lock = threading.Lock()
+
+
+# Imposta (una sola volta per processo) il modello di embedding globale di llama_index.
+def configure_embed_model():
+    global _configured
+    with _configured_lock:
+        if not _configured:
+            Settings.embed_model = get_embed_model()
+            _configured = True
@@ -1,8 +1,100 @@
 SESSION_FILE = "session_data/user_session_state.yaml"
 CACHE_FILE = "cache/pipeline_cache.json"
-CONVERSATION_FILE = "cache/chat_history.json"
+INGESTION_CACHE_DB = "cache/pipeline_cache.sqlite"
+INGESTION_CACHE_MAX_MB = 2048
+CONVERSATION_FILE = "cache/chat_history.jsonl"
+LEGACY_CONVERSATION_FILE = "cache/chat_history.json"
 QUIZ_FILE = "cache/quiz.csv"
 STORAGE_PATH = "ingestion_storage/"
 INDEX_STORAGE = "index_storage"
 SUMMARY_STORAGE = "summary_storage"
 QUIZ_SIZE = 5
+INDEX_GENERATION_FILE = "generation.txt"
+MANIFEST_FILE = "ingestion_storage/.ingestion_manifest.json"
+LOADER_WORKERS = 4
+LOADER_BATCH_FILES = 4
+LOADER_MAX_BATCH_MB = 8
+INGESTION_ASYNC = False
+INGESTION_BATCH_SIZE = 16
+INGESTION_MAX_IN_FLIGHT = 8
+INGESTION_REQUESTS_PER_MINUTE = 500
+INGESTION_TOKENS_PER_MINUTE = 200000
+INGESTION_MAX_RETRIES = 6
+INGESTION_BACKOFF_SECONDS = 1.0
+VECTOR_STORE_BACKEND = "mmap"
+IVF_NPROBE = 8
+IVF_MIN_TRAIN_SIZE = 4096
+IVF_TRAIN_ITERATIONS = 10
+BM25_INDEX_FILE = "bm25_index.json"
+BM25_K1 = 1.5
+BM25_B = 0.75
+HYBRID_RETRIEVAL = True
+HYBRID_CANDIDATES = 10
+RETRIEVAL_TOP_K = 2
+CHAT_STREAMING = True
+CHAT_METRICS_HISTORY = 50
+CHAT_FSYNC_EVERY = 4
+CHAT_COMPACT_MIN_RECORDS = 200
+CHAT_COMPACT_RATIO = 2
+CHAT_PAGE_SIZE = 20
+SEMANTIC_CACHE = True
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_SIZE = 256
+SEMANTIC_CACHE_TTL = 86400
+QUIZ_POOL_DIR = "cache/quiz_pool"
+QUIZ_POOL_SIZE = 2
+QUIZ_PARALLEL = True
+QUIZ_MAX_PARALLEL = 8
+QUIZ_DUPLICATE_THRESHOLD = 0.7
+QUIZ_BANK_DB = "cache/quiz_bank.sqlite"
+NAMESPACES_DIR = "users"
+DEFAULT_NAMESPACE = "default"
+NAMESPACE_LOCK_TIMEOUT = 600
+NAMESPACE_SECRET_FILE = "cache/namespace_secret"
+SUMMARY_MAX_PARALLEL = 4
+SUMMARY_REDUCE_GROUP = 20
+BOILERPLATE_PHRASES = [
+    "Ricevi una favola al giorno gratuitamente: iscriviti su https://365favole.com/",
+    "365favole.com",
+    "3 6 5 f a v o l e",
+    "3 6 5 f a v o l e . c o m",
+    "i s c r i v i t i\ns u\nh t t p s : / / 3 6 5 f a v o l e . c o m ",
+    "R i c e v i\nu n a\nf a v o l a\na l\ng i o r n o\ng r a t u i t a m e n t e",
+]
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_PAGE_FRACTION = 0.5
+STARTUP_BUDGET_SECONDS = 2.0
+STARTUP_LAZY_MODULES = ["llama_index", "openai", "pandas", "fpdf"]
+TRACING = True
+TRACE_EXPORT = False
+TRACE_FILE = "cache/traces.jsonl"
+TRACE_FILE_MAX_MB = 20
+TRACE_FLUSH_SECONDS = 2.0
+TRACE_HISTORY = 2000
+TRACE_SIDEBAR = True
+TRACE_SERVICE_NAME = "learny"
+BENCHMARK_RESULTS = "benchmarks/results.jsonl"
+EMBEDDING_PROVIDER = "openai"
+EMBEDDING_CACHE = True
+EMBEDDING_CACHE_DB = INGESTION_CACHE_DB
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+LOCAL_EMBEDDING_DEVICE = "cpu"
+LOCAL_EMBEDDING_MAX_BATCH = 32
+LOCAL_EMBEDDING_MAX_BATCH_TOKENS = 8192
+LOCAL_EMBEDDING_MAX_LENGTH = 512
+DEDUP_THRESHOLD = 0.85
+DEDUP_NUM_PERM = 128
+DEDUP_BANDS = 32
+DEDUP_SHINGLE_SIZE = 5
+CONTEXT_COMPRESSION = True
+CONTEXT_CANDIDATES = 5
+CONTEXT_TOKEN_BUDGET = 600
+CHAT_MEMORY_TOKEN_LIMIT = 3000
+CHAT_SUMMARY_TOKEN_LIMIT = 500
+CHAT_SUMMARY_FOLD_RATIO = 0.5
+STORAGE_BACKEND = "local"
+REDIS_URL = "redis://localhost:6379/0"
+REDIS_PREFIX = "learny"
+REDIS_MAX_CONNECTIONS = 16
+REDIS_POOL_TIMEOUT = 10
+REDIS_PIPELINE_BATCH = 500
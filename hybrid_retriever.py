@@ -0,0 +1,48 @@
+from typing import List
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from global_settings import HYBRID_CANDIDATES
+
+# Questo modulo implementa un retriever ibrido, che combina la ricerca vettoriale
+# (somiglianza semantica) con la ricerca per parole chiave dell'indice BM25 (bm25_index.py).
+#
+# Ciascuna delle due ricerche restituisce HYBRID_CANDIDATES candidati; le due classifiche
+# vengono fuse con la Reciprocal Rank Fusion (RRF): ogni nodo riceve 1 / (rrf_k + posizione)
+# per ciascuna classifica in cui compare. I nodi trovati da entrambe le ricerche salgono in
+# cima, e la domanda che cita un personaggio per nome trova il brano giusto anche quando la
+# somiglianza semantica da sola non basta. Al LLM vengono passati solo i similarity_top_k
+# nodi migliori: meno testo nel prompt, risposte più rapide ed economiche.
+
+
+class HybridRetriever(BaseRetriever):
+    def __init__(self, vector_index, bm25_index, similarity_top_k=2,
+                 candidates=HYBRID_CANDIDATES, rrf_k=60, **kwargs):
+        self._vector_retriever = vector_index.as_retriever(similarity_top_k=candidates)
+        self._docstore = vector_index.docstore
+        self._bm25_index = bm25_index
+        self._similarity_top_k = similarity_top_k
+        self._candidates = candidates
+        self._rrf_k = rrf_k
+        super().__init__(**kwargs)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        vector_results = self._vector_retriever.retrieve(query_bundle)
+        keyword_results = self._bm25_index.search(
+            query_bundle.query_str, top_k=self._candidates)
+
+        scores = {}
+        nodes = {}
+        for rank, result in enumerate(vector_results):
+            scores[result.node.node_id] = 1 / (self._rrf_k + rank + 1)
+            nodes[result.node.node_id] = result.node
+        for rank, (node_id, _) in enumerate(keyword_results):
+            scores[node_id] = scores.get(node_id, 0) + 1 / (self._rrf_k + rank + 1)
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self._similarity_top_k]
+        results = []
+        for node_id in ranked:
+            # I nodi trovati solo dalla ricerca per parole chiave vengono letti dal docstore.
+            node = nodes.get(node_id) or self._docstore.get_node(node_id, raise_error=False)
+            if node is not None:
+                results.append(NodeWithScore(node=node, score=scores[node_id]))
+        return results
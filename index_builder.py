@@ -1,6 +1,11 @@
 from llama_index.core import VectorStoreIndex, load_index_from_storage
-from llama_index.core import StorageContext
 from global_settings import INDEX_STORAGE
+from storage_factory import load_storage_context, new_storage_context, index_exists
+from index_registry import publish_index, get_vector_index
+from ingestion_manifest import has_changes, commit_changes, save_manifest
+from bm25_index import update_bm25_index
+from namespaces import user_path, namespace_lock
+from tracing import traced, span
 
 # Questo modulo crea e gestisce un indice vettoriale (VectorStoreIndex) per i nodi
 # elaborati nella fase di acquisizione (modulo document_uploader.py).
@@ -30,12 +35,35 @@ from global_settings import INDEX_STORAGE
 # e ottimizza queste informazioni per rendere le operazioni di ricerca e recupero più efficienti e precise.
 
 
-def build_index(nodes):
+# build_index riceve i nodi prodotti da document_uploader.ingest_documents e il dizionario
+# delle modifiche rilevate dal manifesto (ingestion_manifest.py). I documenti dei file
+# modificati o rimossi vengono eliminati dall'indice (per ref_doc_id) prima di inserire i
+# nuovi nodi: l'aggiornamento è quindi un vero upsert e non accoda mai duplicati.
+# L'indice viene salvato nello spazio dell'utente corrente (namespaces.py); il lock su file
+# impedisce che due sessioni dello stesso utente lo aggiornino contemporaneamente.
+@traced("build_index")
+def build_index(nodes, changes=None):
     print("### build_index(nodes)")
+    persist_dir = user_path(INDEX_STORAGE)
 
-    # Verifica se l'indice sia già stato precedentemente salvato su file, nella cartella INDEX_STORAGE
-    try:
-        # Cerca di caricare il contesto di archiviazione dalla cartella INDEX_STORAGE (file docstore.jason)
+    # Se non ci sono file nuovi, modificati o rimossi, l'indice salvato è già aggiornato:
+    # viene restituito quello del registro condiviso, senza riscriverlo su disco.
+    if changes is not None and not has_changes(changes):
+        print("Indice già aggiornato: nessuna modifica da applicare.")
+        return get_vector_index(persist_dir)
+
+    with namespace_lock(persist_dir):
+        return _update_index(nodes, changes, persist_dir)
+
+
+def _update_index(nodes, changes, persist_dir):
+    # Verifica se l'indice sia già stato precedentemente salvato nella cartella INDEX_STORAGE.
+    # Solo in sua assenza l'indice viene creato dai nodi: se invece il caricamento o
+    # l'aggiornamento di un indice esistente non riesce (errore temporaneo, file danneggiato),
+    # l'errore viene propagato, senza sostituire l'indice con i soli nodi appena elaborati
+    # (i documenti non modificati sparirebbero dalle ricerche).
+    if index_exists(persist_dir):
+        # Carica il contesto di archiviazione dalla cartella INDEX_STORAGE (file docstore.jason)
 
         # IndexStore: Questo componente memorizza le informazioni strutturali dell'indice, come la mappatura
         # dei documenti ai loro rispettivi nodi e altre informazioni di metadati. In pratica, IndexStore
@@ -47,17 +75,24 @@ def build_index(nodes):
         # consente di eseguire ricerche basate sulla somiglianza semantica, trovando nodi che sono concettualmente simili alla query.
 
         print("Provo a caricare lo storage context per l'indice")
-        storage_context = StorageContext.from_defaults(
-            persist_dir=INDEX_STORAGE
-        )
-        # Tenta di estrarre dal contesto di archiviazione un indice vettoriale esistente (con indice "vector"),
+        # L'archivio vettoriale utilizzato dipende da VECTOR_STORE_BACKEND (storage_factory.py).
+        storage_context = load_storage_context(persist_dir)
+        # Estrae dal contesto di archiviazione l'indice vettoriale esistente (con indice "vector"),
         # In tal modo si evitano i costi da sostenere per la sua ricostruzione.
         print("Provo a caricare l'indice dallo storage context")
-        vector_index = load_index_from_storage(
-            storage_context, index_id="vector"
-        )
+        with span("load_index_from_storage", persist_dir=persist_dir):
+            vector_index = load_index_from_storage(
+                storage_context, index_id="vector"
+            )
         print("Indice caricato dallo storage.")
 
+        # Elimina dall'indice (e dal docstore) i documenti dei file modificati o rimossi.
+        if changes is not None:
+            for ref_doc_id in changes["stale_doc_ids"]:
+                vector_index.delete_ref_doc(
+                    ref_doc_id, delete_from_docstore=True)
+            print(f"Eliminati {len(changes['stale_doc_ids'])} documenti obsoleti.")
+
         # Inserisce i nuovi nodi
         vector_index.insert_nodes(nodes)
 
@@ -65,15 +100,20 @@ def build_index(nodes):
         print("Indice aggiornato con i nuovi nodi.")
 
         # Salva l'indice aggiornato.
-        storage_context.persist(persist_dir=INDEX_STORAGE)
+        storage_context.persist(persist_dir=persist_dir)
         print("Indice salvato nello storage context.")
-    except Exception as e:
-        # Se il caricamento dell'indice vettoriale fallisce (ad esempio, se l'indice non esiste),
-        # viene creato un nuovo contesto di archiviazione e un nuovo indice vettoriale utilizzando
-        # i nodi forniti. L'ID dell'indice viene impostato su "vector" e il contesto di archiviazione
-        # viene salvato nella directory di persistenza.
-        print(f"{e}\nIndice non trovato: lo ricostruisco dai nodi.")
-        storage_context = StorageContext.from_defaults()
+
+        # Aggiorna l'indice per parole chiave (BM25) usato dalla ricerca ibrida, sostituendo
+        # i nodi dei file modificati o rimossi, solo ora che l'indice vettoriale è salvato.
+        with span("build_index.bm25_index", nodes=len(nodes)):
+            update_bm25_index(nodes, changes["stale_doc_ids"] if changes is not None else [],
+                              persist_dir)
+    else:
+        # Se l'indice non esiste, viene creato un nuovo contesto di archiviazione e un nuovo
+        # indice vettoriale utilizzando i nodi forniti. L'ID dell'indice viene impostato su
+        # "vector" e il contesto di archiviazione viene salvato nella directory di persistenza.
+        print("Indice non trovato: lo creo dai nodi.")
+        storage_context = new_storage_context(persist_dir)
 
         # Associazione del contesto di archiviazione: quando si crea un nuovo indice vettoriale
         # (VectorStoreIndex) e gli si passa storage_context, l'indice viene associato a quel contesto
@@ -86,8 +126,25 @@ def build_index(nodes):
         print("Nuovo indice creato.")
 
         # Salva il nuovo indice.
-        storage_context.persist(persist_dir=INDEX_STORAGE)
+        storage_context.persist(persist_dir=persist_dir)
         print("Nuovo indice salvato nello storage context.")
 
+        # Anche l'indice BM25 viene ricostruito dai soli nodi del nuovo indice.
+        with span("build_index.bm25_index", nodes=len(nodes)):
+            update_bm25_index(nodes, [], persist_dir, rebuild=True)
+
+        # Il nuovo indice contiene solo i nodi appena elaborati: il manifesto viene azzerato,
+        # così gli eventuali altri file verranno riacquisiti alla prossima esecuzione.
+        if changes is not None:
+            save_manifest({"files": {}})
+
+    # Registra nel manifesto i file acquisiti, ora che l'indice è stato salvato.
+    if changes is not None:
+        commit_changes(changes)
+
+    # Pubblica il nuovo indice nel registro condiviso: chat e quiz useranno questa
+    # versione senza doverla ricaricare, e gli altri processi vedranno la nuova generazione.
+    publish_index(vector_index, persist_dir)
+
     # Restituisce l'indice vettoriale.
     return vector_index
@@ -0,0 +1,168 @@
+import os
+import threading
+from llama_index.core import load_index_from_storage
+from llama_index.core.query_engine import RetrieverQueryEngine
+from global_settings import (INDEX_STORAGE, INDEX_GENERATION_FILE, HYBRID_RETRIEVAL,
+                             RETRIEVAL_TOP_K, STORAGE_BACKEND)
+from storage_factory import load_storage_context
+from bm25_index import BM25Index
+from context_compressor import ContextCompressor
+from hybrid_retriever import HybridRetriever
+from namespaces import user_path
+from redis_stores import get_redis_client, redis_key
+from tracing import span
+
+# Questo modulo mantiene, a livello di processo, un registro condiviso degli indici
+# vettoriali e dei relativi motori di query, uno per cartella dell'indice (persist_dir,
+# per impostazione predefinita quella dell'utente corrente, vedi namespaces.py).
+# Streamlit riesegue l'intero script ad ogni interazione dell'utente: senza il registro,
+# chat (conversation_engine.py) e quiz (quiz_builder.py) ricaricherebbero ogni volta
+# l'indice da INDEX_STORAGE, rileggendo e decodificando tutti i file JSON.
+# L'indice viene invece caricato una sola volta per processo e condiviso fra tutte le
+# esecuzioni e tutti i thread; viene ricaricato solo quando index_builder.build_index
+# salva una nuova versione, segnalata da un contatore di generazione su file
+# (INDEX_GENERATION_FILE, all'interno della cartella dell'indice). Con STORAGE_BACKEND =
+# "redis" il contatore è una chiave Redis, così anche i processi su altre macchine si
+# accorgono degli aggiornamenti, e li rileggono da Redis insieme all'indice BM25.
+
+# Il lock protegge i dizionari seguenti da accessi concorrenti (Streamlit serve ogni
+# sessione utente in un thread separato).
+_lock = threading.RLock()
+# persist_dir -> (generazione, indice vettoriale)
+_indexes = {}
+# (persist_dir, parametri del motore) -> (generazione, motore di query)
+_query_engines = {}
+# persist_dir -> (generazione, indice BM25)
+_bm25_indexes = {}
+
+
+def _generation_path(persist_dir):
+    return os.path.join(persist_dir, INDEX_GENERATION_FILE)
+
+
+# Restituisce la generazione corrente dell'indice salvato in persist_dir.
+# La lettura di un piccolo file di testo è trascurabile rispetto al caricamento dell'indice,
+# e permette di accorgersi anche degli aggiornamenti effettuati da altri processi.
+def read_generation(persist_dir=None):
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    if STORAGE_BACKEND == "redis":
+        return int(get_redis_client().get(redis_key(_generation_path(persist_dir))) or 0)
+    try:
+        with open(_generation_path(persist_dir), "r") as file:
+            return int(file.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+# Incrementa il contatore di generazione. La scrittura avviene su un file temporaneo
+# seguito da os.replace, in modo che i lettori non vedano mai un file parziale.
+def bump_generation(persist_dir=None):
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    if STORAGE_BACKEND == "redis":
+        return get_redis_client().incr(redis_key(_generation_path(persist_dir)))
+    generation = read_generation(persist_dir) + 1
+    path = _generation_path(persist_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(str(generation))
+    os.replace(tmp_path, path)
+    return generation
+
+
+# Restituisce l'indice vettoriale "vector" salvato in persist_dir, caricandolo dallo
+# storage solo se non è già presente nel registro o se nel frattempo è cambiata la generazione.
+def get_vector_index(persist_dir=None):
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    generation = read_generation(persist_dir)
+    with _lock:
+        cached = _indexes.get(persist_dir)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+
+        print(f"### get_vector_index() -> carico l'indice (generazione {generation})")
+        storage_context = load_storage_context(persist_dir)
+        with span("load_index_from_storage", persist_dir=persist_dir,
+                  generation=generation):
+            vector_index = load_index_from_storage(
+                storage_context, index_id="vector"
+            )
+        _store(persist_dir, generation, vector_index)
+        return vector_index
+
+
+# Restituisce l'indice per parole chiave (BM25) salvato accanto all'indice vettoriale,
+# con la stessa politica di caricamento e invalidazione.
+def get_bm25_index(persist_dir=None):
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    generation = read_generation(persist_dir)
+    with _lock:
+        cached = _bm25_indexes.get(persist_dir)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        bm25_index = BM25Index.load(persist_dir)
+        _bm25_indexes[persist_dir] = (generation, bm25_index)
+        return bm25_index
+
+
+# Restituisce un motore di query condiviso, costruito sull'indice del registro.
+# I parametri (ad esempio similarity_top_k) sono passati a as_query_engine e fanno
+# parte della chiave: chat e quiz possono quindi usare configurazioni diverse.
+# Con HYBRID_RETRIEVAL il motore usa il retriever ibrido (hybrid_retriever.py), che
+# fonde la ricerca vettoriale con quella per parole chiave dell'indice BM25.
+# Con compress_context=True i nodi recuperati vengono ridotti alle frasi pertinenti alla
+# domanda, entro un budget di token (context_compressor.py).
+def get_query_engine(persist_dir=None, compress_context=False, **kwargs):
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    vector_index = get_vector_index(persist_dir)
+    key = (persist_dir, compress_context, tuple(sorted(kwargs.items())))
+    with _lock:
+        generation = _indexes[persist_dir][0]
+        cached = _query_engines.get(key)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        if compress_context:
+            kwargs["node_postprocessors"] = [ContextCompressor()]
+        if HYBRID_RETRIEVAL:
+            retriever = HybridRetriever(
+                vector_index, get_bm25_index(persist_dir),
+                similarity_top_k=kwargs.pop("similarity_top_k", RETRIEVAL_TOP_K)
+            )
+            query_engine = RetrieverQueryEngine.from_args(retriever, **kwargs)
+        else:
+            query_engine = vector_index.as_query_engine(**kwargs)
+        _query_engines[key] = (generation, query_engine)
+        return query_engine
+
+
+# Pubblica un indice appena salvato da index_builder.build_index: incrementa la
+# generazione (così gli altri processi lo ricaricheranno) e lo inserisce direttamente
+# nel registro, evitando di rileggerlo dallo storage in questo processo.
+def publish_index(vector_index, persist_dir=None):
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    with _lock:
+        generation = bump_generation(persist_dir)
+        _store(persist_dir, generation, vector_index)
+    return generation
+
+
+# Svuota il registro (per una cartella o per intero), forzando il ricaricamento.
+def invalidate(persist_dir=None):
+    with _lock:
+        if persist_dir is None:
+            _indexes.clear()
+            _query_engines.clear()
+            _bm25_indexes.clear()
+            return
+        _indexes.pop(persist_dir, None)
+        _bm25_indexes.pop(persist_dir, None)
+        _drop_query_engines(persist_dir)
+
+
+def _store(persist_dir, generation, vector_index):
+    _indexes[persist_dir] = (generation, vector_index)
+    _drop_query_engines(persist_dir)
+
+
+def _drop_query_engines(persist_dir):
+    for key in [key for key in _query_engines if key[0] == persist_dir]:
+        del _query_engines[key]
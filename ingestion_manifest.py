@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+from global_settings import STORAGE_PATH, INDEX_STORAGE, MANIFEST_FILE
+from namespaces import user_path, namespace_lock
+
+# Questo modulo gestisce il manifesto dell'acquisizione: un file JSON, salvato in
+# STORAGE_PATH, che registra per ciascun file acquisito l'hash del contenuto e gli
+# identificativi dei documenti (ref_doc_id) che ne sono stati ricavati e inseriti nell'indice.
+#
+# Confrontando gli hash attuali con quelli del manifesto, document_uploader.ingest_documents
+# elabora solo i file nuovi o modificati, e index_builder.build_index può sostituire nell'indice
+# i documenti modificati ed eliminare quelli dei file rimossi, invece di accodare duplicati.
+#
+# Struttura del manifesto:
+# {"files": {"nome_file.pdf": {"hash": "...", "doc_ids": ["...", ...], "merged_into": [...]}}}
+# merged_into elenca i file nei cui nodi sono confluiti i nodi quasi identici di questo file
+# (chunk_dedup.py): quando uno di essi cambia o viene rimosso, anche questo file viene
+# riacquisito, perché il suo contenuto nell'indice dipendeva da quei nodi.
+#
+# Il nome del file inizia con un punto: SimpleDirectoryReader ignora i file nascosti,
+# quindi il manifesto non viene mai acquisito come materiale di studio.
+# Cartelle e manifesto sono quelli dello spazio dell'utente corrente (namespaces.py).
+
+
+# Calcola l'hash SHA-256 del contenuto di un file, leggendolo a blocchi.
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest():
+    try:
+        with open(user_path(MANIFEST_FILE), "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"files": {}}
+
+
+def save_manifest(manifest):
+    manifest_file = user_path(MANIFEST_FILE)
+    tmp_path = f"{manifest_file}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, manifest_file)
+
+
+# storage_factory carica llama_index: viene importato solo quando serve, per non rallentare
+# l'avvio dell'applicazione (user_onboarding importa questo modulo).
+def _index_exists():
+    from storage_factory import index_exists
+    return index_exists(user_path(INDEX_STORAGE))
+
+
+# Confronta i file presenti in STORAGE_PATH con il manifesto e restituisce un dizionario con:
+# - hashes: l'hash attuale di ciascun file
+# - changed: i nomi dei file nuovi o modificati, da (ri)acquisire
+# - removed: i nomi dei file presenti nel manifesto ma non più nella cartella
+# - stale_doc_ids: i ref_doc_id da eliminare dall'indice (file modificati o rimossi)
+# - doc_ids: i ref_doc_id dei file acquisiti, compilato da ingest_documents
+# - merged_into e duplicates_removed: i duplicati eliminati, compilati da ingest_documents
+# Se l'indice non esiste ancora (ad esempio dopo aver svuotato INDEX_STORAGE) il manifesto
+# viene ignorato e tutti i file vengono considerati nuovi.
+def detect_changes():
+    print("### detect_changes()")
+    manifest = load_manifest() if _index_exists() else {"files": {}}
+    known_files = manifest["files"]
+
+    hashes = {}
+    storage_path = user_path(STORAGE_PATH)
+    for filename in sorted(os.listdir(storage_path)):
+        file_path = os.path.join(storage_path, filename)
+        if filename.startswith(".") or not os.path.isfile(file_path):
+            continue
+        hashes[filename] = file_hash(file_path)
+
+    changed = [filename for filename, digest in hashes.items()
+               if known_files.get(filename, {}).get("hash") != digest]
+    removed = [filename for filename in known_files if filename not in hashes]
+    # Riacquisisce anche i file i cui duplicati sono confluiti in file modificati o rimossi
+    # (ripetendo finché non se ne aggiungono altri).
+    updated = set(changed + removed)
+    while True:
+        dependent = [filename for filename in hashes if filename not in updated
+                     and updated & set(known_files.get(filename, {}).get("merged_into", []))]
+        if not dependent:
+            break
+        changed.extend(dependent)
+        updated.update(dependent)
+    changed.sort()
+
+    stale_doc_ids = []
+    for filename in changed + removed:
+        stale_doc_ids.extend(known_files.get(filename, {}).get("doc_ids", []))
+
+    return {
+        "hashes": hashes,
+        "changed": changed,
+        "removed": removed,
+        "stale_doc_ids": stale_doc_ids,
+        "doc_ids": {},
+        "merged_into": {},
+        "duplicates_removed": 0,
+    }
+
+
+# Lock su file che comprende un intero aggiornamento dei materiali, da detect_changes
+# (in document_uploader.ingest_documents) a commit_changes (in index_builder.build_index):
+# due sessioni dello stesso utente non possono acquisire due volte le stesse modifiche.
+# Da usare con "with"; è distinto dal lock dell'indice preso da build_index.
+def ingestion_lock():
+    return namespace_lock(user_path(STORAGE_PATH))
+
+
+# Restituisce True se ci sono file da acquisire o documenti da eliminare dall'indice.
+def has_changes(changes):
+    return bool(changes["changed"] or changes["removed"])
+
+
+# Aggiorna il manifesto dopo che l'indice è stato salvato: da questo momento i file
+# elaborati risultano acquisiti e non verranno più rielaborati finché non cambiano.
+def commit_changes(changes):
+    print("### commit_changes()")
+    manifest = load_manifest() if _index_exists() else {"files": {}}
+    files = manifest["files"]
+    for filename in changes["removed"]:
+        files.pop(filename, None)
+    for filename in changes["changed"]:
+        files[filename] = {
+            "hash": changes["hashes"][filename],
+            "doc_ids": changes["doc_ids"].get(filename, []),
+            "merged_into": changes.get("merged_into", {}).get(filename, []),
+        }
+    save_manifest(manifest)
@@ -0,0 +1,156 @@
+import os
+import uuid
+from typing import Any, List, Sequence
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from global_settings import IVF_NPROBE, IVF_MIN_TRAIN_SIZE, IVF_TRAIN_ITERATIONS
+from mmap_vector_store import MmapVectorStore, IVF_PREFIX
+
+# Questo modulo implementa un indice approssimato dei vicini più prossimi (ANN) di tipo IVF
+# (Inverted File), per archivi con molti nodi: intere biblioteche di corsi invece di
+# qualche favola.
+#
+# Con la ricerca esatta (MmapVectorStore) ogni interrogazione confronta la domanda con tutti
+# gli embedding, e la latenza cresce linearmente con il numero di nodi. L'indice IVF
+# raggruppa gli embedding in nlist gruppi (circa la radice quadrata del numero di nodi)
+# con un k-means sferico; ad ogni interrogazione vengono esaminati solo i nodi dei nprobe
+# gruppi con il centroide più simile alla domanda.
+# nprobe (IVF_NPROBE) regola il compromesso fra qualità (recall) e latenza: con nprobe
+# uguale al numero di gruppi la ricerca torna ad essere esatta.
+#
+# Sotto IVF_MIN_TRAIN_SIZE nodi l'indice non viene addestrato e la ricerca resta esatta.
+# I nodi inseriti da index_builder.build_index vengono assegnati al gruppo più vicino;
+# quando il numero di nodi raddoppia rispetto all'ultimo addestramento i centroidi
+# vengono ricalcolati. Le ricerche con filtri sui metadati o su node_ids sono sempre esatte.
+
+# Numero di righe elaborate alla volta durante l'assegnazione ai gruppi (limita la memoria).
+_ASSIGN_CHUNK = 65536
+
+
+class IVFVectorStore(MmapVectorStore):
+    nprobe: int = IVF_NPROBE
+
+    _centroids: Any = PrivateAttr(default=None)
+    _assignments: Any = PrivateAttr(default=None)
+    _trained_size: int = PrivateAttr(default=0)
+    # Liste invertite: righe ordinate per gruppo e posizione iniziale di ciascun gruppo.
+    _order: Any = PrivateAttr(default=None)
+    _offsets: Any = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "IVFVectorStore"
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        ids = super().add(nodes, **add_kwargs)
+        if self._centroids is None:
+            if len(self._ids) >= IVF_MIN_TRAIN_SIZE:
+                self.train()
+        elif len(self._ids) > 2 * self._trained_size:
+            self.train()
+        else:
+            new_rows = self._embeddings[len(self._assignments):]
+            self._assignments = np.concatenate(
+                [self._assignments, self._assign(new_rows)])
+            self._order = None
+        return ids
+
+    def _keep_rows(self, keep):
+        super()._keep_rows(keep)
+        if self._assignments is not None:
+            self._assignments = self._assignments[keep]
+            self._order = None
+
+    # Addestra i centroidi con un k-means sferico (gli embedding sono normalizzati, quindi la
+    # vicinanza è il prodotto scalare) su un campione degli embedding, poi assegna tutti i nodi.
+    def train(self, nlist=None, seed=0):
+        count = len(self._ids)
+        nlist = nlist or max(1, int(np.sqrt(count)))
+        print(f"### IVFVectorStore.train({count} nodi, {nlist} gruppi)")
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(count, min(count, nlist * 64), replace=False))
+        sample = np.asarray(self._embeddings[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            # I gruppi rimasti vuoti mantengono il centroide precedente.
+            filled = counts > 0
+            centroids[filled] = sums[filled]
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms == 0, 1, norms)
+
+        self._centroids = centroids
+        self._assignments = self._assign(self._embeddings)
+        self._trained_size = count
+        self._order = None
+
+    def _assign(self, vectors):
+        return np.concatenate([
+            np.argmax(np.asarray(vectors[i:i + _ASSIGN_CHUNK]) @ self._centroids.T, axis=1)
+            for i in range(0, len(vectors), _ASSIGN_CHUNK)
+        ] or [np.zeros(0, dtype=np.int64)]).astype(np.int32)
+
+    def _inverted_lists(self):
+        if self._order is None:
+            self._order = np.argsort(self._assignments, kind="stable")
+            counts = np.bincount(self._assignments, minlength=len(self._centroids))
+            self._offsets = np.concatenate([[0], np.cumsum(counts)])
+        return self._order, self._offsets
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if (self._centroids is None or query.node_ids is not None
+                or query.filters is not None
+                or query.mode != VectorStoreQueryMode.DEFAULT):
+            return super().query(query, **kwargs)
+
+        query_embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        query_embedding /= np.linalg.norm(query_embedding) or 1.0
+
+        # Seleziona i nprobe gruppi più vicini alla domanda ed esamina solo i loro nodi.
+        centroid_scores = self._centroids @ query_embedding
+        nprobe = min(self.nprobe, len(self._centroids))
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        order, offsets = self._inverted_lists()
+        candidates = np.concatenate(
+            [order[offsets[probe]:offsets[probe + 1]] for probe in probes])
+        if len(candidates) == 0:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        candidates.sort()
+
+        scores = self._embeddings[candidates] @ query_embedding
+        top_k = min(query.similarity_top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return VectorStoreQueryResult(
+            similarities=scores[top].tolist(),
+            ids=[self._ids[row] for row in candidates[top]],
+        )
+
+    def _persist_extra(self, persist_dir):
+        if self._centroids is None:
+            return {}
+        ivf_file = f"{IVF_PREFIX}{uuid.uuid4().hex}.npz"
+        np.savez(os.path.join(persist_dir, ivf_file),
+                 centroids=self._centroids, assignments=self._assignments)
+        return {"ivf_file": ivf_file, "ivf_trained_size": self._trained_size}
+
+    def _load_extra(self, persist_dir, data):
+        if "ivf_file" not in data:
+            # Archivio salvato senza indice IVF (ad esempio da MmapVectorStore).
+            if len(self._ids) >= IVF_MIN_TRAIN_SIZE:
+                self.train()
+            return
+        with np.load(os.path.join(persist_dir, data["ivf_file"])) as ivf:
+            self._centroids = ivf["centroids"]
+            self._assignments = ivf["assignments"]
+        self._trained_size = data["ivf_trained_size"]
@@ -0,0 +1,261 @@
+import json
+import os
+import threading
+from typing import Any, List, Optional
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import ChatMessage
+from llama_index.core.storage.chat_store import SimpleChatStore
+from global_settings import CHAT_FSYNC_EVERY, CHAT_COMPACT_MIN_RECORDS, CHAT_COMPACT_RATIO
+from namespaces import namespace_lock
+
+# Questo modulo implementa un archivio della chat basato su un registro in sola aggiunta
+# (JSONL: un record JSON per riga), da usare al posto di SimpleChatStore.
+#
+# SimpleChatStore.persist riscrive ad ogni turno l'intera conversazione su un unico file
+# JSON: nelle sessioni di studio lunghe ogni turno diventa sempre più lento.
+# JsonlChatStore accoda invece al file solo le operazioni eseguite (messaggio aggiunto,
+# messaggi sostituiti o eliminati), e la conversazione viene ricostruita rileggendole al
+# caricamento. La scrittura su disco (fsync) avviene ogni CHAT_FSYNC_EVERY record e ad
+# ogni chiamata di persist; quando i record superano di CHAT_COMPACT_RATIO volte i messaggi
+# effettivi, il registro viene compattato riscrivendo un solo record per chiave.
+#
+# Un'interruzione durante la scrittura può lasciare incompleta l'ultima riga del registro:
+# al caricamento la riga viene eliminata dal file (che viene troncato all'ultimo record
+# completo), così i record accodati in seguito restano leggibili. I record non validi
+# vengono saltati, senza interrompere la lettura di quelli successivi.
+#
+# Più sessioni dello stesso utente (ad esempio due schede del browser) possono scrivere sullo
+# stesso registro: ogni record viene accodato sotto un lock su file (namespaces.py), e la
+# compattazione riparte dal contenuto del file, non dalla sola conversazione in memoria.
+#
+# La classe eredita da SimpleChatStore, quindi resta compatibile con
+# ChatMemoryBuffer e RollingSummaryMemory (chat_store=..., chat_store_key="0").
+
+
+def _dump_message(message):
+    return message.model_dump(mode="json")
+
+
+def _load_message(data):
+    return ChatMessage.model_validate(data)
+
+
+class JsonlChatStore(SimpleChatStore):
+    persist_path: Optional[str] = None
+
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+    _file: Any = PrivateAttr(default=None)
+    _records: int = PrivateAttr(default=0)
+    _unsynced: int = PrivateAttr(default=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "JsonlChatStore"
+
+    # Carica la conversazione rileggendo le operazioni registrate nel file.
+    # Se il file non esiste ma esiste l'archivio JSON della versione precedente
+    # (legacy_path), la conversazione viene importata da quest'ultimo.
+    @classmethod
+    def from_persist_path(cls, persist_path, legacy_path=None):
+        print("### JsonlChatStore.from_persist_path()")
+        chat_store = cls(persist_path=persist_path)
+        if not os.path.exists(persist_path) and legacy_path and os.path.exists(legacy_path):
+            chat_store._migrate(legacy_path)
+            return chat_store
+        try:
+            complete = chat_store._replay_file()
+        except FileNotFoundError:
+            return chat_store
+        if complete < os.path.getsize(persist_path):
+            # Riga troncata (interruzione durante la scrittura): può essere solo l'ultima,
+            # e viene eliminata prima di accodare altri record.
+            print("### JsonlChatStore -> ultima riga del registro incompleta, eliminata")
+            chat_store._truncate(complete)
+        return chat_store
+
+    # Ricostruisce la conversazione rileggendo il registro e restituisce la lunghezza della
+    # parte del file formata da righe complete (un'ultima riga incompleta viene ignorata).
+    def _replay_file(self):
+        offset = 0
+        with open(self.persist_path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                if line.strip():
+                    self._replay_line(line)
+        return offset
+
+    def _replay_line(self, line):
+        try:
+            self._replay(json.loads(line))
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"### JsonlChatStore -> record non valido ignorato: {e}")
+            return
+        self._records += 1
+
+    # Tronca il registro alla lunghezza size, se nel frattempo un'altra sessione dello stesso
+    # utente non lo ha già riscritto.
+    def _truncate(self, size):
+        with namespace_lock(self.persist_path):
+            with open(self.persist_path, "rb+") as file:
+                file.seek(0, os.SEEK_END)
+                end = file.tell()
+                if end > size:
+                    file.seek(size)
+                    if not file.read().endswith(b"\n"):
+                        file.truncate(size)
+
+    def _migrate(self, legacy_path):
+        print(f"### JsonlChatStore -> importo la conversazione da {legacy_path}")
+        legacy_store = SimpleChatStore.from_persist_path(legacy_path)
+        self.store = {key: list(messages) for key, messages in legacy_store.store.items()}
+        self.compact()
+        os.replace(legacy_path, f"{legacy_path}.migrated")
+
+    def _replay(self, record):
+        op, key = record["op"], record["key"]
+        if op == "add":
+            SimpleChatStore.add_message(self, key, _load_message(record["message"]),
+                                        record.get("idx"))
+        elif op == "set":
+            self.store[key] = [_load_message(data) for data in record["messages"]]
+        elif op == "delete":
+            self.store.pop(key, None)
+        elif op == "delete_idx":
+            SimpleChatStore.delete_message(self, key, record["idx"])
+        elif op == "delete_last":
+            SimpleChatStore.delete_last_message(self, key)
+
+    # Accoda un record al registro. Il file viene aperto alla prima scrittura e
+    # mantenuto aperto; fsync viene eseguito ogni CHAT_FSYNC_EVERY record.
+    # La scrittura avviene sotto il lock su file del registro: se nel frattempo un'altra
+    # sessione dello stesso utente lo ha compattato (sostituendo il file con os.replace),
+    # il file viene riaperto, invece di continuare a scrivere su quello eliminato.
+    def _append(self, record):
+        if self.persist_path is None:
+            return
+        with self._lock, namespace_lock(self.persist_path):
+            if self._file is not None and not self._is_current_file():
+                self._file.close()
+                self._file = None
+                self._unsynced = 0
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok=True)
+                self._file = open(self.persist_path, "a")
+                # Non accoda mai un record dopo una riga incompleta (scritta, ad esempio, da
+                # un'altra sessione interrotta): la riga incompleta resta isolata e viene
+                # saltata al caricamento.
+                if self._file.tell() > 0 and not self._ends_with_newline():
+                    self._file.write("\n")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self._records += 1
+            self._unsynced += 1
+            if self._unsynced >= CHAT_FSYNC_EVERY:
+                self._sync()
+
+    # Restituisce True se il file aperto è ancora quello che si trova in persist_path.
+    def _is_current_file(self):
+        try:
+            path_stat = os.stat(self.persist_path)
+        except FileNotFoundError:
+            return False
+        file_stat = os.fstat(self._file.fileno())
+        return (path_stat.st_dev, path_stat.st_ino) == (file_stat.st_dev, file_stat.st_ino)
+
+    def _ends_with_newline(self):
+        with open(self.persist_path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    # Le operazioni sulla conversazione modificano self.store e accodano il record sotto lo
+    # stesso lock di compact: il riassunto della chat (rolling_memory.py) viene scritto da un
+    # thread in background, mentre la richiesta corrente aggiunge messaggi o compatta il registro.
+    def set_messages(self, key: str, messages: List[ChatMessage]) -> None:
+        with self._lock:
+            super().set_messages(key, messages)
+            self._append({"op": "set", "key": key,
+                          "messages": [_dump_message(message) for message in messages]})
+
+    def add_message(self, key: str, message: ChatMessage,
+                    idx: Optional[int] = None) -> None:
+        record = {"op": "add", "key": key, "message": _dump_message(message)}
+        if idx is not None:
+            record["idx"] = idx
+        with self._lock:
+            super().add_message(key, message, idx)
+            self._append(record)
+
+    def delete_messages(self, key: str) -> Optional[List[ChatMessage]]:
+        with self._lock:
+            messages = super().delete_messages(key)
+            if messages is not None:
+                self._append({"op": "delete", "key": key})
+            return messages
+
+    def delete_message(self, key: str, idx: int) -> Optional[ChatMessage]:
+        with self._lock:
+            message = super().delete_message(key, idx)
+            if message is not None:
+                self._append({"op": "delete_idx", "key": key, "idx": idx})
+            return message
+
+    def delete_last_message(self, key: str) -> Optional[ChatMessage]:
+        with self._lock:
+            message = super().delete_last_message(key)
+            if message is not None:
+                self._append({"op": "delete_last", "key": key})
+            return message
+
+    # Restituisce una pagina di messaggi contando dalla fine della conversazione:
+    # page=0 sono gli ultimi page_size messaggi, page=1 i page_size precedenti, e così via.
+    # La conversazione è comunque interamente in memoria (viene ricostruita al caricamento):
+    # la paginazione limita solo i messaggi mostrati nella chat.
+    def get_messages_page(self, key, page=0, page_size=20):
+        messages = self.get_messages(key)
+        end = max(len(messages) - page * page_size, 0)
+        return messages[max(end - page_size, 0):end]
+
+    # Riscrive il registro con un solo record "set" per chiave (file temporaneo + os.replace).
+    # Il lock su file impedisce che due sessioni dello stesso utente compattino insieme, o che
+    # una accodi record mentre l'altra compatta. Prima di riscriverlo, la conversazione viene
+    # ricostruita dal registro: contiene anche i record accodati dalle altre sessioni.
+    def compact(self):
+        print("### JsonlChatStore.compact()")
+        with self._lock, namespace_lock(self.persist_path):
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.persist_path):
+                self.store = {}
+                self._replay_file()
+            os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok=True)
+            tmp_path = f"{self.persist_path}.tmp"
+            with open(tmp_path, "w") as file:
+                for key, messages in self.store.items():
+                    file.write(json.dumps({
+                        "op": "set", "key": key,
+                        "messages": [_dump_message(message) for message in messages],
+                    }, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.persist_path)
+            self._records = len(self.store)
+            self._unsynced = 0
+
+    # Rende durevoli i record accodati e, se il registro è cresciuto troppo rispetto
+    # alla conversazione, lo compatta. Il parametro persist_path è accettato per
+    # compatibilità con SimpleChatStore.persist, ma il file resta quello del registro.
+    def persist(self, persist_path: Optional[str] = None, fs: Any = None) -> None:
+        with self._lock:
+            self._sync()
+            messages = sum(len(messages) for messages in self.store.values())
+            if (self._records >= CHAT_COMPACT_MIN_RECORDS
+                    and self._records > CHAT_COMPACT_RATIO * max(messages, 1)):
+                self.compact()
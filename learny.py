@@ -1,6 +1,5 @@
-from user_onboarding import user_onboarding
 from session_functions import load_session, delete_session
-from training_UI import show_training_UI
+from namespaces import resolve_namespace
 import streamlit as st
 import os
 from dotenv import load_dotenv
@@ -9,6 +8,20 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+# I moduli dell'onboarding (acquisizione, indice, sommario) e dell'allenamento (agent, quiz)
+# caricano llama_index, OpenAI, pandas e fpdf, e richiedono alcuni secondi: vengono quindi
+# importati solo quando servono, all'interno di main(), e non per mostrare la pagina di
+# benvenuto. Python li conserva in sys.modules, per cui le esecuzioni successive dello script
+# non li ricaricano. Il tempo di avvio è verificato da startup_benchmark.py.
+
+# Legge l'immagine del logo una sola volta per processo, invece che ad ogni esecuzione dello script.
+@st.cache_resource
+def load_logo():
+    print("### load_logo()")
+    with open("Learny.png", "rb") as image_file:
+        return image_file.read()
+
+
 # Questo codice è responsabile della gestione dell'esecuzione dei vari componenti
 # che compongono l'applicazione. Funziona come hub centrale, instradando i nuovi
 # utenti verso il processo di onboarding, e gestendo la presentazione di quiz e
@@ -16,12 +29,12 @@ load_dotenv()
 def main():
     print("\n### main()")
     st.set_page_config(layout="wide")
+    # Sceglie lo spazio dei dati dell'utente (namespaces.py) prima di qualsiasi accesso
+    # a sessione, materiali, indice, chat e quiz.
+    resolve_namespace()
 
-    # Carica l'immagine dal file
-    with open("Learny.png", "rb") as image_file:
-        icona = image_file.read()
-        # Aggiunge l'icona alla barra laterale
-        st.sidebar.image(icona, width=260)
+    # Aggiunge l'icona alla barra laterale
+    st.sidebar.image(load_logo(), width=260)
 
     st.sidebar.title('Learny')
     st.sidebar.markdown(
@@ -36,12 +49,14 @@ def main():
 
     # Lo studente ha già indicato l'argomento di studio, caricato i materiali, e scelto di fare un quiz
     if 'show_quiz' in st.session_state and st.session_state['show_quiz']:
+        from training_UI import show_training_UI
         show_training_UI(
             st.session_state['user_name'], st.session_state['study_subject'])
     elif not load_session(st.session_state):
         # Lo studente si presenta per la prima volta all'applicazione:
         # viene mostrata la schermata per l'inserimento del nome, la
         # scelta dell'argomento e il caricamento dei materiali di studio
+        from user_onboarding import user_onboarding
         user_onboarding()
     else:
         # Per studenti che si sono già presentati all'applicazione, mostra le opzioni
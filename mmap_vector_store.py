@@ -0,0 +1,293 @@
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Any, List, Optional, Sequence
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import SimpleVectorStore, _build_metadata_filter_fn
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+# Questo modulo implementa un archivio vettoriale (vector store) binario, alternativo al
+# SimpleVectorStore predefinito di Llamaindex.
+#
+# SimpleVectorStore salva gli embedding in un file JSON (default__vector_store.json) come
+# liste di numeri: ad ogni caricamento il file deve essere interamente decodificato, e ad
+# ogni interrogazione la somiglianza viene calcolata nodo per nodo in Python.
+# MmapVectorStore salva invece gli embedding in una matrice float32 (file .npy), già
+# normalizzata, che viene aperta con il memory mapping del sistema operativo: il caricamento
+# richiede pochi millisecondi e le pagine vengono lette dal disco solo quando servono.
+# La ricerca dei top-k risultati è un unico prodotto matrice-vettore di NumPy seguito da
+# np.argpartition.
+#
+# File salvati nella cartella dell'indice:
+# - vector_embeddings-<versione>.npy: la matrice degli embedding (una riga per nodo);
+# - vector_ids.json: id dei nodi, ref_doc_id, metadati e nome del file .npy corrente.
+# Ogni salvataggio scrive un nuovo file .npy e aggiorna per ultimo vector_ids.json: i processi
+# che hanno ancora aperta la versione precedente continuano a leggerla senza errori. Per questo
+# la versione precedente viene eliminata solo al salvataggio successivo.
+#
+# Un indice salvato con il SimpleVectorStore (default__vector_store.json) non viene convertito
+# automaticamente: continua ad essere caricato nel formato JSON (storage_factory.py) finché
+# non viene migrato esplicitamente con:
+#     python mmap_vector_store.py <cartella dell'indice> --migrate
+
+IDS_FNAME = "vector_ids.json"
+EMBEDDINGS_PREFIX = "vector_embeddings-"
+IVF_PREFIX = "vector_ivf-"
+# Prefissi dei file salvati con un nome diverso ad ogni versione.
+VERSIONED_PREFIXES = (EMBEDDINGS_PREFIX, IVF_PREFIX)
+SIMPLE_VECTOR_STORE_FNAME = "default__vector_store.json"
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    stores_text: bool = False
+
+    _embeddings: np.ndarray = PrivateAttr()
+    _ids: List[str] = PrivateAttr()
+    _ref_doc_ids: List[str] = PrivateAttr()
+    _metadata: dict = PrivateAttr()
+    _rows: dict = PrivateAttr()
+
+    def __init__(self, embeddings=None, ids=None, ref_doc_ids=None, metadata=None,
+                 **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._embeddings = embeddings if embeddings is not None else np.zeros(
+            (0, 0), dtype=np.float32)
+        self._ids = list(ids or [])
+        self._ref_doc_ids = list(ref_doc_ids or [])
+        self._metadata = dict(metadata or {})
+        self._rows = {node_id: row for row, node_id in enumerate(self._ids)}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    # Carica l'archivio dalla cartella dell'indice. Un indice ancora nel formato del
+    # SimpleVectorStore deve essere prima migrato (migrate_from_simple).
+    @classmethod
+    def from_persist_dir(cls, persist_dir):
+        ids_path = os.path.join(persist_dir, IDS_FNAME)
+        if not os.path.exists(ids_path):
+            if is_simple_format(persist_dir):
+                raise ValueError(f"L'indice in {persist_dir} è nel formato del SimpleVectorStore: "
+                                 f"eseguire python mmap_vector_store.py {persist_dir} --migrate")
+            return cls()
+
+        with open(ids_path, "r") as file:
+            data = json.load(file)
+        embeddings = np.load(os.path.join(persist_dir, data["embeddings_file"]),
+                             mmap_mode="r")
+        vector_store = cls(embeddings, data["ids"], data["ref_doc_ids"], data["metadata"])
+        vector_store._load_extra(persist_dir, data)
+        return vector_store
+
+    # Punti di estensione per le sottoclassi (ad esempio IVFVectorStore), che salvano
+    # strutture aggiuntive accanto agli embedding: _persist_extra scrive i propri file e
+    # restituisce le voci da aggiungere a vector_ids.json, _load_extra le rilegge.
+    def _persist_extra(self, persist_dir):
+        return {}
+
+    def _load_extra(self, persist_dir, data):
+        pass
+
+    def get(self, text_id: str) -> List[float]:
+        return self._embeddings[self._rows[text_id]].tolist()
+
+    # Aggiunge (o sostituisce, se l'id è già presente) gli embedding dei nodi.
+    # Gli embedding vengono normalizzati una volta sola, in fase di inserimento.
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        vectors = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        replaced = [node.node_id for node in nodes if node.node_id in self._rows]
+        if replaced:
+            self.delete_nodes(node_ids=replaced)
+
+        if self._embeddings.size == 0:
+            self._embeddings = vectors
+        else:
+            self._embeddings = np.vstack([self._embeddings, vectors])
+        for node in nodes:
+            self._rows[node.node_id] = len(self._ids)
+            self._ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id or "None")
+            metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+            metadata.pop("_node_content", None)
+            self._metadata[node.node_id] = metadata
+        return [node.node_id for node in nodes]
+
+    def _keep_rows(self, keep):
+        self._embeddings = np.ascontiguousarray(self._embeddings[keep])
+        removed = [node_id for node_id, kept in zip(self._ids, keep) if not kept]
+        self._ids = [node_id for node_id, kept in zip(self._ids, keep) if kept]
+        self._ref_doc_ids = [ref for ref, kept in zip(self._ref_doc_ids, keep) if kept]
+        for node_id in removed:
+            self._metadata.pop(node_id, None)
+        self._rows = {node_id: row for row, node_id in enumerate(self._ids)}
+
+    # Elimina tutti i nodi di un documento (ref_doc_id).
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        keep = np.array([ref != ref_doc_id for ref in self._ref_doc_ids], dtype=bool)
+        if not keep.all():
+            self._keep_rows(keep)
+
+    def delete_nodes(self, node_ids=None, filters=None, **delete_kwargs: Any) -> None:
+        delete = self._select(node_ids, filters)
+        if delete.any():
+            self._keep_rows(~delete)
+
+    def clear(self) -> None:
+        self._keep_rows(np.zeros(len(self._ids), dtype=bool))
+
+    # Restituisce una maschera booleana delle righe che soddisfano node_ids e filters.
+    def _select(self, node_ids, filters):
+        mask = np.ones(len(self._ids), dtype=bool)
+        if node_ids is not None:
+            wanted = set(node_ids)
+            mask &= np.array([node_id in wanted for node_id in self._ids], dtype=bool)
+        if filters is not None:
+            filter_fn = _build_metadata_filter_fn(
+                lambda node_id: self._metadata[node_id], filters)
+            mask &= np.array([filter_fn(node_id) for node_id in self._ids], dtype=bool)
+        return mask
+
+    # Ricerca per somiglianza del coseno: gli embedding sono già normalizzati, quindi basta
+    # un prodotto matrice-vettore; np.argpartition seleziona i top-k in tempo lineare e
+    # solo questi k valori vengono poi ordinati.
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Modalità di ricerca non supportata: {query.mode}")
+        if not self._ids:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        query_embedding /= np.linalg.norm(query_embedding) or 1.0
+        scores = self._embeddings @ query_embedding
+
+        if query.node_ids is not None or query.filters is not None:
+            candidates = np.flatnonzero(self._select(query.node_ids, query.filters))
+            scores = scores[candidates]
+        else:
+            candidates = None
+
+        top_k = min(query.similarity_top_k, len(scores))
+        if top_k == 0:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return VectorStoreQueryResult(
+            similarities=scores[top].tolist(),
+            ids=[self._ids[row] for row in rows],
+        )
+
+    # Salva l'archivio nella cartella di persist_path. Il nome del file viene ignorato:
+    # StorageContext.persist passa il percorso del file JSON del SimpleVectorStore.
+    def persist(self, persist_path: str, fs: Optional[Any] = None) -> None:
+        persist_dir = os.path.dirname(persist_path)
+        os.makedirs(persist_dir, exist_ok=True)
+
+        # File della versione attualmente salvata: non vengono eliminati in questo salvataggio.
+        ids_path = os.path.join(persist_dir, IDS_FNAME)
+        previous_files = set()
+        if os.path.exists(ids_path):
+            with open(ids_path, "r") as file:
+                previous_files = _versioned_files(json.load(file))
+
+        embeddings_file = f"{EMBEDDINGS_PREFIX}{uuid.uuid4().hex}.npy"
+        np.save(os.path.join(persist_dir, embeddings_file),
+                np.ascontiguousarray(self._embeddings, dtype=np.float32))
+
+        extra = self._persist_extra(persist_dir)
+
+        data = {
+            "embeddings_file": embeddings_file,
+            "ids": self._ids,
+            "ref_doc_ids": self._ref_doc_ids,
+            "metadata": self._metadata,
+            **extra,
+        }
+        tmp_path = f"{ids_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, ids_path)
+
+        # Elimina le versioni più vecchie di quella precedente: la versione precedente può
+        # essere ancora aperta dai processi che non hanno ancora ricaricato l'indice. Su Windows
+        # un file ancora mappato in memoria non può essere eliminato: verrà rimosso in seguito.
+        keep_files = _versioned_files(data) | previous_files
+        for fname in os.listdir(persist_dir):
+            if fname.startswith(VERSIONED_PREFIXES) and fname not in keep_files:
+                try:
+                    os.remove(os.path.join(persist_dir, fname))
+                except OSError:
+                    pass
+
+
+# Nomi dei file con versione (.npy, IVF) elencati nel contenuto di vector_ids.json.
+def _versioned_files(data):
+    return {value for value in data.values()
+            if isinstance(value, str) and value.startswith(VERSIONED_PREFIXES)}
+
+
+# Restituisce True se l'indice in persist_dir è salvato nel formato del SimpleVectorStore.
+def is_simple_format(persist_dir):
+    return (not os.path.exists(os.path.join(persist_dir, IDS_FNAME))
+            and os.path.exists(os.path.join(persist_dir, SIMPLE_VECTOR_STORE_FNAME)))
+
+
+# Converte il file JSON di un SimpleVectorStore esistente (default__vector_store.json)
+# nel formato binario. Il file originale viene rinominato con il suffisso ".migrated",
+# così non può più essere caricato per errore con dati non aggiornati.
+def migrate_from_simple(persist_dir, store_cls=MmapVectorStore):
+    print(f"### migrate_from_simple({persist_dir})")
+    simple_path = os.path.join(persist_dir, SIMPLE_VECTOR_STORE_FNAME)
+    simple_store = SimpleVectorStore.from_persist_path(simple_path)
+    data = simple_store.data
+
+    ids = list(data.embedding_dict.keys())
+    embeddings = np.asarray([data.embedding_dict[node_id] for node_id in ids],
+                            dtype=np.float32).reshape(len(ids), -1)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings = embeddings / np.where(norms == 0, 1, norms)
+
+    vector_store = store_cls(
+        embeddings,
+        ids,
+        [data.text_id_to_ref_doc_id.get(node_id, "None") for node_id in ids],
+        {node_id: (data.metadata_dict or {}).get(node_id, {}) for node_id in ids},
+    )
+    # Inizializza le eventuali strutture aggiuntive delle sottoclassi prima di salvare.
+    vector_store._load_extra(persist_dir, {})
+    vector_store.persist(simple_path)
+    os.replace(simple_path, f"{simple_path}.migrated")
+    print(f"Migrati {len(ids)} embedding nel formato binario.")
+    return vector_store
+
+
+# Migrazione esplicita di un indice nel formato binario (--migrate) e confronto dei tempi
+# di caricamento.
+# Esempio: python mmap_vector_store.py index_storage --migrate
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else "index_storage"
+    if "--migrate" in sys.argv[2:] and is_simple_format(folder):
+        migrate_from_simple(folder)
+    start = time.perf_counter()
+    store = MmapVectorStore.from_persist_dir(folder)
+    print(f"Caricati {len(store._ids)} embedding in {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+from typing import Any, List
+from llama_index.core.base.llms.types import CompletionResponse
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+# Questo modulo fornisce dei sostituti locali, deterministici e senza accesso alla rete,
+# del LLM e del modello di embedding di OpenAI. Servono a misurare le prestazioni e a
+# verificare il comportamento della pipeline (concorrenza, limiti di frequenza, ripetizione
+# delle richieste dopo un errore 429) senza chiamare le API e senza costi.
+#
+# La latenza di ogni chiamata è configurabile, ed è possibile simulare una frazione di
+# richieste rifiutate per superamento dei limiti (errore HTTP 429).
+
+
+# Errore restituito dai sostituti per simulare il superamento dei limiti di frequenza.
+# Espone status_code come le eccezioni del client di OpenAI.
+class MockRateLimitError(Exception):
+    status_code = 429
+
+
+class LatencyMockLLM(MockLLM):
+    # Latenza di ogni chiamata, in secondi.
+    latency: float = 0.0
+    # Frazione (0-1) delle chiamate che falliscono con un errore 429.
+    failure_rate: float = 0.0
+    seed: int = 0
+    _random: random.Random = PrivateAttr()
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0,
+                 max_tokens=None, **kwargs: Any) -> None:
+        super().__init__(max_tokens=max_tokens, **kwargs)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self._random = random.Random(seed)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LatencyMockLLM"
+
+    def _check_failure(self):
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise MockRateLimitError("429 Too Many Requests (simulato)")
+
+    # La risposta è ricavata in modo deterministico dal prompt: le prime parole
+    # dell'ultimo paragrafo, così da avere testi brevi ma diversi per ogni nodo.
+    def _respond(self, prompt):
+        if self.max_tokens:
+            return self._generate_text(self.max_tokens)
+        paragraphs = [p for p in prompt.split("\n\n") if p.strip()]
+        words = (paragraphs[-1] if paragraphs else prompt).split()
+        return " ".join(words[:40])
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False,
+                 **kwargs: Any) -> CompletionResponse:
+        time.sleep(self.latency)
+        self._check_failure()
+        return CompletionResponse(text=self._respond(prompt))
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False,
+                        **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self.latency)
+        self._check_failure()
+        return CompletionResponse(text=self._respond(prompt))
+
+
+# Modello di embedding deterministico basato sul "feature hashing" dei trigrammi di caratteri:
+# testi con parole in comune producono vettori simili, quindi la ricerca per
+# somiglianza restituisce risultati sensati anche senza un modello reale.
+class LatencyMockEmbedding(MockEmbedding):
+    latency: float = 0.0
+    failure_rate: float = 0.0
+    seed: int = 0
+    _random: random.Random = PrivateAttr()
+
+    def __init__(self, embed_dim=256, latency=0.0, failure_rate=0.0, seed=0,
+                 **kwargs: Any) -> None:
+        super().__init__(embed_dim=embed_dim, **kwargs)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self._random = random.Random(seed)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LatencyMockEmbedding"
+
+    def _check_failure(self):
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise MockRateLimitError("429 Too Many Requests (simulato)")
+
+    # Vengono usati i trigrammi di caratteri (senza spazi e punteggiatura), così da ottenere
+    # vettori sensati anche per i PDF estratti con le lettere separate da spazi.
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.embed_dim
+        letters = re.sub(r"\W+", "", text.lower())
+        for i in range(max(1, len(letters) - 2)):
+            digest = hashlib.md5(letters[i:i + 3].encode("utf-8")).digest()
+            position = int.from_bytes(digest[:4], "little") % self.embed_dim
+            vector[position] += 1.0 if digest[4] % 2 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        self._check_failure()
+        return self._embed(text)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embedding(query)
+
+    # Un lotto di testi corrisponde a una sola richiesta, come per le API reali.
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        self._check_failure()
+        return [self._embed(text) for text in texts]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        self._check_failure()
+        return self._embed(text)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._aget_text_embedding(query)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency)
+        self._check_failure()
+        return [self._embed(text) for text in texts]
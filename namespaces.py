@@ -0,0 +1,151 @@
+import contextvars
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import shutil
+import sys
+from filelock import FileLock
+from global_settings import (NAMESPACES_DIR, DEFAULT_NAMESPACE, NAMESPACE_LOCK_TIMEOUT,
+                             NAMESPACE_SECRET_FILE, SESSION_FILE, CONVERSATION_FILE,
+                             LEGACY_CONVERSATION_FILE, QUIZ_FILE, QUIZ_POOL_DIR, STORAGE_PATH,
+                             INDEX_STORAGE, SUMMARY_STORAGE)
+
+# Questo modulo separa i dati dei diversi utenti che usano la stessa istanza dell'applicazione.
+#
+# I percorsi di global_settings.py (sessione, materiali caricati, indice, chat, quiz...) sono
+# unici per tutto il processo: due studenti collegati allo stesso server Streamlit si
+# sovrascriverebbero a vicenda indice, conversazione e quiz, e delete_session cancellerebbe
+# i materiali di tutti. Ogni utente ha invece un proprio spazio (namespace), una cartella in
+# NAMESPACES_DIR, e user_path risolve i percorsi all'interno dello spazio corrente.
+#
+# Lo spazio viene scelto all'inizio di ogni esecuzione dello script (learny.py) dal parametro
+# "user" dell'URL. Il nome dello spazio è generato a caso dal server, e il parametro contiene
+# il nome seguito dalla sua firma (HMAC con la chiave segreta del server, NAMESPACE_SECRET_FILE
+# o la variabile d'ambiente LEARNY_NAMESPACE_SECRET): un utente non può quindi scegliere o
+# indovinare lo spazio di un altro modificando l'URL. Se il parametro manca o la firma non è
+# valida viene creato un nuovo spazio, aggiunto all'URL così da ritrovarlo ricaricando la pagina.
+# Fuori da Streamlit (script da riga di comando, benchmark) lo spazio è DEFAULT_NAMESPACE,
+# che usa i percorsi originali. I dati salvati in questi percorsi prima dell'introduzione degli
+# spazi non sono raggiungibili dall'applicazione: possono essere spostati in un nuovo spazio con
+#     python namespaces.py migrate
+# che stampa il parametro "user" da usare nell'URL.
+#
+# Restano invece condivisi fra tutti gli utenti i dati che dipendono solo dal contenuto:
+# la cache della pipeline di acquisizione (indicizzata dall'hash dei testi, quindi gli stessi
+# documenti caricati da più studenti vengono elaborati una sola volta) e l'archivio dei quiz.
+#
+# Le scritture che devono restare coerenti (indice, manifesto, sessione, registro della chat)
+# sono protette da un lock su file (namespace_lock), valido anche fra processi diversi.
+
+# Percorsi dello spazio di un utente, spostati da migrate_default_namespace.
+_USER_PATHS = (SESSION_FILE, CONVERSATION_FILE, LEGACY_CONVERSATION_FILE, QUIZ_FILE,
+               QUIZ_POOL_DIR, STORAGE_PATH, INDEX_STORAGE, SUMMARY_STORAGE)
+
+_namespace = contextvars.ContextVar("namespace", default=DEFAULT_NAMESPACE)
+
+
+def _sanitize(name):
+    return re.sub(r"[^\w-]+", "_", str(name)).strip("_")[:64] or DEFAULT_NAMESPACE
+
+
+def get_namespace():
+    return _namespace.get()
+
+
+def set_namespace(name):
+    _namespace.set(_sanitize(name))
+
+
+# Restituisce il percorso path all'interno dello spazio dell'utente (quello corrente se
+# namespace non è indicato).
+def user_path(path, namespace=None):
+    namespace = namespace or get_namespace()
+    if namespace == DEFAULT_NAMESPACE:
+        return path
+    return os.path.join(NAMESPACES_DIR, namespace, path)
+
+
+# Chiave segreta usata per firmare i nomi degli spazi, creata al primo utilizzo.
+def _secret():
+    secret = os.environ.get("LEARNY_NAMESPACE_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    with namespace_lock(NAMESPACE_SECRET_FILE):
+        if not os.path.exists(NAMESPACE_SECRET_FILE):
+            descriptor = os.open(NAMESPACE_SECRET_FILE, os.O_WRONLY | os.O_CREAT, 0o600)
+            with os.fdopen(descriptor, "w") as file:
+                file.write(secrets.token_hex(32))
+        with open(NAMESPACE_SECRET_FILE, "r") as file:
+            return file.read().strip().encode("utf-8")
+
+
+def _signature(name):
+    return hmac.new(_secret(), name.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+# Restituisce il valore del parametro "user" dell'URL per lo spazio name: nome e firma.
+def namespace_token(name):
+    return f"{name}.{_signature(name)}"
+
+
+# Restituisce lo spazio indicato da token, oppure None se la firma non è valida.
+def verify_namespace_token(token):
+    name, _, signature = str(token or "").rpartition(".")
+    if not name or _sanitize(name) != name or name == DEFAULT_NAMESPACE:
+        return None
+    if not hmac.compare_digest(signature, _signature(name)):
+        return None
+    return name
+
+
+# Determina lo spazio dell'utente per l'esecuzione corrente dello script Streamlit e crea,
+# se necessario, le sue cartelle.
+def resolve_namespace():
+    import streamlit as st
+    name = verify_namespace_token(st.query_params.get("user"))
+    if name is None:
+        name = st.session_state.get('_namespace') or secrets.token_hex(16)
+        st.query_params["user"] = namespace_token(name)
+    set_namespace(name)
+    st.session_state['_namespace'] = get_namespace()
+    for path in (SESSION_FILE, CONVERSATION_FILE, QUIZ_FILE):
+        os.makedirs(os.path.dirname(user_path(path)), exist_ok=True)
+    for path in (STORAGE_PATH, INDEX_STORAGE, SUMMARY_STORAGE):
+        os.makedirs(user_path(path), exist_ok=True)
+    return get_namespace()
+
+
+# Restituisce un lock su file associato a path (file o cartella), da usare con "with".
+def namespace_lock(path):
+    lock_path = f"{os.path.normpath(path)}.lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    return FileLock(lock_path, timeout=NAMESPACE_LOCK_TIMEOUT)
+
+
+# Sposta in un nuovo spazio i dati salvati nei percorsi originali (DEFAULT_NAMESPACE), ad
+# esempio da una versione dell'applicazione precedente agli spazi, e restituisce il parametro
+# "user" con cui ritrovarli. Le cache condivise (pipeline, archivio dei quiz) restano al loro posto.
+# Con STORAGE_BACKEND = "redis" l'indice e la conversazione salvati in Redis non vengono spostati.
+def migrate_default_namespace(name=None):
+    name = _sanitize(name or secrets.token_hex(16))
+    moved = 0
+    for path in _USER_PATHS:
+        if not os.path.exists(path):
+            continue
+        destination = user_path(path, name)
+        if os.path.exists(destination):
+            raise FileExistsError(f"{destination} esiste già")
+        os.makedirs(os.path.dirname(os.path.normpath(destination)), exist_ok=True)
+        shutil.move(path, destination)
+        moved += 1
+    print(f"### migrate_default_namespace() -> spostati {moved} percorsi nello spazio {name}")
+    return namespace_token(name)
+
+
+# Esempio: python namespaces.py migrate
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["migrate"]:
+        token = migrate_default_namespace(sys.argv[2] if len(sys.argv) > 2 else None)
+        print(f"Aprire l'applicazione con il parametro ?user={token}")
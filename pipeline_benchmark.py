@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from llama_index.core import Settings
+from llama_index.core.schema import QueryBundle
+from global_settings import STORAGE_PATH, RETRIEVAL_TOP_K, BENCHMARK_RESULTS
+from mock_backends import LatencyMockLLM, LatencyMockEmbedding
+
+# Benchmark dell'intera pipeline, eseguito senza accesso alla rete e senza costi: il LLM e il
+# modello di embedding di OpenAI sono sostituiti dai modelli deterministici di mock_backends.py,
+# con latenza configurabile. Il corpus è la cartella Libri, eventualmente copiata più volte
+# (--scale) per simulare una raccolta di materiali più grande.
+#
+# Vengono misurati, con le funzioni usate dall'applicazione:
+# - acquisizione (document_uploader.ingest_documents): tempo, pagine e nodi al secondo;
+# - indice (index_builder.build_index): tempo di creazione e di caricamento dallo storage;
+# - interrogazioni del motore study_materials (index_registry.get_query_engine): latenza
+#   p50/p95 del solo recupero dei nodi e della risposta completa;
+# - quiz (quiz_builder.build_quiz_parallel): tempo di generazione;
+# - memoria: picco della memoria residente (RSS) del processo e dei processi figli.
+#
+# Il benchmark lavora in una cartella temporanea, con cache e indice vuoti, e non tocca i dati
+# dell'applicazione. I risultati sono accodati a BENCHMARK_RESULTS insieme al commit corrente:
+# con --compare vengono confrontati con l'ultima misura di un commit diverso, eseguita con gli
+# stessi parametri.
+#
+# Esempio: python pipeline_benchmark.py --scale 4 --latency 0.05 --compare
+
+QUERIES = [
+    "Chi è Alessandra e dove vive?",
+    "Che cosa inventa Paolo?",
+    "Perché il dinosauro ha i brufoli?",
+    "Che cosa succede all'albero magico di Margo e Ornella?",
+    "Qual è la morale della favola?",
+]
+
+
+# Sostituto di OpenAIPydanticProgram per il quiz: ricava una domanda dal testo del nodo,
+# dopo la latenza simulata di una chiamata al LLM.
+class MockQuizProgram:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def __call__(self, topic, context):
+        from quiz_builder import QuizQuestion
+        time.sleep(self.latency)
+        words = [word for word in context.split() if len(word) > 3] or ["testo"]
+        options = list(dict.fromkeys(words))[:4]
+        options += [f"opzione {i}" for i in range(len(options), 4)]
+        return QuizQuestion(
+            Question_text=f"Quale parola compare nel brano su {topic}: {' '.join(words[:12])}?",
+            Option1=options[0], Option2=options[1], Option3=options[2], Option4=options[3],
+            Correct_answer=options[0], Rationale=" ".join(words[:20]))
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _peak_rss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # Su Linux ru_maxrss è in KB, su macOS in byte.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _git_commit(repo_dir):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               cwd=repo_dir, capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Copia i PDF del corpus scale volte nella cartella dei materiali.
+def prepare_corpus(corpus_dir, scale):
+    os.makedirs(STORAGE_PATH, exist_ok=True)
+    size = 0
+    for copy in range(scale):
+        for filename in sorted(os.listdir(corpus_dir)):
+            source = os.path.join(corpus_dir, filename)
+            shutil.copyfile(source, os.path.join(STORAGE_PATH, f"copia{copy}-{filename}"))
+            size += os.path.getsize(source)
+    return size
+
+
+def run_benchmark(corpus_dir, scale, latency, queries, quiz_size):
+    from document_uploader import ingest_documents
+    from index_builder import build_index
+    from index_registry import get_query_engine, get_vector_index, invalidate
+    from quiz_builder import build_quiz_parallel
+
+    Settings.llm = LatencyMockLLM(latency=latency)
+    Settings.embed_model = LatencyMockEmbedding(latency=latency)
+    metrics = {"corpus_mb": prepare_corpus(corpus_dir, scale) / (1024 * 1024)}
+
+    start = time.perf_counter()
+    nodes, changes = ingest_documents()
+    elapsed = time.perf_counter() - start
+    pages = sum(len(doc_ids) for doc_ids in changes["doc_ids"].values())
+    metrics.update(ingest_seconds=elapsed, pages=pages, nodes=len(nodes),
+                   ingest_pages_per_second=pages / elapsed,
+                   ingest_nodes_per_second=len(nodes) / elapsed)
+
+    start = time.perf_counter()
+    build_index(nodes, changes)
+    metrics["index_build_seconds"] = time.perf_counter() - start
+    invalidate()
+    start = time.perf_counter()
+    get_vector_index()
+    metrics["index_load_seconds"] = time.perf_counter() - start
+
+    engine = get_query_engine(similarity_top_k=RETRIEVAL_TOP_K)
+    retrieve_latencies, query_latencies = [], []
+    for number in range(queries):
+        question = QUERIES[number % len(QUERIES)]
+        start = time.perf_counter()
+        engine.retrieve(QueryBundle(question))
+        retrieve_latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        engine.query(question)
+        query_latencies.append(time.perf_counter() - start)
+    metrics.update(
+        retrieve_p50_ms=_percentile(retrieve_latencies, 0.5) * 1000,
+        retrieve_p95_ms=_percentile(retrieve_latencies, 0.95) * 1000,
+        query_p50_ms=_percentile(query_latencies, 0.5) * 1000,
+        query_p95_ms=_percentile(query_latencies, 0.95) * 1000)
+
+    start = time.perf_counter()
+    build_quiz_parallel("favole", output_file="quiz_benchmark.csv", size=quiz_size,
+                        program=MockQuizProgram(latency))
+    metrics["quiz_seconds"] = time.perf_counter() - start
+
+    metrics["peak_rss_mb"] = _peak_rss_mb(resource.RUSAGE_SELF)
+    metrics["peak_rss_children_mb"] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return metrics
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+# Confronta le metriche con quelle dell'ultima misura di un altro commit, con gli stessi parametri.
+def compare(result, previous_results):
+    previous = [entry for entry in previous_results
+                if entry["params"] == result["params"] and entry["commit"] != result["commit"]]
+    if not previous:
+        print("Nessuna misura precedente con gli stessi parametri da confrontare.")
+        return
+    baseline = previous[-1]
+    print(f"\nConfronto con {baseline['commit']} ({baseline['date']}):")
+    for name, value in result["metrics"].items():
+        old = baseline["metrics"].get(name)
+        if isinstance(old, (int, float)) and old:
+            print(f"  {name:26} {old:12.2f} -> {value:12.2f}  ({(value - old) / old:+.1%})")
+
+
+if __name__ == "__main__":
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Benchmark offline della pipeline di Learny")
+    parser.add_argument("--corpus", default=os.path.join(repo_dir, "Libri"))
+    parser.add_argument("--scale", type=int, default=1,
+                        help="numero di copie del corpus da acquisire")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="latenza simulata di ogni chiamata al LLM e agli embedding (s)")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--quiz-size", type=int, default=5)
+    parser.add_argument("--results", default=os.path.join(repo_dir, BENCHMARK_RESULTS))
+    parser.add_argument("--compare", action="store_true")
+    args = parser.parse_args()
+    corpus_dir = os.path.abspath(args.corpus)
+    results_path = os.path.abspath(args.results)
+
+    work_dir = tempfile.mkdtemp(prefix="learny-benchmark-")
+    os.chdir(work_dir)
+    try:
+        metrics = run_benchmark(corpus_dir, args.scale, args.latency, args.queries,
+                                args.quiz_size)
+    finally:
+        os.chdir(repo_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = {
+        "commit": _git_commit(repo_dir),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "params": {"corpus": os.path.basename(corpus_dir), "scale": args.scale,
+                   "latency": args.latency, "queries": args.queries,
+                   "quiz_size": args.quiz_size},
+        "metrics": metrics,
+    }
+    print("\nRisultati:")
+    for name, value in metrics.items():
+        print(f"  {name:26} {value:12.3f}")
+    previous_results = load_results(results_path)
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, "a", encoding="utf-8") as file:
+        file.write(json.dumps(result) + "\n")
+    print(f"Risultati salvati in {results_path}")
+    if args.compare:
+        compare(result, previous_results)
@@ -1,13 +1,16 @@
+import os
 import streamlit as st
 import pandas as pd
 from global_settings import QUIZ_FILE
+from quiz_bank import record_answers, score_answers
+from namespaces import user_path
 
 # Questo modulo gestisce l'interfaccia utente per lo svolgimento del quiz.
 
 
 # Evidenzia le risposte corrette/errate
 def evidenzia_risposte(df, answers):
-    for index, row in df.iterrows():
+    for row in df.to_dict("records"):
         question = row["Question_text"]
         options = [row["Option1"], row["Option2"],
                    row["Option3"], row["Option4"]]
@@ -28,18 +31,31 @@ def evidenzia_risposte(df, answers):
                 st.markdown(f"- {option}")
 
 
+# Legge il file CSV contenente le domande del quiz e le risposte corrette, e lo carica nel
+# DataFrame df. Il DataFrame viene conservato nella sessione di Streamlit e il file viene
+# riletto solo quando cambia (cioè quando viene preparato un nuovo quiz).
+def load_quiz():
+    quiz_file = user_path(QUIZ_FILE)
+    modified = os.path.getmtime(quiz_file)
+    cached = st.session_state.get('_quiz')
+    if cached is not None and cached[0] == modified:
+        return cached[1]
+    df = pd.read_csv(quiz_file)
+    st.session_state['_quiz'] = (modified, df)
+    return df
+
+
 # Mostra l'interfaccia per il quiz
 def show_quiz(topic):
     print("### show_quiz()")
     st.markdown(f"### Verifichiamo le tue conoscenze su {topic} con un quiz:")
-    # Legge il file CSV contenente le domande del quiz e le risposte corrette, e lo carica nel DataFrame df
-    df = pd.read_csv(QUIZ_FILE)
+    df = load_quiz()
 
     # Inizializza un dizionario vuoto per memorizzare le risposte degli utenti.
     answers = {}
 
     # Itera attraverso ogni riga del DataFrame
-    for index, row in df.iterrows():
+    for row in df.to_dict("records"):
         # Estrae il testo della domanda dalla colonna "Question_text".
         question = row["Question_text"]
         # Estrae le opzioni di risposta dalle colonne "Option1", "Option2", "Option3" e "Option4".
@@ -56,24 +72,15 @@ def show_quiz(topic):
     if all_answered:
         print("All answered")
         if st.button("INVIA RISPOSTE"):
-            score = 0
-            for q_no in answers:
-                user_answer_text = answers[q_no]
-                print(f"Risposta fornita: {user_answer_text}")
-                # Estrae la risposta corretta dal DataFrame.
-                # Utilizza loc per filtrare il DataFrame in base al numero della domanda e seleziona
-                # la colonna "Correct_answer". iloc[0] viene utilizzato per ottenere il primo
-                # (e presumibilmente unico) valore corrispondente.
-                correct_answer_text = df.loc[df['Question_no']
-                                             == q_no, "Correct_answer"].iloc[0]
-                print(f"Risposta corretta: {correct_answer_text}")
-                if user_answer_text in correct_answer_text:
-                    score += 1
-                    print("Risposta azzeccata!")
-                    print("-------------------")
-                else:
-                    print("Risposta errata!")
-                    print("-------------------")
+            # Confronta tutte le risposte con quelle corrette in un'unica operazione
+            # vettoriale (quiz_bank.score_answers).
+            correct = score_answers(df, answers)
+            score = int(correct.sum())
+            print(f"Risposte azzeccate: {score}/{len(df)}")
+            # Registra le risposte nell'archivio dei quiz: le domande già risolte non
+            # verranno riproposte allo studente (quiz_bank.select_quiz).
+            if "Question_id" in df:
+                record_answers(df["Question_id"], correct)
 
             max_score = len(df)
             third_of_max = max_score / 3
@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+from global_settings import QUIZ_BANK_DB
+from namespaces import get_namespace
+
+# Questo modulo implementa un archivio permanente delle domande dei quiz (quiz bank),
+# su un database SQLite.
+#
+# Ogni quiz proposto allo studente (generato da quiz_builder.build_quiz o prelevato dalla
+# riserva di quiz_pool.py) viene aggiunto all'archivio da register_quiz, domanda per domanda,
+# insieme all'argomento e al nodo da cui la domanda è stata ricavata. I quiz ancora nella
+# riserva non vengono registrati: altrimenti select_quiz li proporrebbe come domande mai viste,
+# prima che lo studente li abbia ricevuti. Per ogni studente, identificato dal suo spazio
+# (namespaces.py), vengono registrate le risposte date: select_quiz compone un nuovo quiz
+# scegliendo a caso fra le domande che lo studente non ha ancora visto e, in mancanza, fra
+# quelle a cui ha risposto in modo errato, senza alcuna chiamata al LLM.
+# score_answers calcola il punteggio di un intero quiz con un'unica operazione vettoriale.
+
+QUIZ_COLUMNS = ["Question_no", "Question_text", "Option1", "Option2", "Option3",
+                "Option4", "Correct_answer", "Rationale"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    subject TEXT NOT NULL,
+    question_text TEXT NOT NULL,
+    option1 TEXT, option2 TEXT, option3 TEXT, option4 TEXT,
+    correct_answer TEXT, rationale TEXT,
+    source_node_id TEXT,
+    created REAL NOT NULL,
+    UNIQUE (subject, question_text)
+);
+CREATE TABLE IF NOT EXISTS answers (
+    user TEXT NOT NULL,
+    question_id INTEGER NOT NULL REFERENCES questions (id),
+    correct INTEGER NOT NULL,
+    answered REAL NOT NULL,
+    PRIMARY KEY (user, question_id)
+);
+"""
+
+_lock = threading.Lock()
+_connections = {}
+
+
+def _connect(db_path=QUIZ_BANK_DB):
+    with _lock:
+        if db_path not in _connections:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            connection = sqlite3.connect(db_path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            _connections[db_path] = connection
+        return _connections[db_path]
+
+
+# Aggiunge all'archivio le domande di un quiz (DataFrame con le colonne QUIZ_COLUMNS ed
+# eventualmente Source_node_id) e restituisce gli id delle domande, nello stesso ordine.
+# Le domande già presenti per lo stesso argomento non vengono duplicate.
+def add_questions(subject, df, db_path=QUIZ_BANK_DB):
+    print(f"### add_questions({len(df)} domande)")
+    connection = _connect(db_path)
+    sources = (df["Source_node_id"] if "Source_node_id" in df
+               else pd.Series([None] * len(df), index=df.index))
+    rows = [(subject, row.Question_text, row.Option1, row.Option2, row.Option3,
+             row.Option4, row.Correct_answer, row.Rationale, source, time.time())
+            for row, source in zip(df.itertuples(index=False), sources)]
+    with _lock, connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO questions (subject, question_text, option1, option2, "
+            "option3, option4, correct_answer, rationale, source_node_id, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return [connection.execute(
+            "SELECT id FROM questions WHERE subject = ? AND question_text = ?",
+            (subject, row[1])).fetchone()[0] for row in rows]
+
+
+# Registra nell'archivio le domande del quiz appena proposto allo studente, salvato in
+# quiz_file, e vi aggiunge l'id di ciascuna domanda (necessario per registrare le risposte).
+def register_quiz(subject, quiz_file, db_path=QUIZ_BANK_DB):
+    df = pd.read_csv(quiz_file, dtype={column: str for column in QUIZ_COLUMNS[1:]})
+    df["Question_id"] = add_questions(subject, df, db_path)
+    df.to_csv(quiz_file, index=False)
+    return df
+
+
+# Compone un quiz di size domande per lo studente dello spazio namespace (quello corrente se
+# non è indicato), senza chiamare il LLM: prima le domande mai viste, poi quelle a cui ha
+# risposto in modo errato, in ordine casuale.
+# Restituisce None se l'archivio non contiene abbastanza domande da proporre.
+def select_quiz(subject, size, namespace=None, db_path=QUIZ_BANK_DB):
+    print("### select_quiz()")
+    user = namespace or get_namespace()
+    connection = _connect(db_path)
+    with _lock:
+        rows = connection.execute(
+            "SELECT q.id, q.question_text, q.option1, q.option2, q.option3, q.option4, "
+            "q.correct_answer, q.rationale FROM questions q "
+            "LEFT JOIN answers a ON a.question_id = q.id AND a.user = ? "
+            "WHERE q.subject = ? AND (a.correct IS NULL OR a.correct = 0) "
+            "ORDER BY a.correct IS NOT NULL, RANDOM() LIMIT ?",
+            (user, subject, size)).fetchall()
+    if len(rows) < size:
+        return None
+    df = pd.DataFrame(rows, columns=["Question_id"] + QUIZ_COLUMNS[1:])
+    df.insert(0, "Question_no", range(1, len(df) + 1))
+    return df
+
+
+# Registra le risposte date dallo studente dello spazio namespace (quello corrente se non è
+# indicato): una per domanda, l'ultima sostituisce le precedenti.
+def record_answers(question_ids, correct, namespace=None, db_path=QUIZ_BANK_DB):
+    user = namespace or get_namespace()
+    connection = _connect(db_path)
+    now = time.time()
+    with _lock, connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)",
+            [(user, int(question_id), int(ok), now)
+             for question_id, ok in zip(question_ids, correct)])
+
+
+# Calcola in un'unica operazione vettoriale quali risposte sono corrette: come in
+# precedenza, una risposta è corretta se è contenuta nel testo della risposta corretta.
+# answers è il dizionario {Question_no: risposta}; restituisce un array di booleani
+# allineato alle righe del DataFrame.
+def score_answers(df, answers):
+    user_answers = np.array([answers.get(number) or "\x01" for number in df["Question_no"]],
+                            dtype=str)
+    correct_answers = df["Correct_answer"].to_numpy(dtype=str)
+    return np.char.find(correct_answers, user_answers) >= 0
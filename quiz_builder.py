@@ -1,14 +1,34 @@
-from llama_index.core import load_index_from_storage, StorageContext
+from concurrent.futures import ThreadPoolExecutor
+from llama_index.core.bridge.pydantic import BaseModel, Field, model_validator
 from llama_index.program.evaporate.df import DFRowsProgram
 from llama_index.program.openai import OpenAIPydanticProgram
-from global_settings import INDEX_STORAGE, QUIZ_SIZE, QUIZ_FILE
+from global_settings import (QUIZ_SIZE, QUIZ_FILE, QUIZ_PARALLEL, QUIZ_MAX_PARALLEL,
+                             QUIZ_DUPLICATE_THRESHOLD)
+from index_registry import get_query_engine
+from bm25_index import tokenize
+from quiz_bank import QUIZ_COLUMNS
+from namespaces import user_path
+from tracing import traced, propagate
 import pandas as pd
 
 # Crea un quiz basato sui file caricati.
+# Il quiz viene salvato in output_file: per impostazione predefinita QUIZ_FILE, il quiz da
+# mostrare all'utente corrente, oppure un file della riserva di quiz preparati in anticipo
+# (quiz_pool.py).
+# Le domande vengono aggiunte all'archivio permanente dei quiz (quiz_bank.register_quiz)
+# solo quando il quiz viene proposto allo studente.
 
 
-def build_quiz(topic):
+@traced("build_quiz")
+def build_quiz(topic, output_file=None):
     print("### build_quiz(topic)")
+    output_file = output_file or user_path(QUIZ_FILE)
+    if QUIZ_PARALLEL:
+        try:
+            return build_quiz_parallel(topic, output_file)
+        except ValueError as e:
+            # Nessuna domanda valida: il quiz viene generato con un'unica interrogazione.
+            print(f"### build_quiz -> {e}: genero il quiz con un'unica interrogazione")
 
     # Crea un DataFrame vuoto con colonne specifiche per le domande del quiz, le opzioni
     # di risposta, la risposta corretta e la spiegazione (Rationale).
@@ -26,11 +46,6 @@ def build_quiz(topic):
         }
     )
 
-    # Carica il contesto di archiviazione e l'indice vettoriale "vector"
-    # dalla directory di persistenza specificata (INDEX_STORAGE)
-    storage_context = StorageContext.from_defaults(persist_dir=INDEX_STORAGE)
-    vector_index = load_index_from_storage(storage_context, index_id="vector")
-
     # Inizializza l'estrattore DataFrame, utilizzando i valori predefiniti.
 
     # DFRowsProgram è un parser che analizza e gestisce le righe del DataFrame,
@@ -45,12 +60,14 @@ def build_quiz(topic):
     )
 
     # Definisce il motore di query a cui passare il prompt (query_string) che genererà le domande del quiz.
+    # Il motore viene recuperato dal registro condiviso (index_registry.py), che carica l'indice
+    # vettoriale "vector" da INDEX_STORAGE una sola volta per processo e lo condivide con la chat.
     # vector_index.as_query_engine() trasforma l'indice vettoriale in un motore di query.
     # Un motore di query è un'interfaccia che permette di eseguire ricerche e recuperare informazioni
     # dall'indice vettoriale in modo efficiente, partendo da query espresse in linguaggio naturale.
     # Le ricerche sono basate sulla somiglianza semantica e consentono di ottenere risultati rilevanti
     # in base alle rappresentazioni vettoriali dei nodi.
-    query_engine = vector_index.as_query_engine()
+    query_engine = get_query_engine()
 
     query_string = (f"Create {QUIZ_SIZE} different quiz questions relevant for testing "
                     "a candidate's knowledge about {topic}. You must use Italian language. "
@@ -75,6 +92,121 @@ def build_quiz(topic):
     new_df = result_obj.to_df(existing_df=df)
 
     # Salva il DataFrame contenente le domande del quiz in un file .csv
-    # (QUIZ_FILE) e restituisce il nuovo DataFrame.
-    new_df.to_csv(QUIZ_FILE, index=False)
+    # (output_file) e restituisce il nuovo DataFrame.
+    new_df.to_csv(output_file, index=False)
+    return new_df
+
+
+# Generazione parallela del quiz, una domanda per volta.
+#
+# La generazione in un'unica interrogazione richiede una risposta lunga quanto l'intero quiz
+# (la latenza cresce con il numero di domande, e i quiz lunghi superano il limite di token in
+# uscita) e una seconda chiamata al LLM per convertire il testo in righe del DataFrame.
+# build_quiz_parallel assegna invece a ciascuna domanda un blocco di testo diverso, preso a
+# turno dai diversi documenti, e genera le domande in parallelo (al massimo QUIZ_MAX_PARALLEL
+# chiamate contemporanee): il tempo totale resta circa quello di una singola domanda.
+# Ogni risposta del LLM viene validata direttamente nello schema QuizQuestion; le domande
+# non valide o quasi identiche ad altre vengono scartate.
+
+class QuizQuestion(BaseModel):
+    Question_text: str = Field(description="Il testo della domanda")
+    Option1: str
+    Option2: str
+    Option3: str
+    Option4: str
+    Correct_answer: str = Field(description="Il testo esatto dell'opzione corretta")
+    Rationale: str = Field(description="La spiegazione della risposta corretta")
+
+    @model_validator(mode="after")
+    def check_answer(self):
+        options = [self.Option1, self.Option2, self.Option3, self.Option4]
+        if len(set(options)) < 4:
+            raise ValueError("Le opzioni di risposta devono essere diverse")
+        if not any(option in self.Correct_answer for option in options):
+            raise ValueError("La risposta corretta deve essere una delle opzioni")
+        return self
+
+
+QUESTION_PROMPT = (
+    "Create one quiz question relevant for testing a candidate's knowledge about {topic}, "
+    "based on the following text. You must use Italian language.\n"
+    "---------------------\n{context}\n---------------------\n"
+    "The question will have 4 different answer options, and only one of them is correct. "
+    "The question and the answers must not refer to websites or URL. "
+    "Provide also the correct answer, copied exactly from the options, and the answer rationale."
+)
+
+
+# Seleziona count blocchi di testo pertinenti all'argomento, alternando i documenti di
+# provenienza (ref_doc_id) in modo che le domande coprano materiali diversi.
+# Viene usato il retriever del motore di query condiviso: con HYBRID_RETRIEVAL la ricerca
+# ibrida, come nella chat.
+def _diverse_chunks(topic, count):
+    retriever = get_query_engine(similarity_top_k=count * 3).retriever
+    by_document = {}
+    for result in retriever.retrieve(topic):
+        by_document.setdefault(result.node.ref_doc_id, []).append(result.node)
+    groups = list(by_document.values())
+    chunks = []
+    while groups and len(chunks) < count:
+        for group in groups:
+            chunks.append(group.pop(0))
+        groups = [group for group in groups if group]
+    # Con pochi materiali i blocchi vengono riutilizzati per più domande.
+    distinct = len(chunks)
+    while chunks and len(chunks) < count:
+        chunks.append(chunks[len(chunks) % distinct])
+    return chunks[:count]
+
+
+# Due domande sono considerate duplicate se la somiglianza di Jaccard fra i loro termini
+# (ridotti alla radice, senza parole vuote) supera QUIZ_DUPLICATE_THRESHOLD.
+def _deduplicate(questions, threshold=QUIZ_DUPLICATE_THRESHOLD):
+    unique, seen = [], []
+    for question in questions:
+        terms = set(tokenize(question.Question_text))
+        if any(len(terms & other) / max(len(terms | other), 1) >= threshold
+               for other in seen):
+            continue
+        unique.append(question)
+        seen.append(terms)
+    return unique
+
+
+def _generate_question(program, topic, node):
+    try:
+        question = program(topic=topic, context=node.get_content())
+    except Exception as e:
+        print(f"### build_quiz_parallel -> domanda scartata: {e}")
+        return None
+    return question, node.node_id
+
+
+# program è il programma che genera una domanda da un nodo: per impostazione predefinita
+# OpenAIPydanticProgram, sostituibile ad esempio nei benchmark (pipeline_benchmark.py).
+# Se nessuna domanda è valida solleva ValueError, invece di salvare un quiz vuoto.
+def build_quiz_parallel(topic, output_file=None, size=QUIZ_SIZE, program=None):
+    print(f"### build_quiz_parallel({size} domande)")
+    output_file = output_file or user_path(QUIZ_FILE)
+    program = program or OpenAIPydanticProgram.from_defaults(
+        output_cls=QuizQuestion, prompt_template_str=QUESTION_PROMPT)
+
+    # Vengono generate alcune domande in più, per compensare quelle scartate.
+    chunks = _diverse_chunks(topic, size + max(1, size // 5))
+    with ThreadPoolExecutor(max_workers=QUIZ_MAX_PARALLEL) as executor:
+        questions = list(executor.map(
+            propagate(lambda node: _generate_question(program, topic, node)), chunks))
+    questions = [result for result in questions if result is not None]
+    sources = {id(question): node_id for question, node_id in questions}
+    questions = _deduplicate([question for question, _ in questions])
+    if not questions:
+        raise ValueError("nessuna domanda valida generata")
+
+    new_df = pd.DataFrame(
+        [{"Question_no": number, **question.model_dump(),
+          "Source_node_id": sources[id(question)]}
+         for number, question in enumerate(questions[:size], start=1)],
+        columns=QUIZ_COLUMNS + ["Source_node_id"],
+    )
+    new_df.to_csv(output_file, index=False)
     return new_df
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from global_settings import QUIZ_FILE, QUIZ_POOL_DIR, QUIZ_POOL_SIZE
+from index_registry import read_generation
+from quiz_builder import build_quiz
+from namespaces import user_path, get_namespace, set_namespace
+
+# Questo modulo mantiene una riserva di quiz generati in anticipo, uno per argomento di studio.
+#
+# La generazione di un quiz (quiz_builder.build_quiz) richiede una interrogazione dell'indice
+# e un'estrazione strutturata con il LLM: eseguita nel gestore del pulsante "Genera un quiz"
+# bloccherebbe l'interfaccia per molti secondi. I quiz vengono invece preparati da un thread
+# in background (dopo la creazione dell'indice in user_onboarding e ogni volta che un quiz
+# viene usato), e salvati come file CSV in QUIZ_POOL_DIR, in una cartella per argomento.
+# Il pulsante preleva semplicemente un quiz pronto con pop_quiz.
+#
+# Ogni quiz porta nel nome del file la generazione dell'indice da cui è stato creato:
+# quando l'indice viene aggiornato, i quiz preparati sul vecchio indice vengono scartati.
+# Ogni utente ha la propria riserva, nel proprio spazio (namespaces.py): il thread in
+# background lavora nello spazio dell'utente che ha richiesto il riempimento.
+
+# Un solo thread: i quiz vengono generati uno alla volta, senza competere con la chat
+# per i limiti di frequenza delle API.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="quiz_pool")
+_lock = threading.Lock()
+# (spazio dell'utente, argomento) per cui è già in corso (o in coda) il riempimento della riserva.
+_pending = set()
+
+
+def _subject_dir(subject):
+    slug = re.sub(r"[^\w]+", "_", subject.lower()).strip("_")[:40]
+    digest = hashlib.sha1(subject.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(user_path(QUIZ_POOL_DIR), f"{slug}-{digest}")
+
+
+# Restituisce i quiz pronti per l'argomento, dal più vecchio, eliminando quelli
+# generati su una versione precedente dell'indice.
+def _ready_quizzes(subject):
+    directory = _subject_dir(subject)
+    if not os.path.isdir(directory):
+        return []
+    generation = str(read_generation())
+    ready = []
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if not filename.endswith(".csv"):
+            continue
+        if filename.split("-", 1)[0] != generation:
+            os.remove(path)
+            continue
+        ready.append(path)
+    return sorted(ready, key=os.path.getmtime)
+
+
+def _fill(namespace, subject):
+    set_namespace(namespace)
+    try:
+        directory = _subject_dir(subject)
+        os.makedirs(directory, exist_ok=True)
+        while len(_ready_quizzes(subject)) < QUIZ_POOL_SIZE:
+            print(f"### quiz_pool -> preparo un quiz su '{subject}'")
+            path = os.path.join(directory, f"{read_generation()}-{uuid.uuid4().hex}")
+            # Il quiz viene scritto su un file temporaneo e rinominato solo quando è completo.
+            build_quiz(subject, output_file=f"{path}.tmp")
+            os.replace(f"{path}.tmp", f"{path}.csv")
+    except Exception as e:
+        print(f"### quiz_pool -> generazione del quiz non riuscita: {e}")
+    finally:
+        with _lock:
+            _pending.discard((namespace, subject))
+
+
+# Avvia in background il riempimento della riserva di quiz per l'argomento.
+# Può essere chiamata ad ogni esecuzione dello script: se la riserva è già piena o
+# in fase di riempimento non fa nulla.
+def refill_pool(subject):
+    namespace = get_namespace()
+    with _lock:
+        if ((namespace, subject) in _pending
+                or len(_ready_quizzes(subject)) >= QUIZ_POOL_SIZE):
+            return
+        _pending.add((namespace, subject))
+    _executor.submit(_fill, namespace, subject)
+
+
+# Preleva un quiz pronto dalla riserva e lo copia in destination (QUIZ_FILE dell'utente),
+# quindi avvia il riempimento della riserva. Restituisce False se non ci sono quiz pronti.
+def pop_quiz(subject, destination=None):
+    print("### pop_quiz()")
+    destination = destination or user_path(QUIZ_FILE)
+    popped = False
+    for path in _ready_quizzes(subject):
+        try:
+            os.replace(path, destination)
+            popped = True
+            break
+        except FileNotFoundError:
+            # Il quiz è stato prelevato nel frattempo da un'altra sessione.
+            continue
+    refill_pool(subject)
+    return popped
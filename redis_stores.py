@@ -0,0 +1,335 @@
+import json
+import os
+import threading
+import zlib
+from typing import Any, Dict, List, Optional
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import ChatMessage
+from llama_index.core.storage.chat_store.base import BaseChatStore
+from llama_index.core.storage.kvstore.types import BaseKVStore, DEFAULT_COLLECTION
+from global_settings import (REDIS_URL, REDIS_PREFIX, REDIS_MAX_CONNECTIONS,
+                             REDIS_POOL_TIMEOUT, REDIS_PIPELINE_BATCH)
+from mmap_vector_store import MmapVectorStore
+from tracing import count
+
+# Questo modulo implementa gli archivi su Redis usati con STORAGE_BACKEND = "redis", per
+# eseguire più processi Streamlit (anche su macchine diverse, dietro un bilanciatore di
+# carico) che condividono conversazioni, indice e cache:
+# - RedisKVStore: archivio chiave-valore (un hash Redis per collezione, valori JSON compressi
+#   con zlib come in SQLiteKVStore), usato per la cache della pipeline di acquisizione,
+#   degli embedding e dei riassunti, e per il docstore e l'index store dell'indice
+#   (KVDocumentStore e KVIndexStore di llama_index);
+# - RedisVectorStore: MmapVectorStore i cui embedding vengono salvati in Redis invece che in
+#   un file .npy; al salvataggio vengono scritte solo le righe aggiunte o eliminate;
+# - RedisChatStore: archivio della chat (una lista Redis per chiave). Ogni processo conserva
+#   una copia dei messaggi e ad ogni lettura scarica solo quelli aggiunti nel frattempo;
+#   le operazioni diverse da un'aggiunta incrementano un contatore di versione, che obbliga
+#   gli altri processi a rileggere la conversazione.
+#
+# Tutti i processi condividono un unico client con un pool di connessioni (al più
+# REDIS_MAX_CONNECTIONS, attendendo fino a REDIS_POOL_TIMEOUT secondi una connessione
+# libera). Le scritture di più valori vengono inviate in pipeline, a gruppi di
+# REDIS_PIPELINE_BATCH comandi: un solo viaggio di andata e ritorno per gruppo.
+# Il client può essere sostituito con set_redis_client, ad esempio con fakeredis.FakeRedis()
+# per provare gli archivi senza un server Redis.
+#
+# Le chiavi iniziano con REDIS_PREFIX seguito dal percorso che l'archivio avrebbe avuto su
+# disco (redis_key), che comprende lo spazio dell'utente (namespaces.py).
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            import redis
+            print(f"### get_redis_client() -> {REDIS_URL}")
+            pool = redis.BlockingConnectionPool.from_url(
+                REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT)
+            _client = redis.Redis(connection_pool=pool)
+        return _client
+
+
+def set_redis_client(client):
+    global _client
+    with _client_lock:
+        _client = client
+
+
+# Chiave Redis corrispondente a un percorso su disco (ad esempio users/mario/index_storage).
+def redis_key(path, *parts):
+    path_parts = [part for part in os.path.normpath(path).split(os.sep) if part not in ("", ".")]
+    return ":".join([REDIS_PREFIX, *path_parts, *parts])
+
+
+# Esegue i comandi (nome del metodo e argomenti) in pipeline, a gruppi di batch_size.
+def pipelined(client, commands, batch_size=REDIS_PIPELINE_BATCH):
+    pipe = client.pipeline(transaction=False)
+    pending = 0
+    for name, *args in commands:
+        getattr(pipe, name)(*args)
+        pending += 1
+        if pending >= batch_size:
+            pipe.execute()
+            pending = 0
+    if pending:
+        pipe.execute()
+
+
+# Elimina tutte le chiavi che iniziano con prefix.
+def delete_prefix(prefix, client=None):
+    client = client or get_redis_client()
+    pipelined(client, (("delete", key) for key in client.scan_iter(match=f"{prefix}:*",
+                                                                    count=1000)))
+
+
+def _dumps(value):
+    return zlib.compress(json.dumps(value).encode("utf-8"), 1)
+
+
+def _loads(value):
+    return json.loads(zlib.decompress(value))
+
+
+class RedisKVStore(BaseKVStore):
+    def __init__(self, namespace, client=None, batch_size=REDIS_PIPELINE_BATCH):
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self._client = client or get_redis_client()
+
+    def _hash(self, collection):
+        return f"{self.namespace}:{collection}"
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self._client.hset(self._hash(collection), key, _dumps(val))
+
+    # Inserisce più valori in pipeline. Il batch_size dei chiamanti (1 per KVDocumentStore)
+    # è ignorato: i comandi sono comunque inviati a gruppi di self.batch_size.
+    def put_all(self, kv_pairs, collection: str = DEFAULT_COLLECTION, batch_size: int = 1):
+        name = self._hash(collection)
+        pipelined(self._client, (("hset", name, key, _dumps(val)) for key, val in kv_pairs),
+                  self.batch_size)
+
+    # Le letture trovate (o meno) nella cache vengono contate nello span corrente (tracing.py).
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        value = self._client.hget(self._hash(collection), key)
+        if value is None:
+            count("cache_misses")
+            return None
+        count("cache_hits")
+        return _loads(value)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return {key.decode("utf-8"): _loads(value)
+                for key, value in self._client.hgetall(self._hash(collection)).items()}
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return bool(self._client.hdel(self._hash(collection), key))
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection)
+
+    async def aput_all(self, kv_pairs, collection: str = DEFAULT_COLLECTION,
+                       batch_size: int = 1) -> None:
+        self.put_all(kv_pairs, collection)
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection)
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection)
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+    # Il client è condiviso: non c'è nulla da chiudere.
+    def close(self):
+        pass
+
+
+# Gli embedding sono salvati nell'hash "<namespace>:vectors" (id del nodo -> riga float32
+# normalizzata), ref_doc_id e metadati nell'hash "<namespace>:vector_metadata".
+class RedisVectorStore(MmapVectorStore):
+    namespace: str = ""
+
+    _client: Any = PrivateAttr()
+    # Id delle righe già salvate in Redis e di quelle aggiunte (o sostituite) da allora.
+    _persisted: set = PrivateAttr(default_factory=set)
+    _dirty: set = PrivateAttr(default_factory=set)
+
+    def __init__(self, namespace, client=None, **kwargs: Any) -> None:
+        super().__init__(namespace=namespace, **kwargs)
+        self._client = client or get_redis_client()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RedisVectorStore"
+
+    @classmethod
+    def from_redis(cls, namespace, client=None):
+        client = client or get_redis_client()
+        pipe = client.pipeline(transaction=True)
+        pipe.hgetall(f"{namespace}:vectors")
+        pipe.hgetall(f"{namespace}:vector_metadata")
+        vectors, metadata = pipe.execute()
+        if not vectors:
+            return cls(namespace, client)
+        ids = sorted(vectors)
+        embeddings = np.frombuffer(b"".join(vectors[node_id] for node_id in ids),
+                                   dtype=np.float32).reshape(len(ids), -1)
+        rows = [json.loads(metadata[node_id]) for node_id in ids]
+        ids = [node_id.decode("utf-8") for node_id in ids]
+        vector_store = cls(namespace, client, embeddings=embeddings, ids=ids,
+                           ref_doc_ids=[row["ref_doc_id"] for row in rows],
+                           metadata={node_id: row["metadata"] for node_id, row in zip(ids, rows)})
+        vector_store._persisted = set(ids)
+        return vector_store
+
+    def add(self, nodes, **add_kwargs: Any) -> List[str]:
+        node_ids = super().add(nodes, **add_kwargs)
+        self._dirty.update(node_ids)
+        return node_ids
+
+    # Scrive in Redis le righe aggiunte ed elimina quelle rimosse dall'ultimo salvataggio.
+    # persist_path è accettato per compatibilità con StorageContext.persist, ma ignorato.
+    def persist(self, persist_path: Optional[str] = None, fs: Optional[Any] = None) -> None:
+        current = set(self._ids)
+        written = (current - self._persisted) | (self._dirty & current)
+        removed = self._persisted - current
+        commands = []
+        for node_id in written:
+            row = self._rows[node_id]
+            commands.append(("hset", f"{self.namespace}:vectors", node_id,
+                             np.ascontiguousarray(self._embeddings[row],
+                                                  dtype=np.float32).tobytes()))
+            commands.append(("hset", f"{self.namespace}:vector_metadata", node_id,
+                             json.dumps({"ref_doc_id": self._ref_doc_ids[row],
+                                         "metadata": self._metadata[node_id]})))
+        for node_id in removed:
+            commands.append(("hdel", f"{self.namespace}:vectors", node_id))
+            commands.append(("hdel", f"{self.namespace}:vector_metadata", node_id))
+        pipelined(self._client, commands)
+        print(f"### RedisVectorStore.persist() -> {len(written)} righe scritte, "
+              f"{len(removed)} eliminate")
+        self._persisted = current
+        self._dirty.clear()
+
+
+def _dump_message(message):
+    return json.dumps(message.model_dump(mode="json"), ensure_ascii=False)
+
+
+def _load_message(data):
+    return ChatMessage.model_validate_json(data)
+
+
+class RedisChatStore(BaseChatStore):
+    namespace: str
+
+    _client: Any = PrivateAttr()
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+    # chiave -> (versione, messaggi) letti da Redis.
+    _cache: dict = PrivateAttr(default_factory=dict)
+
+    def __init__(self, namespace, client=None, **kwargs: Any) -> None:
+        super().__init__(namespace=namespace, **kwargs)
+        self._client = client or get_redis_client()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RedisChatStore"
+
+    def _messages_key(self, key):
+        return f"{self.namespace}:messages:{key}"
+
+    def _version_key(self, key):
+        return f"{self.namespace}:version:{key}"
+
+    def _keys_key(self):
+        return f"{self.namespace}:keys"
+
+    # Sostituisce i messaggi di una chiave in un'unica transazione.
+    def set_messages(self, key: str, messages: List[ChatMessage]) -> None:
+        pipe = self._client.pipeline(transaction=True)
+        pipe.delete(self._messages_key(key))
+        for start in range(0, len(messages), REDIS_PIPELINE_BATCH):
+            pipe.rpush(self._messages_key(key), *[
+                _dump_message(message) for message in messages[start:start + REDIS_PIPELINE_BATCH]])
+        pipe.incr(self._version_key(key))
+        pipe.sadd(self._keys_key(), key)
+        pipe.execute()
+
+    # Restituisce i messaggi, scaricando da Redis solo quelli aggiunti dall'ultima lettura.
+    # I messaggi già letti restano gli stessi oggetti (RollingSummaryMemory vi associa il
+    # conteggio dei token).
+    def get_messages(self, key: str) -> List[ChatMessage]:
+        with self._lock:
+            version, messages = self._cache.get(key, (None, []))
+            pipe = self._client.pipeline(transaction=True)
+            pipe.get(self._version_key(key))
+            pipe.lrange(self._messages_key(key), len(messages), -1)
+            current, new = pipe.execute()
+            if current != version:
+                pipe = self._client.pipeline(transaction=True)
+                pipe.get(self._version_key(key))
+                pipe.lrange(self._messages_key(key), 0, -1)
+                current, new = pipe.execute()
+                messages = []
+            messages = messages + [_load_message(data) for data in new]
+            self._cache[key] = (current, messages)
+            return list(messages)
+
+    def add_message(self, key: str, message: ChatMessage, idx: Optional[int] = None) -> None:
+        if idx is not None:
+            messages = self.get_messages(key)
+            messages.insert(idx, message)
+            self.set_messages(key, messages)
+            return
+        pipe = self._client.pipeline(transaction=True)
+        pipe.rpush(self._messages_key(key), _dump_message(message))
+        pipe.sadd(self._keys_key(), key)
+        pipe.execute()
+
+    def delete_messages(self, key: str) -> Optional[List[ChatMessage]]:
+        if not self._client.sismember(self._keys_key(), key):
+            return None
+        messages = self.get_messages(key)
+        pipe = self._client.pipeline(transaction=True)
+        pipe.delete(self._messages_key(key))
+        pipe.incr(self._version_key(key))
+        pipe.srem(self._keys_key(), key)
+        pipe.execute()
+        return messages
+
+    def delete_message(self, key: str, idx: int) -> Optional[ChatMessage]:
+        messages = self.get_messages(key)
+        if idx >= len(messages):
+            return None
+        message = messages.pop(idx)
+        self.set_messages(key, messages)
+        return message
+
+    def delete_last_message(self, key: str) -> Optional[ChatMessage]:
+        pipe = self._client.pipeline(transaction=True)
+        pipe.rpop(self._messages_key(key))
+        pipe.incr(self._version_key(key))
+        data, _ = pipe.execute()
+        return _load_message(data) if data is not None else None
+
+    def get_keys(self) -> List[str]:
+        return sorted(key.decode("utf-8") for key in self._client.smembers(self._keys_key()))
+
+    # Restituisce una pagina di messaggi contando dalla fine della conversazione, come
+    # JsonlChatStore.get_messages_page.
+    def get_messages_page(self, key, page=0, page_size=20):
+        messages = self.get_messages(key)
+        end = max(len(messages) - page * page_size, 0)
+        return messages[max(end - page_size, 0):end]
+
+    # Ogni operazione è già salvata in Redis: persist esiste per compatibilità con
+    # JsonlChatStore.persist.
+    def persist(self, persist_path: Optional[str] = None, fs: Any = None) -> None:
+        pass
@@ -0,0 +1,213 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+from llama_index.core import Settings
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.memory.types import BaseChatStoreMemory
+from global_settings import (CHAT_MEMORY_TOKEN_LIMIT, CHAT_SUMMARY_TOKEN_LIMIT,
+                             CHAT_SUMMARY_FOLD_RATIO)
+from tracing import span, count, propagate
+
+# Questo modulo implementa la memoria della chat usata dall'agent (conversation_engine.py),
+# al posto di ChatMemoryBuffer.
+#
+# ChatMemoryBuffer, ad ogni turno, ricalcola i token dell'intera conversazione (anche più
+# volte, togliendo un messaggio alla volta) e scarta semplicemente i turni più vecchi:
+# nelle sessioni lunghe ogni turno diventa più lento e l'agent dimentica l'inizio della
+# conversazione. RollingSummaryMemory invece:
+# - conta i token di ciascun messaggio una sola volta, conservando il conteggio insieme al
+#   messaggio: ad ogni turno vengono contati solo i messaggi nuovi;
+# - invia al LLM gli ultimi messaggi che stanno in CHAT_MEMORY_TOKEN_LIMIT token, insieme a
+#   un riassunto dei messaggi precedenti (al più CHAT_SUMMARY_TOKEN_LIMIT token);
+# - quando i messaggi escono dalla finestra, li incorpora nel riassunto con il LLM in un
+#   thread in background, fuori dal percorso della richiesta. Per non chiamare il LLM ad ogni
+#   turno, la finestra viene ridotta a CHAT_SUMMARY_FOLD_RATIO del suo limite, così i messaggi
+#   vengono riassunti a gruppi. Finché il riassunto non è pronto la finestra resta comunque
+#   entro il limite: i messaggi appena usciti mancano dal prompt solo per quel turno.
+# Il prompt resta quindi limitato qualunque sia la lunghezza della sessione.
+#
+# Il riassunto è salvato nello stesso archivio della chat, con la chiave
+# "<chat_store_key>:summary", come un unico messaggio di sistema; il numero di messaggi che
+# riassume è in additional_kwargs["covered"]. In questo modo viene ripreso insieme alla
+# conversazione nelle sessioni successive, e non compare fra i messaggi mostrati nella chat.
+
+SUMMARY_PROMPT = (
+    "Di seguito sono riportati il riassunto di una conversazione fra uno studente e "
+    "l'assistente Learny, e i messaggi successivi. Scrivi in italiano un unico riassunto "
+    "aggiornato della conversazione, in al più {words} parole, mantenendo gli argomenti "
+    "discussi, le domande dello studente e le informazioni importanti date nelle risposte."
+    "\n---------------------\nRiassunto precedente:\n{summary}\n\nMessaggi:\n{messages}"
+    "\n---------------------\nRiassunto aggiornato:"
+)
+
+# Token aggiunti da OpenAI per ogni messaggio (ruolo e separatori).
+_MESSAGE_OVERHEAD = 4
+
+# Un solo thread: i riassunti di tutte le sessioni vengono calcolati uno alla volta.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rolling_memory")
+
+
+def _message_text(message):
+    text = message.content or ""
+    # I messaggi dell'assistant che chiamano un tool hanno gli argomenti della chiamata
+    # al posto del contenuto.
+    for tool_call in message.additional_kwargs.get("tool_calls") or []:
+        function = getattr(tool_call, "function", None)
+        if function is None and isinstance(tool_call, dict):
+            function = tool_call.get("function", {})
+        if isinstance(function, dict):
+            text += f" {function.get('name', '')} {function.get('arguments', '')}"
+        elif function is not None:
+            text += f" {function.name} {function.arguments}"
+    return text
+
+
+def _default_tokenizer():
+    return Settings.tokenizer
+
+
+class RollingSummaryMemory(BaseChatStoreMemory):
+    token_limit: int = CHAT_MEMORY_TOKEN_LIMIT
+    summary_token_limit: int = CHAT_SUMMARY_TOKEN_LIMIT
+    fold_ratio: float = CHAT_SUMMARY_FOLD_RATIO
+    tokenizer_fn: Callable[[str], List] = Field(default_factory=_default_tokenizer, exclude=True)
+
+    # Conteggi dei token: (messaggio, token) nell'ordine della conversazione. Il messaggio
+    # è conservato per riconoscere quando la conversazione è stata sostituita.
+    _counts: List[Any] = PrivateAttr(default_factory=list)
+    _summary_count: Any = PrivateAttr(default=(None, 0))
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+    _pending: bool = PrivateAttr(default=False)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RollingSummaryMemory"
+
+    @classmethod
+    def from_defaults(cls, chat_history: Optional[List[ChatMessage]] = None, llm: Any = None,
+                      **kwargs: Any) -> "RollingSummaryMemory":
+        memory = cls(**kwargs)
+        if chat_history is not None:
+            memory.set(chat_history)
+        return memory
+
+    @property
+    def summary_key(self):
+        return f"{self.chat_store_key}:summary"
+
+    # Restituisce il riassunto salvato e il numero di messaggi che riassume.
+    def get_summary(self):
+        messages = self.chat_store.get_messages(self.summary_key)
+        if not messages:
+            return None, 0
+        return messages[-1], messages[-1].additional_kwargs.get("covered", 0)
+
+    def count_tokens(self, message):
+        return len(self.tokenizer_fn(_message_text(message))) + _MESSAGE_OVERHEAD
+
+    # Conteggi dei token di tutti i messaggi: vengono contati solo quelli nuovi.
+    def _token_counts(self, history):
+        with self._lock:
+            valid = 0
+            for (message, _), current in zip(self._counts, history):
+                if message is not current:
+                    break
+                valid += 1
+            del self._counts[valid:]
+            for message in history[valid:]:
+                self._counts.append((message, self.count_tokens(message)))
+            count("memory_tokens_counted", len(history) - valid)
+            return [tokens for _, tokens in self._counts]
+
+    def _summary_tokens(self, summary):
+        if summary is None:
+            return 0
+        with self._lock:
+            if self._summary_count[0] is not summary:
+                self._summary_count = (summary, self.count_tokens(summary))
+            return self._summary_count[1]
+
+    # Primo messaggio di una finestra di al più budget token che termina con la conversazione,
+    # senza iniziare con una risposta dell'assistant o di un tool (che richiedono il messaggio
+    # precedente).
+    def _window_start(self, history, counts, budget, first):
+        start, used = len(history), 0
+        while start > first and used + counts[start - 1] <= budget:
+            start -= 1
+            used += counts[start]
+        while start < len(history) and history[start].role in (MessageRole.ASSISTANT,
+                                                                MessageRole.TOOL):
+            start += 1
+        return start
+
+    def get(self, input: Optional[str] = None, initial_token_count: int = 0,
+            **kwargs: Any) -> List[ChatMessage]:
+        history = self.get_all()
+        counts = self._token_counts(history)
+        summary, covered = self.get_summary()
+        covered = min(covered, len(history))
+        summary_tokens = self._summary_tokens(summary)
+        budget = self.token_limit - summary_tokens - initial_token_count
+        start = self._window_start(history, counts, budget, covered)
+        if start > covered:
+            # Alcuni messaggi sono usciti dalla finestra senza essere stati riassunti:
+            # vengono incorporati nel riassunto, insieme a quelli che eccedono la finestra
+            # ridotta, in background.
+            fold_end = self._window_start(history, counts, int(budget * self.fold_ratio),
+                                          covered)
+            self._schedule_fold(covered, fold_end)
+        with span("chat_memory", messages=len(history), window=len(history) - start,
+                  summarized=covered) as memory_span:
+            memory_span.set(memory_tokens=summary_tokens + sum(counts[start:]))
+        window = history[start:]
+        return [summary] + window if summary is not None else window
+
+    def _schedule_fold(self, covered, end):
+        with self._lock:
+            if self._pending:
+                return
+            self._pending = True
+        _executor.submit(propagate(self._fold), covered, end)
+
+    # Incorpora nel riassunto i messaggi da covered a end (esclusi i messaggi dei tool,
+    # il cui contenuto è già riportato nelle risposte dell'assistant).
+    def _fold(self, covered, end):
+        try:
+            with span("chat_memory.summarize", messages=end - covered):
+                summary, _ = self.get_summary()
+                history = self.get_all()[covered:end]
+                messages = "\n".join(f"{message.role.value}: {message.content}"
+                                     for message in history
+                                     if message.role != MessageRole.TOOL and message.content)
+                words = int(self.summary_token_limit * 0.6)
+                text = Settings.llm.complete(SUMMARY_PROMPT.format(
+                    words=words, summary=summary.content if summary is not None else "",
+                    messages=messages)).text.strip()
+                # Il riassunto non deve mai superare il suo limite, anche se il LLM
+                # non rispetta il numero di parole richiesto.
+                tokens = self.tokenizer_fn(text)
+                if len(tokens) > self.summary_token_limit:
+                    text = text[:len(text) * self.summary_token_limit // len(tokens)]
+                self.chat_store.set_messages(self.summary_key, [ChatMessage(
+                    role=MessageRole.SYSTEM,
+                    content=f"Riassunto della conversazione precedente: {text}",
+                    additional_kwargs={"covered": end})])
+                print(f"### RollingSummaryMemory -> riassunti {end} messaggi")
+        except Exception as e:
+            # Il riassunto verrà ritentato al turno successivo; nel frattempo la finestra
+            # resta comunque entro il limite.
+            print(f"### RollingSummaryMemory -> riassunto non riuscito: {e}")
+        finally:
+            with self._lock:
+                self._pending = False
+
+    def set(self, messages: List[ChatMessage]) -> None:
+        super().set(messages)
+        self.chat_store.delete_messages(self.summary_key)
+
+    def reset(self) -> None:
+        super().reset()
+        self.chat_store.delete_messages(self.summary_key)
+        with self._lock:
+            self._counts.clear()
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.schema import QueryBundle
+from global_settings import (INDEX_STORAGE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE,
+                             SEMANTIC_CACHE_TTL)
+from index_registry import read_generation
+from namespaces import user_path
+from tracing import count
+
+# Questo modulo implementa una cache semantica delle risposte del tool study_materials
+# (conversation_engine.py).
+#
+# Gli studenti di una stessa classe pongono spesso domande quasi identiche sugli stessi
+# materiali, e ciascuna richiederebbe un nuovo recupero dei nodi e una nuova sintesi del LLM.
+# La cache confronta l'embedding della domanda con quelli delle domande già servite: se la
+# somiglianza (coseno) supera SEMANTIC_CACHE_THRESHOLD viene restituita la risposta salvata,
+# con le relative fonti. Le voci scadono dopo SEMANTIC_CACHE_TTL secondi e, oltre
+# SEMANTIC_CACHE_SIZE voci, viene eliminata quella usata meno di recente (LRU).
+#
+# La cache è condivisa fra tutte le sessioni del processo che usano lo stesso indice (cioè
+# dello stesso utente, vedi namespaces.py) e viene svuotata quando cambia
+# la generazione dell'indice (cioè quando index_builder.build_index salva un nuovo indice).
+# Ogni risposta è associata alla configurazione del motore di query che l'ha prodotta
+# (ad esempio similarity_top_k e compress_context): motori configurati in modo diverso non
+# condividono le risposte.
+# L'embedding della domanda viene passato al motore di query, che non deve ricalcolarlo.
+
+
+class SemanticCache:
+    def __init__(self, persist_dir=None, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_size=SEMANTIC_CACHE_SIZE, ttl=SEMANTIC_CACHE_TTL):
+        self.persist_dir = persist_dir or user_path(INDEX_STORAGE)
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # chiave progressiva -> (embedding normalizzato, risposta, istante, latenza originale,
+        # configurazione del motore)
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._generation = read_generation(self.persist_dir)
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def _check_generation(self):
+        generation = read_generation(self.persist_dir)
+        if generation != self._generation:
+            print(f"### SemanticCache -> nuova generazione dell'indice ({generation}), svuoto la cache")
+            self._entries.clear()
+            self._generation = generation
+
+    # Restituisce la risposta salvata per la domanda più simile, fra quelle servite con la
+    # stessa configurazione (config) del motore di query, oppure None.
+    def lookup(self, embedding, config=()):
+        with self._lock:
+            self._check_generation()
+            now = time.time()
+            for key in [key for key, entry in self._entries.items()
+                        if now - entry[2] > self.ttl]:
+                del self._entries[key]
+            keys = [key for key, entry in self._entries.items() if entry[4] == config]
+            if keys:
+                matrix = np.stack([self._entries[key][0] for key in keys])
+                scores = matrix @ embedding
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    count("semantic_cache_hits")
+                    self.saved_seconds += self._entries[key][3]
+                    return self._entries[key][1]
+            self.misses += 1
+            count("semantic_cache_misses")
+            return None
+
+    def store(self, embedding, response, latency, config=()):
+        with self._lock:
+            self._entries[self._next_key] = (embedding, response, time.time(), latency, config)
+            self._next_key += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "saved_seconds": self.saved_seconds,
+            "entries": len(self._entries),
+        }
+
+
+# Cache condivise a livello di processo, una per cartella dell'indice.
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_semantic_cache(persist_dir=None):
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    with _caches_lock:
+        if persist_dir not in _caches:
+            _caches[persist_dir] = SemanticCache(persist_dir)
+        return _caches[persist_dir]
+
+
+# Motore di query che interpone la cache semantica fra il tool e il motore di query reale.
+# config sono i parametri con cui il motore è stato costruito (index_registry.get_query_engine).
+class SemanticCacheQueryEngine(BaseQueryEngine):
+    def __init__(self, query_engine, cache=None, embed_model=None, config=None):
+        self._query_engine = query_engine
+        self._cache = cache or get_semantic_cache()
+        self._embed_model = embed_model or Settings.embed_model
+        self._config = tuple(sorted((config or {}).items()))
+        super().__init__(callback_manager=query_engine.callback_manager)
+
+    def _get_prompt_modules(self):
+        return {}
+
+    def _embed(self, query_bundle):
+        embedding = np.asarray(
+            self._embed_model.get_query_embedding(query_bundle.query_str), dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+
+    def _query(self, query_bundle: QueryBundle):
+        embedding = self._embed(query_bundle)
+        response = self._cache.lookup(embedding, self._config)
+        if response is not None:
+            print("### SemanticCacheQueryEngine -> risposta dalla cache")
+            return response
+        start = time.perf_counter()
+        response = self._query_engine.query(
+            QueryBundle(query_bundle.query_str, embedding=embedding.tolist()))
+        self._cache.store(embedding, response, time.perf_counter() - start, self._config)
+        return response
+
+    async def _aquery(self, query_bundle: QueryBundle):
+        embedding = self._embed(query_bundle)
+        response = self._cache.lookup(embedding, self._config)
+        if response is not None:
+            return response
+        start = time.perf_counter()
+        response = await self._query_engine.aquery(
+            QueryBundle(query_bundle.query_str, embedding=embedding.tolist()))
+        self._cache.store(embedding, response, time.perf_counter() - start, self._config)
+        return response
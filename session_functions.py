@@ -1,4 +1,6 @@
-from global_settings import SESSION_FILE, STORAGE_PATH, CONVERSATION_FILE
+from global_settings import (SESSION_FILE, STORAGE_PATH, CONVERSATION_FILE,
+                             LEGACY_CONVERSATION_FILE, MANIFEST_FILE, STORAGE_BACKEND)
+from namespaces import user_path, namespace_lock
 import yaml
 import os
 
@@ -7,18 +9,25 @@ import os
 # e l'eliminazione dello stato della sessione di un utente. YAML è un formato
 # per la serializzazione. È leggibile dall'uomo e indipendente dalla piattaforma,
 # adatto per l'archiviazione di strutture dati semplici come lo stato della sessione.
+# Tutti i file si trovano nello spazio dell'utente corrente (namespaces.py): eliminare una
+# sessione non tocca i materiali e le conversazioni degli altri utenti.
 
 def save_session(state):
     print("### save_session()")
-    state_to_save = {key: value for key, value in state.items()}
-    with open(SESSION_FILE, 'w') as file:
+    # Le chiavi che iniziano con "_" contengono oggetti di lavoro (agent, archivio della chat)
+    # conservati solo in memoria per la durata della sessione: non vengono salvate.
+    state_to_save = {key: value for key, value in state.items()
+                     if not str(key).startswith('_')}
+    session_file = user_path(SESSION_FILE)
+    with namespace_lock(session_file), open(session_file, 'w') as file:
         yaml.dump(state_to_save, file)
 
 
 def load_session(state):
     print("### load_session()")
-    if os.path.exists(SESSION_FILE):
-        with open(SESSION_FILE, 'r') as file:
+    session_file = user_path(SESSION_FILE)
+    if os.path.exists(session_file):
+        with open(session_file, 'r') as file:
             try:
                 loaded_state = yaml.safe_load(file) or {}
                 for key, value in loaded_state.items():
@@ -31,12 +40,25 @@ def load_session(state):
 
 def delete_session(state):
     print("### delete_session()")
-    if os.path.exists(SESSION_FILE):
-        os.remove(SESSION_FILE)
-    if os.path.exists(CONVERSATION_FILE):
-        os.remove(CONVERSATION_FILE)
-    for filename in os.listdir(STORAGE_PATH):
-        file_path = os.path.join(STORAGE_PATH, filename)
+    session_file = user_path(SESSION_FILE)
+    if os.path.exists(session_file):
+        os.remove(session_file)
+    for conversation_file in (user_path(CONVERSATION_FILE), user_path(LEGACY_CONVERSATION_FILE)):
+        if os.path.exists(conversation_file):
+            os.remove(conversation_file)
+    # Con Redis la conversazione (e il riassunto della memoria della chat) è in Redis.
+    if STORAGE_BACKEND == "redis":
+        from redis_stores import RedisChatStore, redis_key
+        chat_store = RedisChatStore(redis_key(user_path(CONVERSATION_FILE)))
+        for key in chat_store.get_keys():
+            chat_store.delete_messages(key)
+    # Il manifesto dell'acquisizione viene conservato: alla successiva acquisizione i file
+    # eliminati verranno riconosciuti come rimossi e i loro documenti tolti dall'indice.
+    storage_path = user_path(STORAGE_PATH)
+    for filename in os.listdir(storage_path):
+        file_path = os.path.join(storage_path, filename)
+        if os.path.abspath(file_path) == os.path.abspath(user_path(MANIFEST_FILE)):
+            continue
         if os.path.isfile(file_path) or os.path.islink(file_path):
             os.remove(file_path)
     for key in list(state.keys()):
@@ -0,0 +1,154 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+from llama_index.core.storage.kvstore import SimpleKVStore
+from llama_index.core.storage.kvstore.types import BaseKVStore, DEFAULT_COLLECTION
+from global_settings import INGESTION_CACHE_DB, INGESTION_CACHE_MAX_MB
+from tracing import count
+
+# Questo modulo implementa un archivio chiave-valore su SQLite, da usare come backend
+# della cache della pipeline di acquisizione (IngestionCache) al posto di un unico file JSON.
+#
+# Con SimpleKVStore la cache è un solo file JSON (CACHE_FILE) che contiene tutti i risultati
+# delle trasformazioni, embedding compresi: va letto per intero all'avvio dell'acquisizione
+# e riscritto per intero alla fine, e su una raccolta di libri raggiunge centinaia di MB.
+# Con SQLiteKVStore ogni risultato è una riga indicizzata dall'hash della trasformazione:
+# viene letto solo quando serve e scritto subito, senza dover salvare l'intera cache.
+# I valori sono JSON compressi con zlib. Quando la dimensione totale supera max_size_mb
+# vengono eliminate le righe lette meno di recente (LRU).
+#
+# import_json_cache importa (una sola volta) un pipeline_cache.json esistente.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    collection TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (collection, key)
+);
+CREATE INDEX IF NOT EXISTS kv_last_access ON kv (last_access);
+"""
+
+
+class SQLiteKVStore(BaseKVStore):
+    def __init__(self, db_path=INGESTION_CACHE_DB, max_size_mb=INGESTION_CACHE_MAX_MB):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        # La connessione è condivisa fra i thread (Streamlit, acquisizione asincrona):
+        # gli accessi sono serializzati dal lock.
+        self._connection = sqlite3.connect(db_path, check_same_thread=False,
+                                           isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._total_size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM kv").fetchone()[0]
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection=collection)
+
+    # Inserisce più valori in un'unica transazione.
+    def put_all(self, kv_pairs, collection: str = DEFAULT_COLLECTION, batch_size: int = 1):
+        rows = []
+        for key, val in kv_pairs:
+            value = zlib.compress(json.dumps(val).encode("utf-8"), 1)
+            rows.append((collection, key, value, len(value), time.time()))
+        with self._lock:
+            self._connection.execute("BEGIN")
+            for row in rows:
+                previous = self._connection.execute(
+                    "SELECT size FROM kv WHERE collection = ? AND key = ?",
+                    row[:2]).fetchone()
+                self._total_size -= previous[0] if previous else 0
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?, ?)", row)
+                self._total_size += row[3]
+            self._connection.execute("COMMIT")
+            if self._total_size > self.max_size:
+                self._evict()
+
+    # Elimina le righe lette meno di recente fino a scendere al 90% della dimensione massima.
+    def _evict(self):
+        target = self.max_size * 0.9
+        print(f"### SQLiteKVStore -> cache oltre {self.max_size // (1024 * 1024)} MB, elimino le voci meno recenti")
+        self._connection.execute("BEGIN")
+        for collection, key, size in self._connection.execute(
+                "SELECT collection, key, size FROM kv ORDER BY last_access").fetchall():
+            if self._total_size <= target:
+                break
+            self._connection.execute(
+                "DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key))
+            self._total_size -= size
+        self._connection.execute("COMMIT")
+
+    # Le letture trovate (o meno) nella cache vengono contate nello span corrente (tracing.py).
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM kv WHERE collection = ? AND key = ?",
+                (collection, key)).fetchone()
+            if row is None:
+                count("cache_misses")
+                return None
+            count("cache_hits")
+            self._connection.execute(
+                "UPDATE kv SET last_access = ? WHERE collection = ? AND key = ?",
+                (time.time(), collection, key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, value FROM kv WHERE collection = ?", (collection,)).fetchall()
+        return {key: json.loads(zlib.decompress(value)) for key, value in rows}
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size FROM kv WHERE collection = ? AND key = ?",
+                (collection, key)).fetchone()
+            if row is None:
+                return False
+            self._connection.execute(
+                "DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key))
+            self._total_size -= row[0]
+            return True
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection)
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection)
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection)
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+# Importa nell'archivio SQLite il contenuto di una cache salvata da SimpleKVStore
+# (pipeline_cache.json), quindi rinomina il file in .imported per non importarlo di nuovo.
+def import_json_cache(json_path, kv_store):
+    if not os.path.exists(json_path):
+        return 0
+    print(f"### import_json_cache() -> importo {json_path}")
+    data = SimpleKVStore.from_persist_path(json_path).to_dict()
+    count = 0
+    for collection, values in data.items():
+        kv_store.put_all(list(values.items()), collection=collection)
+        count += len(values)
+    os.replace(json_path, f"{json_path}.imported")
+    return count
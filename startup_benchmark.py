@@ -0,0 +1,79 @@
+import json
+import os
+import secrets
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from global_settings import STARTUP_BUDGET_SECONDS, STARTUP_LAZY_MODULES
+
+# Benchmark del tempo di avvio a freddo dell'applicazione (learny.py).
+# Ogni misura viene eseguita in un nuovo processo Python, senza moduli già importati:
+# lo script viene eseguito una volta con streamlit.testing (AppTest), che mostra la pagina
+# di benvenuto, e viene misurato il tempo complessivo (import compresi).
+# Viene inoltre verificato che la pagina di benvenuto non abbia importato i moduli pesanti
+# (STARTUP_LAZY_MODULES), che learny.py carica solo quando servono.
+#
+# Il processo lavora in una cartella temporanea, con una chiave segreta temporanea per gli
+# spazi degli utenti (namespaces.py) e un parametro "user" firmato con quella chiave: lo
+# spazio, la sessione e la chiave creati dall'applicazione non restano nel repository.
+# Lo stesso controllo è eseguito da pytest (tests/test_startup.py).
+#
+# Termina con codice di uscita 1 se la mediana supera STARTUP_BUDGET_SECONDS o se un modulo
+# pesante è stato importato, così da poter essere usato come controllo automatico.
+#
+# Esempio: python startup_benchmark.py 5
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+from namespaces import namespace_token
+app = AppTest.from_file(sys.argv[2], default_timeout=60)
+app.query_params["user"] = namespace_token("startup_benchmark")
+app.run()
+elapsed = time.perf_counter() - start
+loaded = sorted({name.split(".")[0] for name in sys.modules} & set(json.loads(sys.argv[1])))
+print(json.dumps({"seconds": elapsed, "loaded": loaded,
+                  "errors": [str(exception.value) for exception in app.exception]}))
+"""
+
+
+def measure_cold_start():
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "startup-benchmark")
+    env["LEARNY_NAMESPACE_SECRET"] = secrets.token_hex(32)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    with tempfile.TemporaryDirectory() as workdir:
+        # learny.py legge il logo dalla cartella corrente.
+        shutil.copy(os.path.join(root, "Learny.png"), workdir)
+        result = subprocess.run(
+            [sys.executable, "-c", _CHILD, json.dumps(STARTUP_LAZY_MODULES),
+             os.path.join(root, "learny.py")],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    runs = [measure_cold_start() for _ in range(repeat)]
+    seconds = [run["seconds"] for run in runs]
+    median = statistics.median(seconds)
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+    errors = sorted({error for run in runs for error in run["errors"]})
+    print(f"Avvio a freddo della pagina di benvenuto: mediana {median:.2f} s, "
+          f"min {min(seconds):.2f} s, max {max(seconds):.2f} s "
+          f"(budget {STARTUP_BUDGET_SECONDS:.2f} s, {repeat} esecuzioni)")
+    failed = False
+    if errors:
+        print(f"Errori durante l'esecuzione dello script: {errors}")
+        failed = True
+    if loaded:
+        print(f"Moduli pesanti importati all'avvio: {', '.join(loaded)}")
+        failed = True
+    if median > STARTUP_BUDGET_SECONDS:
+        print("Tempo di avvio oltre il budget")
+        failed = True
+    sys.exit(1 if failed else 0)
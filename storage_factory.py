@@ -0,0 +1,101 @@
+import os
+from llama_index.core import StorageContext
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.index_store.keyval_index_store import KVIndexStore
+from global_settings import (INDEX_STORAGE, VECTOR_STORE_BACKEND, STORAGE_BACKEND,
+                             INGESTION_CACHE_DB)
+from mmap_vector_store import MmapVectorStore, is_simple_format
+from namespaces import user_path
+from ivf_vector_store import IVFVectorStore
+from sqlite_kv_store import SQLiteKVStore
+from redis_stores import (RedisKVStore, RedisVectorStore, get_redis_client, redis_key,
+                          delete_prefix)
+
+# Questo modulo crea i contesti di archiviazione (StorageContext) dell'indice, in base
+# all'archivio vettoriale scelto in global_settings.py (VECTOR_STORE_BACKEND):
+# - "simple": il SimpleVectorStore predefinito di Llamaindex (embedding in un file JSON);
+# - "mmap": MmapVectorStore (mmap_vector_store.py), embedding in un file binario float32
+#   aperto con il memory mapping e ricerca vettorializzata con NumPy;
+# - "ivf": IVFVectorStore (ivf_vector_store.py), come "mmap" ma con un indice approssimato
+#   (IVF) per corpora di grandi dimensioni, regolabile con IVF_NPROBE.
+# index_builder.py e index_registry.py usano sempre queste funzioni, così il tipo di
+# archivio può essere cambiato in un solo punto. Un indice già salvato con "simple" continua
+# ad essere caricato nel formato JSON finché non viene migrato esplicitamente
+# (python mmap_vector_store.py <cartella dell'indice> --migrate).
+#
+# Con STORAGE_BACKEND = "redis" docstore, index store, embedding e indice BM25 sono invece
+# salvati in Redis (redis_stores.py), con chiavi ricavate da persist_dir, e sono condivisi da
+# tutti i processi dell'applicazione; VECTOR_STORE_BACKEND viene ignorato. Anche le cache
+# condivise (open_cache_store) sono salvate in Redis invece che nel database SQLite.
+
+_VECTOR_STORES = {
+    "mmap": MmapVectorStore,
+    "ivf": IVFVectorStore,
+}
+
+
+# Prefisso delle chiavi Redis dell'indice salvato in persist_dir. Il contatore di generazione
+# (index_registry.py) è fuori da questo prefisso: sopravvive alla ricostruzione dell'indice.
+def _index_namespace(persist_dir):
+    return redis_key(persist_dir, "index")
+
+
+# Archivio chiave-valore Redis dell'indice salvato in persist_dir: docstore, index store e
+# indice BM25 (bm25_index.py).
+def open_index_kvstore(persist_dir):
+    return RedisKVStore(_index_namespace(persist_dir))
+
+
+def _redis_storage_context(persist_dir, vector_store):
+    kvstore = open_index_kvstore(persist_dir)
+    return StorageContext.from_defaults(docstore=KVDocumentStore(kvstore),
+                                        index_store=KVIndexStore(kvstore),
+                                        vector_store=vector_store)
+
+
+# Carica il contesto di archiviazione salvato in persist_dir.
+def load_storage_context(persist_dir=None):
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    if STORAGE_BACKEND == "redis":
+        return _redis_storage_context(persist_dir,
+                                      RedisVectorStore.from_redis(_index_namespace(persist_dir)))
+    if VECTOR_STORE_BACKEND in _VECTOR_STORES and not is_simple_format(persist_dir):
+        vector_store_cls = _VECTOR_STORES[VECTOR_STORE_BACKEND]
+        return StorageContext.from_defaults(
+            persist_dir=persist_dir,
+            vector_store=vector_store_cls.from_persist_dir(persist_dir)
+        )
+    return StorageContext.from_defaults(persist_dir=persist_dir)
+
+
+# Crea un contesto di archiviazione vuoto, per costruire un nuovo indice.
+# Con Redis vengono prima eliminati gli eventuali dati rimasti in persist_dir da un indice
+# mai completato; un indice salvato (index_exists) non viene invece mai cancellato.
+def new_storage_context(persist_dir=None):
+    if STORAGE_BACKEND == "redis":
+        persist_dir = persist_dir or user_path(INDEX_STORAGE)
+        if index_exists(persist_dir):
+            raise ValueError(f"Esiste già un indice in {persist_dir}: non viene ricreato.")
+        delete_prefix(_index_namespace(persist_dir))
+        return _redis_storage_context(persist_dir,
+                                      RedisVectorStore(_index_namespace(persist_dir)))
+    if VECTOR_STORE_BACKEND in _VECTOR_STORES:
+        vector_store_cls = _VECTOR_STORES[VECTOR_STORE_BACKEND]
+        return StorageContext.from_defaults(vector_store=vector_store_cls())
+    return StorageContext.from_defaults()
+
+
+# Restituisce True se in persist_dir è già stato salvato un indice.
+def index_exists(persist_dir=None):
+    persist_dir = persist_dir or user_path(INDEX_STORAGE)
+    if STORAGE_BACKEND == "redis":
+        return bool(get_redis_client().exists(f"{_index_namespace(persist_dir)}:index_store/data"))
+    return os.path.exists(os.path.join(persist_dir, "index_store.json"))
+
+
+# Apre l'archivio chiave-valore delle cache condivise fra gli utenti (pipeline di
+# acquisizione, embedding, riassunti): il database SQLite db_path, oppure Redis.
+def open_cache_store(db_path=INGESTION_CACHE_DB):
+    if STORAGE_BACKEND == "redis":
+        return RedisKVStore(redis_key(db_path))
+    return SQLiteKVStore(db_path)
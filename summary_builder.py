@@ -1,12 +1,71 @@
-from global_settings import STORAGE_PATH, SUMMARY_STORAGE
+from global_settings import STORAGE_PATH, SUMMARY_STORAGE, SUMMARY_MAX_PARALLEL, SUMMARY_REDUCE_GROUP
 from fpdf import FPDF
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
+from llama_index.core import Settings
+from namespaces import user_path
+from storage_factory import open_cache_store
+from tracing import traced, propagate
 
 
 # Crea un sommario basato sui file caricati.
+#
+# Il sommario viene costruito in due passaggi (map-reduce): i sommari dei nodi
+# (metadato section_summary, prodotto da SummaryExtractor durante l'acquisizione) vengono
+# prima riassunti documento per documento, in parallelo, e i sommari dei documenti vengono
+# poi riassunti in una panoramica generale. Le sequenze troppo lunghe vengono ridotte a
+# gruppi di SUMMARY_REDUCE_GROUP sommari alla volta.
+# Ogni riassunto è salvato nella cache della pipeline di acquisizione (open_cache_store),
+# con chiave l'hash del testo riassunto: i documenti non modificati non vengono mai
+# riassunti di nuovo, e gli stessi documenti caricati da più utenti una sola volta.
+# Il PDF contiene la panoramica seguita da una sezione per ciascun documento. Viene scritto
+# su disco una sola volta, alla fine: fpdf 1.7 costruisce comunque l'intero documento in
+# memoria, e la panoramica, che precede le sezioni, è disponibile solo dopo tutti i riassunti.
+# I testi sono però brevi (un riassunto per documento), non i sommari di tutti i nodi.
 
+SUMMARY_COLLECTION = "document_summaries"
 
-def build_summary(summary_text):
+SUMMARY_PROMPT = (
+    "Di seguito sono riportati i riassunti di alcune parti di {what}. "
+    "Scrivi in italiano un unico riassunto, chiaro e conciso, che ne colga i contenuti "
+    "principali.\n---------------------\n{text}\n---------------------\nRiassunto:"
+)
+
+
+# Riassume una lista di testi con il LLM, riducendoli a gruppi se sono troppi.
+# Il risultato di ogni chiamata viene letto dalla cache, se presente.
+def _reduce(texts, what, cache):
+    while len(texts) > 1:
+        groups = [texts[i:i + SUMMARY_REDUCE_GROUP]
+                  for i in range(0, len(texts), SUMMARY_REDUCE_GROUP)]
+        texts = [_summarize("\n\n".join(group), what, cache) for group in groups]
+    return texts[0] if texts else ""
+
+
+def _summarize(text, what, cache):
+    key = hashlib.sha256(f"{what}\n{text}".encode("utf-8")).hexdigest()
+    cached = cache.get(key, collection=SUMMARY_COLLECTION)
+    if cached is not None:
+        return cached["summary"]
+    summary = Settings.llm.complete(SUMMARY_PROMPT.format(what=what, text=text)).text.strip()
+    cache.put(key, {"summary": summary}, collection=SUMMARY_COLLECTION)
+    return summary
+
+
+# Raggruppa i sommari dei nodi per documento (file di origine), nell'ordine dei nodi.
+def _section_summaries(nodes):
+    documents = {}
+    for node in nodes:
+        summary = node.metadata.get('section_summary', '')
+        if summary:
+            name = node.metadata.get('file_name', node.ref_doc_id)
+            documents.setdefault(name, []).append(summary)
+    return documents
+
+
+@traced("build_summary")
+def build_summary(nodes):
     print("### build_summary()")
 
     # Creazione del PDF di Riassunto
@@ -27,16 +86,29 @@ def build_summary(summary_text):
                 'latin-1', 'replace').decode('latin-1'))
             self.ln()
 
+    # Riassume i documenti in parallelo (map), poi l'insieme dei documenti (reduce).
+    documents = _section_summaries(nodes)
+    cache = open_cache_store()
+    with ThreadPoolExecutor(max_workers=SUMMARY_MAX_PARALLEL) as executor:
+        document_summaries = list(executor.map(
+            propagate(lambda summaries: _reduce(summaries, "un documento", cache)),
+            documents.values()))
+    overview = _reduce(document_summaries, "una raccolta di documenti", cache)
+    cache.close()
+
     # Crea la directory se non esiste
-    output_dir = SUMMARY_STORAGE
+    output_dir = user_path(SUMMARY_STORAGE)
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Crea il PDF
+    # Crea il PDF: la panoramica, poi una sezione per ciascun documento.
     pdf = PDF()
     pdf.add_page()
     pdf.chapter_title('Riassunto del Documento')
-    pdf.chapter_body(summary_text)
+    pdf.chapter_body(overview)
+    for name, summary in zip(documents, document_summaries):
+        pdf.chapter_title(os.path.basename(name))
+        pdf.chapter_body(summary)
 
     # Salva il PDF
     pdf_output_path = os.path.join(output_dir, 'sommario.pdf')
@@ -46,3 +118,4 @@ def build_summary(summary_text):
     # Stampa conferma
     print(
         f"Il riassunto è stato generato e salvato come PDF in: {pdf_output_path}")
+    return overview
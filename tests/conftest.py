@@ -0,0 +1,47 @@
+import os
+import sys
+import pytest
+from global_settings import STORAGE_PATH, INDEX_STORAGE
+
+# I percorsi di global_settings.py sono relativi alla cartella corrente: ogni test lavora in
+# una cartella temporanea, nello spazio utente predefinito, con LLM e modello di embedding
+# sostituiti da quelli locali di mock_backends.py (nessuna chiamata alle API).
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(STORAGE_PATH)
+    os.makedirs(INDEX_STORAGE)
+    # Il registro degli indici e le cache semantiche sono condivisi dal processo: gli indici
+    # dei test precedenti, salvati con lo stesso percorso relativo, non devono essere riutilizzati.
+    if "index_registry" in sys.modules:
+        registry = sys.modules["index_registry"]
+        registry._indexes.clear()
+        registry._query_engines.clear()
+        registry._bm25_indexes.clear()
+    if "semantic_cache" in sys.modules:
+        sys.modules["semantic_cache"]._caches.clear()
+    return tmp_path
+
+
+# Anche i test che non usano i materiali lavorano nella cartella temporanea: le tracce
+# (tracing.py), se esportate, vengono salvate in un percorso relativo.
+@pytest.fixture
+def mock_models(workdir):
+    from llama_index.core import Settings
+    from mock_backends import LatencyMockLLM, LatencyMockEmbedding
+    Settings.llm = LatencyMockLLM()
+    Settings.embed_model = LatencyMockEmbedding()
+    return Settings
+
+
+# Scrive (o sovrascrive) un file fra i materiali caricati dallo studente.
+@pytest.fixture
+def write_material(workdir):
+    def write(name, text):
+        path = os.path.join(STORAGE_PATH, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        return path
+    return write
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import pytest
+from llama_index.core import Document
+from llama_index.core.extractors import SummaryExtractor
+from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.node_parser import TokenTextSplitter
+from async_ingestion import RateLimiter, with_backoff, arun_ingestion
+from mock_backends import LatencyMockLLM, LatencyMockEmbedding, MockRateLimitError
+
+
+STORIES = ["Dino è un triceratopo che vive nella foresta e ha paura dei brufoli. ",
+           "Margo e Ornella piantano un albero magico nel giardino della nonna. ",
+           "Paolo costruisce una macchina volante con le ruote della bicicletta. "]
+
+
+def test_rate_limiter_waits_for_the_request_budget():
+    async def acquire_all():
+        limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=1000, period=0.2)
+        times = []
+        for _ in range(3):
+            await limiter.acquire(requests=1, tokens=10)
+            times.append(time.monotonic())
+        return times
+
+    times = asyncio.run(acquire_all())
+    assert times[1] - times[0] < 0.1
+    assert times[2] - times[0] >= 0.19
+
+
+def test_rate_limiter_waits_for_the_token_budget():
+    async def acquire_all():
+        limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=100, period=0.2)
+        start = time.monotonic()
+        # Una richiesta più grande del budget viene limitata al budget, e non blocca per sempre.
+        await limiter.acquire(tokens=500)
+        first = time.monotonic() - start
+        await limiter.acquire(tokens=1)
+        return first, time.monotonic() - start
+
+    first, second = asyncio.run(acquire_all())
+    assert first < 0.1 and second >= 0.19
+
+
+def test_with_backoff_retries_only_rate_limit_errors():
+    calls = []
+
+    async def flaky():
+        calls.append(len(calls))
+        if len(calls) < 3:
+            raise MockRateLimitError("429")
+        return "ok"
+
+    assert asyncio.run(with_backoff(flaky, max_retries=5, base_delay=0.001)) == "ok"
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(MockRateLimitError):
+        asyncio.run(with_backoff(flaky, max_retries=1, base_delay=0.001))
+    assert len(calls) == 2
+
+    async def broken():
+        calls.append(len(calls))
+        raise ValueError("errore non dovuto ai limiti")
+
+    calls.clear()
+    with pytest.raises(ValueError):
+        asyncio.run(with_backoff(broken, max_retries=5, base_delay=0.001))
+    assert len(calls) == 1
+
+
+def test_async_ingestion_matches_the_sync_pipeline_order(workdir):
+    documents = [Document(text=story * 30, id_=f"favola_{i}.txt")
+                 for i, story in enumerate(STORIES)]
+
+    def stages(failure_rate):
+        # Latenze diverse per nodo non devono cambiare l'ordine dei risultati.
+        return (TokenTextSplitter(chunk_size=64, chunk_overlap=0),
+                SummaryExtractor(summaries=["self"], language="it", show_progress=False,
+                                 llm=LatencyMockLLM(latency=0.001, failure_rate=failure_rate)),
+                LatencyMockEmbedding(latency=0.001, embed_batch_size=4,
+                                     failure_rate=failure_rate))
+
+    splitter, extractor, embed_model = stages(0.0)
+    expected = IngestionPipeline(transformations=[splitter, extractor, embed_model]).run(
+        documents=[document.model_copy() for document in documents])
+
+    splitter, extractor, embed_model = stages(0.2)
+    nodes = asyncio.run(arun_ingestion(documents, [splitter], extractor, embed_model,
+                                       batch_size=5, max_in_flight=4, max_retries=20,
+                                       backoff_seconds=0.001))
+    assert len(nodes) == len(expected) > 5
+    assert [node.text for node in nodes] == [node.text for node in expected]
+    assert ([node.metadata["section_summary"] for node in nodes]
+            == [node.metadata["section_summary"] for node in expected])
+    assert [node.embedding for node in nodes] == [node.embedding for node in expected]
@@ -0,0 +1,64 @@
+import time
+from types import SimpleNamespace
+import conversation_engine
+from global_settings import CHAT_METRICS_HISTORY
+
+
+def test_first_token_time_is_taken_when_the_first_token_arrives():
+    def tokens():
+        time.sleep(0.05)
+        yield "Ciao"
+        time.sleep(0.05)
+        yield " Mario"
+
+    start = time.perf_counter()
+    timings = {}
+    stream = conversation_engine._timed_stream(tokens(), start, timings)
+    assert timings == {}
+    assert next(stream) == "Ciao"
+    first_token = timings["first_token"]
+    assert list(stream) == [" Mario"]
+    assert timings["first_token"] == first_token and 0.05 <= first_token < 0.1
+
+
+def test_metrics_keep_only_the_latest_turns(monkeypatch):
+    monkeypatch.setattr(conversation_engine, "st", SimpleNamespace(session_state={}))
+    for _ in range(CHAT_METRICS_HISTORY + 3):
+        metrics = conversation_engine._record_metrics(time.perf_counter() - 1.0,
+                                                      {"first_token": 0.25})
+    assert metrics["first_token"] == 0.25 and metrics["total"] >= 1.0
+    history = conversation_engine.st.session_state['_chat_metrics']
+    assert len(history) == CHAT_METRICS_HISTORY and history[-1] is metrics
+
+    # Senza alcun token (ad esempio una risposta vuota) il primo token coincide con la fine.
+    metrics = conversation_engine._record_metrics(time.perf_counter(), {})
+    assert metrics["first_token"] == metrics["total"]
+
+
+def test_streamed_answer_is_shown_and_measured(workdir, monkeypatch):
+    from streamlit.testing.v1 import AppTest
+
+    def app():
+        import streamlit as st
+        from types import SimpleNamespace
+        from conversation_engine import chat_interface
+
+        class StubAgent:
+            def stream_chat(self, prompt):
+                return SimpleNamespace(response_gen=iter(["Dino ", "è un ", "triceratopo."]))
+
+        class StubChatStore:
+            def persist(self, path):
+                st.session_state["_persisted"] = path
+
+        chat_interface(StubAgent(), StubChatStore(), st.container())
+
+    monkeypatch.setattr(conversation_engine, "CHAT_STREAMING", True)
+    at = AppTest.from_function(app).run()
+    at.chat_input[0].set_value("Chi è Dino?").run()
+    assert not at.exception
+    assert [message.name for message in at.chat_message] == ["user", "assistant"]
+    assert "Dino è un triceratopo." in at.chat_message[1].markdown[0].value
+    assert len(at.session_state["_chat_metrics"]) == 1
+    assert "_persisted" in at.session_state
+    assert at.caption[0].value.startswith("Primo token:")
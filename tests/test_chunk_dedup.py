@@ -0,0 +1,42 @@
+from llama_index.core.schema import TextNode, MetadataMode
+from chunk_dedup import NearDuplicateFilter
+
+
+STORY = ("Dino è un piccolo triceratopo che vive ai margini della grande foresta. "
+         "Ogni mattina si guarda nel lago e conta i brufoli sul suo muso, poi corre "
+         "dalla mamma a chiedere se anche gli altri dinosauri hanno i brufoli come lui. ")
+OTHER = ("Margo e Ornella piantano un albero magico nel giardino della nonna, e ogni sera "
+         "lo annaffiano con l'acqua del pozzo sperando che cresca fino alle nuvole. ")
+
+
+def _node(text, file_name):
+    return TextNode(text=text, metadata={"file_name": file_name})
+
+
+def test_near_duplicates_are_removed_and_recorded():
+    nodes = [
+        _node(STORY, "dino.txt"),
+        _node(OTHER, "margo.txt"),
+        _node(STORY.upper().replace(". ", ".\n"), "dino_ristampa.txt"),
+        _node(STORY, "dino.txt"),
+    ]
+    kept = NearDuplicateFilter()(nodes)
+    assert [node.metadata["file_name"] for node in kept] == ["dino.txt", "margo.txt"]
+    assert kept[0].metadata["duplicate_count"] == 2
+    assert kept[0].metadata["duplicate_files"] == ["dino_ristampa.txt"]
+    assert kept[1].metadata["duplicate_count"] == 0
+    # I metadati dei duplicati non entrano nel testo degli embedding e del LLM.
+    for mode in (MetadataMode.EMBED, MetadataMode.LLM):
+        assert "duplicate" not in kept[0].get_content(metadata_mode=mode)
+
+
+def test_different_texts_are_kept():
+    nodes = [_node(STORY, "a.txt"), _node(OTHER, "b.txt"), _node("", "vuoto.txt"),
+             _node("", "vuoto2.txt")]
+    assert len(NearDuplicateFilter()(nodes)) == 4
+
+
+def test_threshold_controls_how_similar_duplicates_must_be():
+    texts = [STORY, STORY.replace("grande", "immensa")]
+    assert NearDuplicateFilter(threshold=0.9).groups(texts) == [0, 1]
+    assert NearDuplicateFilter(threshold=0.6).groups(texts) == [0, 0]
@@ -0,0 +1,44 @@
+from llama_index.core.schema import TextNode, NodeWithScore, QueryBundle
+from context_compressor import ContextCompressor, count_tokens, split_sentences
+
+
+FILLER = ("La pioggia cadeva lenta sulle colline e il vento muoveva le foglie degli alberi. "
+          "Nel villaggio le campane suonavano a festa per tutta la mattina. ") * 6
+DINO = "Il triceratopo Dino aveva paura dei brufoli sul suo muso. "
+TREE = "Margo e Ornella piantarono un albero magico nel giardino. "
+
+
+def _nodes(*texts):
+    return [NodeWithScore(node=TextNode(id_=f"n{i}", text=text), score=1.0)
+            for i, text in enumerate(texts)]
+
+
+def _compress(nodes, query, budget):
+    return ContextCompressor(token_budget=budget).postprocess_nodes(
+        nodes, query_bundle=QueryBundle(query))
+
+
+def test_output_stays_within_the_token_budget():
+    nodes = _nodes(FILLER + DINO + FILLER, FILLER + TREE)
+    budget = 40
+    compressed = _compress(nodes, "Di cosa aveva paura il triceratopo Dino?", budget)
+    kept = [sentence for result in compressed
+            for sentence in split_sentences(result.node.get_content().replace("[...]", ""))]
+    assert sum(count_tokens(sentence) for sentence in kept) <= budget
+    assert compressed[0].node.node_id == "n0"
+    assert DINO.strip() in compressed[0].node.get_content()
+    assert "[...]" in compressed[0].node.get_content()
+
+
+def test_at_least_one_sentence_is_kept_and_originals_are_unchanged():
+    nodes = _nodes(DINO + TREE)
+    compressed = _compress(nodes, "albero magico", budget=1)
+    assert [result.node.get_content() for result in compressed] == [
+        "[...] " + TREE.strip()]
+    assert nodes[0].node.get_content() == DINO + TREE
+
+
+def test_large_budget_keeps_every_sentence_in_order():
+    nodes = _nodes(DINO + TREE)
+    compressed = _compress(nodes, "Dino", budget=10000)
+    assert compressed[0].node.get_content() == (DINO + TREE).strip()
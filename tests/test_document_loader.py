@@ -0,0 +1,31 @@
+import os
+from document_loader import iter_document_batches
+
+
+def _write_files(folder, names):
+    paths = []
+    for name in names:
+        path = os.path.join(folder, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"Contenuto del file {name}.")
+        paths.append(path)
+    return paths
+
+
+def _file_names(batch):
+    return [doc.metadata["file_name"] for doc in batch]
+
+
+def test_batches_are_bounded_by_file_count(tmp_path):
+    paths = _write_files(tmp_path, [f"file_{i}.txt" for i in range(5)])
+    batches = list(iter_document_batches(paths, max_workers=1, batch_files=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_batches_follow_input_order_and_are_sorted_by_file_name(tmp_path):
+    names = ["e.txt", "c.txt", "a.txt", "d.txt", "b.txt"]
+    paths = _write_files(tmp_path, names)
+    for workers in (1, 3):
+        batches = list(iter_document_batches(paths, max_workers=workers, batch_files=3))
+        assert [_file_names(batch) for batch in batches] == [
+            ["a.txt", "c.txt", "e.txt"], ["b.txt", "d.txt"]]
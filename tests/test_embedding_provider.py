@@ -0,0 +1,97 @@
+import os
+import pytest
+from llama_index.core.ingestion.cache import DEFAULT_CACHE_NAME
+from llama_index.core.storage.docstore.utils import json_to_doc
+from global_settings import STORAGE_PATH, INGESTION_CACHE_DB
+from mock_backends import LatencyMockEmbedding
+from sqlite_kv_store import SQLiteKVStore
+from embedding_provider import (CachedEmbedding, LocalTransformersEmbedding, dynamic_batches,
+                                EMBEDDING_COLLECTION)
+
+
+# Modello di prova che registra i testi di cui calcola l'embedding.
+class RecordingEmbedding(LatencyMockEmbedding):
+    calls: list = []
+
+    def _get_query_embedding(self, query):
+        self.calls.append(("query", [query]))
+        return super()._get_query_embedding(query)
+
+    def _get_text_embeddings(self, texts):
+        self.calls.append(("text", list(texts)))
+        return [self._get_text_embedding(text) for text in texts]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteKVStore(str(tmp_path / "cache.db"))
+    yield store
+    store.close()
+
+
+def test_only_missing_texts_reach_the_wrapped_model(store):
+    stub = RecordingEmbedding(calls=[])
+    model = CachedEmbedding(stub, cache=store)
+
+    first = model.get_text_embedding_batch(["a b c", "d e f"])
+    second = model.get_text_embedding_batch(["d e f", "g h i"])
+    assert stub.calls == [("text", ["a b c", "d e f"]), ("text", ["g h i"])]
+    assert second[0] == pytest.approx(first[1])
+    assert second[1] == pytest.approx(stub.get_text_embedding("g h i"))
+
+    model.get_text_embedding_batch(["a b c", "g h i"])
+    assert len(stub.calls) == 2
+    assert len(store.get_all(EMBEDDING_COLLECTION)) == 3
+
+
+def test_queries_and_texts_are_cached_separately(store):
+    stub = RecordingEmbedding(calls=[])
+    model = CachedEmbedding(stub, cache=store)
+
+    model.get_text_embedding("il triceratopo")
+    model.get_query_embedding("il triceratopo")
+    model.get_query_embedding("il triceratopo")
+    assert stub.calls == [("text", ["il triceratopo"]), ("query", ["il triceratopo"])]
+
+
+def test_the_cache_depends_on_the_wrapped_model(store):
+    CachedEmbedding(RecordingEmbedding(calls=[]), cache=store).get_text_embedding("Dino")
+    other = RecordingEmbedding(calls=[], model_name="altro")
+    CachedEmbedding(other, cache=store).get_text_embedding("Dino")
+    assert other.calls == [("text", ["Dino"])]
+
+
+def test_cached_embeddings_are_not_saved_again_by_the_pipeline(workdir, mock_models):
+    from llama_index.core import Settings
+    from document_uploader import ingest_documents
+    with open(os.path.join(STORAGE_PATH, "favola.txt"), "w") as file:
+        file.write("Dino è un triceratopo che vive nella foresta. " * 20)
+    Settings.embed_model = CachedEmbedding(LatencyMockEmbedding())
+
+    nodes, _ = ingest_documents()
+    cache_store = SQLiteKVStore(INGESTION_CACHE_DB)
+    pipeline_nodes = [json_to_doc(node)
+                      for value in cache_store.get_all(DEFAULT_CACHE_NAME).values()
+                      for node in value["nodes"]]
+    embeddings = cache_store.get_all(EMBEDDING_COLLECTION)
+    cache_store.close()
+    assert all(node.embedding for node in nodes)
+    assert len(embeddings) == len(nodes)
+    assert pipeline_nodes and all(node.embedding is None for node in pipeline_nodes)
+
+
+def test_dynamic_batches_limit_texts_and_padded_tokens():
+    lengths = [100, 5, 7, 100, 6, 50]
+    batches = dynamic_batches(lengths, max_batch=2, max_tokens=120)
+    # In ordine di lunghezza; il lotto 50+100 supererebbe 120 token con il riempimento.
+    assert batches == [[1, 4], [2, 5], [0], [3]]
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+
+
+def test_local_model_reports_missing_dependencies(monkeypatch):
+    import importlib.util
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, "find_spec",
+                        lambda name: None if name == "torch" else find_spec(name))
+    with pytest.raises(ImportError, match="torch"):
+        LocalTransformersEmbedding()
@@ -0,0 +1,73 @@
+from llama_index.core import VectorStoreIndex
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+from bm25_index import BM25Index, tokenize
+from hybrid_retriever import HybridRetriever
+
+
+def _node(node_id, text, ref_doc_id):
+    node = TextNode(id_=node_id, text=text)
+    node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=ref_doc_id)
+    return node
+
+
+NODES = [
+    _node("n1", "La principessa Ornella vive in un castello sulla collina.", "fiabe.txt"),
+    _node("n2", "Le principesse del regno danzano nel salone del castello.", "fiabe.txt"),
+    _node("n3", "Il triceratopo Dino mangia le foglie della foresta.", "dinosauri.txt"),
+]
+
+
+def test_tokenize_stems_italian_words_and_drops_stopwords():
+    assert tokenize("La principessa e le principesse") == tokenize("principessa principesse")
+    assert tokenize("principessa")[0] == tokenize("principesse")[0]
+    assert tokenize("il 1999 di") == []
+
+
+def test_bm25_search_ranks_matching_nodes(tmp_path):
+    index = BM25Index()
+    index.add_nodes(NODES)
+    assert [node_id for node_id, _ in index.search("Dino")] == ["n3"]
+    assert {node_id for node_id, _ in index.search("principessa")} == {"n1", "n2"}
+
+    index.persist(tmp_path)
+    loaded = BM25Index.load(tmp_path)
+    assert loaded.search("castello") == index.search("castello")
+
+
+def test_bm25_replaces_the_nodes_of_updated_documents():
+    index = BM25Index()
+    index.add_nodes(NODES)
+    index.add_nodes([_node("n4", "Il drago sputa fuoco sul villaggio.", "fiabe.txt")])
+    assert index.search("principessa") == []
+    assert [node_id for node_id, _ in index.search("drago")] == ["n4"]
+
+    index.delete_ref_docs(["dinosauri.txt"])
+    assert index.search("Dino") == []
+    assert set(index.doc_lengths) == {"n4"}
+
+
+def test_rrf_fuses_vector_and_keyword_rankings(mock_models):
+    vector_index = VectorStoreIndex(NODES)
+    bm25_index = BM25Index()
+    bm25_index.add_nodes(NODES)
+    retriever = HybridRetriever(vector_index, bm25_index, similarity_top_k=3, candidates=3,
+                                rrf_k=60)
+
+    results = retriever.retrieve("Dino triceratopo")
+    assert results[0].node.node_id == "n3"
+    # Il primo nodo compare in entrambe le classifiche: riceve la somma dei due contributi.
+    assert results[0].score == 2 / 61
+    assert [result.score for result in results] == sorted(
+        (result.score for result in results), reverse=True)
+
+
+def test_rrf_reads_keyword_only_results_from_the_docstore(mock_models):
+    vector_index = VectorStoreIndex(NODES)
+    bm25_index = BM25Index()
+    bm25_index.add_nodes(NODES)
+    retriever = HybridRetriever(vector_index, bm25_index, similarity_top_k=1, candidates=1)
+    retriever._vector_retriever = vector_index.as_retriever(similarity_top_k=0)
+
+    results = retriever.retrieve("Ornella")
+    assert [result.node.node_id for result in results] == ["n1"]
+    assert results[0].node.get_content() == NODES[0].get_content()
@@ -0,0 +1,106 @@
+import os
+import pytest
+from global_settings import STORAGE_PATH, INDEX_STORAGE
+from ingestion_manifest import detect_changes, load_manifest, save_manifest
+
+
+STORY_A = "Dino è un triceratopo che vive nella foresta e ha paura dei brufoli. " * 20
+STORY_B = "Margo e Ornella piantano un albero magico nel giardino della nonna. " * 20
+STORY_C = "Paolo costruisce una macchina volante con le ruote della bicicletta. " * 20
+
+
+def _ingest_and_build():
+    from document_uploader import ingest_documents
+    from index_builder import build_index
+    nodes, changes = ingest_documents()
+    return build_index(nodes, changes), changes
+
+
+def _indexed_files(index):
+    return {node.metadata["file_name"] for node in index.docstore.docs.values()}
+
+
+def test_detect_changes_without_index_treats_all_files_as_new(workdir, write_material):
+    write_material("a.txt", STORY_A)
+    write_material("b.txt", STORY_B)
+    changes = detect_changes()
+    assert changes["changed"] == ["a.txt", "b.txt"]
+    assert changes["removed"] == []
+    assert changes["stale_doc_ids"] == []
+
+
+def test_detect_changes_cascades_to_files_merged_into_changed_ones(workdir, write_material):
+    for name, story in (("a.txt", STORY_A), ("b.txt", STORY_B), ("c.txt", STORY_C)):
+        write_material(name, story)
+    changes = detect_changes()
+    manifest = {"files": {name: {"hash": changes["hashes"][name], "doc_ids": [f"{name}_doc"],
+                                 "merged_into": []} for name in changes["hashes"]}}
+    # I duplicati di c.txt sono confluiti nei nodi di b.txt, quelli di b.txt nei nodi di a.txt.
+    manifest["files"]["c.txt"]["merged_into"] = ["b.txt"]
+    manifest["files"]["b.txt"]["merged_into"] = ["a.txt"]
+    save_manifest(manifest)
+    with open(os.path.join(INDEX_STORAGE, "index_store.json"), "w") as file:
+        file.write("{}")
+    assert detect_changes()["changed"] == []
+
+    write_material("a.txt", STORY_A + "Fine.")
+    changes = detect_changes()
+    assert changes["changed"] == ["a.txt", "b.txt", "c.txt"]
+    assert sorted(changes["stale_doc_ids"]) == ["a.txt_doc", "b.txt_doc", "c.txt_doc"]
+
+    os.remove(os.path.join(STORAGE_PATH, "b.txt"))
+    write_material("a.txt", STORY_A)
+    changes = detect_changes()
+    assert changes["changed"] == ["c.txt"] and changes["removed"] == ["b.txt"]
+
+
+def test_incremental_update_replaces_only_changed_files(workdir, write_material, mock_models):
+    write_material("a.txt", STORY_A)
+    write_material("b.txt", STORY_B)
+    index, changes = _ingest_and_build()
+    assert _indexed_files(index) == {"a.txt", "b.txt"}
+    b_doc_ids = load_manifest()["files"]["b.txt"]["doc_ids"]
+
+    # Nessuna modifica: nulla da acquisire.
+    assert detect_changes()["changed"] == []
+
+    write_material("b.txt", STORY_C)
+    os.remove(os.path.join(STORAGE_PATH, "a.txt"))
+    changes = detect_changes()
+    assert changes["changed"] == ["b.txt"]
+    assert changes["removed"] == ["a.txt"]
+    assert set(b_doc_ids) <= set(changes["stale_doc_ids"])
+
+    index, _ = _ingest_and_build()
+    assert _indexed_files(index) == {"b.txt"}
+    texts = " ".join(node.get_content() for node in index.docstore.docs.values())
+    assert "macchina volante" in texts and "albero magico" not in texts
+    assert set(load_manifest()["files"]) == {"b.txt"}
+
+
+def test_build_index_does_not_rebuild_when_loading_fails(workdir, write_material,
+                                                         mock_models, monkeypatch):
+    import index_builder
+    write_material("a.txt", STORY_A)
+    write_material("b.txt", STORY_B)
+    _ingest_and_build()
+    manifest = load_manifest()
+
+    write_material("b.txt", STORY_C)
+    from document_uploader import ingest_documents
+    nodes, changes = ingest_documents()
+
+    def broken_storage(persist_dir=None):
+        raise OSError("archivio temporaneamente non disponibile")
+    with monkeypatch.context() as patch, pytest.raises(OSError):
+        patch.setattr(index_builder, "load_storage_context", broken_storage)
+        index_builder.build_index(nodes, changes)
+
+    # L'indice esistente e il manifesto non sono stati sostituiti dai soli nodi modificati,
+    # e nemmeno l'indice BM25 è stato aggiornato.
+    assert load_manifest() == manifest
+    from bm25_index import BM25Index
+    assert BM25Index.load().search("macchina volante") == []
+    assert BM25Index.load().search("albero magico")
+    from index_registry import get_vector_index
+    assert _indexed_files(get_vector_index()) == {"a.txt", "b.txt"}
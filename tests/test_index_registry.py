@@ -0,0 +1,52 @@
+import pytest
+import index_registry
+from global_settings import INDEX_STORAGE
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    loads = []
+    load_index_from_storage = index_registry.load_index_from_storage
+
+    def counting_load(*args, **kwargs):
+        loads.append(kwargs.get("index_id"))
+        return load_index_from_storage(*args, **kwargs)
+
+    monkeypatch.setattr(index_registry, "load_index_from_storage", counting_load)
+    return loads
+
+
+@pytest.fixture
+def built_index(workdir, write_material, mock_models):
+    from document_uploader import ingest_documents
+    from index_builder import build_index
+    write_material("a.txt", "Dino è un triceratopo che vive nella foresta. " * 20)
+    nodes, changes = ingest_documents()
+    index = build_index(nodes, changes)
+    # L'indice appena costruito viene pubblicato nel registro senza rileggerlo.
+    assert index_registry.get_vector_index() is index
+    return index
+
+
+def test_index_and_query_engines_are_loaded_once(built_index, loads):
+    index_registry.invalidate()
+    index = index_registry.get_vector_index()
+    assert index_registry.get_vector_index() is index
+    assert loads == ["vector"]
+
+    engine = index_registry.get_query_engine(similarity_top_k=2)
+    assert index_registry.get_query_engine(similarity_top_k=2) is engine
+    assert index_registry.get_query_engine(similarity_top_k=3) is not engine
+    assert loads == ["vector"]
+
+
+def test_a_new_generation_reloads_the_index_and_its_engines(built_index, loads):
+    engine = index_registry.get_query_engine(similarity_top_k=2)
+    generation = index_registry.read_generation()
+
+    # Un altro processo salva una nuova versione dell'indice.
+    assert index_registry.bump_generation(INDEX_STORAGE) == generation + 1
+    index = index_registry.get_vector_index()
+    assert index is not built_index and loads == ["vector"]
+    assert index_registry.get_query_engine(similarity_top_k=2) is not engine
+    assert index_registry.get_vector_index() is index and loads == ["vector"]
@@ -0,0 +1,113 @@
+import json
+import jsonl_chat_store
+from llama_index.core.llms import ChatMessage
+from jsonl_chat_store import JsonlChatStore
+
+
+def _message(text, role="user"):
+    return ChatMessage(role=role, content=text)
+
+
+def _contents(chat_store, key="0"):
+    return [message.content for message in chat_store.get_messages(key)]
+
+
+def _lines(path):
+    with open(path, "r") as file:
+        return file.read().splitlines()
+
+
+def test_replay_rebuilds_the_conversation(tmp_path):
+    path = str(tmp_path / "chat.jsonl")
+    chat_store = JsonlChatStore.from_persist_path(path)
+    for i in range(4):
+        chat_store.add_message("0", _message(f"messaggio {i}"))
+    chat_store.delete_message("0", 1)
+    chat_store.delete_last_message("0")
+    chat_store.add_message("0", _message("inserito"), idx=0)
+    chat_store.set_messages("0:summary", [_message("riassunto", "system")])
+    chat_store.delete_messages("vuota")
+    chat_store.persist()
+
+    loaded = JsonlChatStore.from_persist_path(path)
+    assert _contents(loaded) == ["inserito", "messaggio 0", "messaggio 2"]
+    assert _contents(loaded, "0:summary") == ["riassunto"]
+    assert len(_lines(path)) == 8
+
+
+def test_persist_compacts_the_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(jsonl_chat_store, "CHAT_COMPACT_MIN_RECORDS", 10)
+    path = str(tmp_path / "chat.jsonl")
+    chat_store = JsonlChatStore.from_persist_path(path)
+    for i in range(12):
+        chat_store.add_message("0", _message(f"messaggio {i}"))
+        chat_store.delete_last_message("0")
+    chat_store.add_message("0", _message("ultimo"))
+    chat_store.persist()
+
+    assert len(_lines(path)) == 1
+    assert _contents(JsonlChatStore.from_persist_path(path)) == ["ultimo"]
+
+
+def test_truncated_tail_is_removed_before_new_records(tmp_path):
+    path = str(tmp_path / "chat.jsonl")
+    chat_store = JsonlChatStore.from_persist_path(path)
+    chat_store.add_message("0", _message("primo"))
+    chat_store.add_message("0", _message("secondo"))
+    chat_store.persist()
+    with open(path, "a") as file:
+        file.write('{"op": "add", "key": "0", "mess')
+
+    loaded = JsonlChatStore.from_persist_path(path)
+    assert _contents(loaded) == ["primo", "secondo"]
+    assert len(_lines(path)) == 2
+    loaded.add_message("0", _message("terzo"))
+    loaded.persist()
+    assert _contents(JsonlChatStore.from_persist_path(path)) == ["primo", "secondo", "terzo"]
+
+
+def test_records_are_never_appended_to_an_incomplete_line(tmp_path):
+    path = str(tmp_path / "chat.jsonl")
+    chat_store = JsonlChatStore.from_persist_path(path)
+    chat_store.add_message("0", _message("primo"))
+    chat_store.persist()
+    # Un'altra sessione si interrompe a metà di una scrittura dopo il caricamento.
+    other = JsonlChatStore.from_persist_path(path)
+    with open(path, "a") as file:
+        file.write('{"op": "add", "key": "0"')
+
+    other.add_message("0", _message("secondo"))
+    other.persist()
+    assert _contents(JsonlChatStore.from_persist_path(path)) == ["primo", "secondo"]
+
+
+def test_invalid_records_are_skipped(tmp_path):
+    path = str(tmp_path / "chat.jsonl")
+    records = [
+        {"op": "add", "key": "0", "message": {"role": "user", "content": "primo"}},
+        {"op": "add", "key": "0"},
+        "non è un record",
+        {"op": "add", "key": "0", "message": {"role": "user", "content": "secondo"}},
+    ]
+    with open(path, "w") as file:
+        file.write("\n".join(json.dumps(record) for record in records) + "\n")
+        file.write("{rotto}\n")
+
+    assert _contents(JsonlChatStore.from_persist_path(path)) == ["primo", "secondo"]
+
+
+def test_two_sessions_keep_each_others_records_across_compaction(tmp_path):
+    path = str(tmp_path / "chat.jsonl")
+    first = JsonlChatStore.from_persist_path(path)
+    second = JsonlChatStore.from_persist_path(path)
+    first.add_message("0", _message("prima sessione 1"))
+    second.add_message("0", _message("seconda sessione 1"))
+    # La compattazione della seconda sessione include il record della prima, e la prima
+    # continua a scrivere sul nuovo file invece che su quello sostituito.
+    second.compact()
+    first.add_message("0", _message("prima sessione 2"))
+    assert _contents(second) == ["prima sessione 1", "seconda sessione 1"]
+
+    loaded = JsonlChatStore.from_persist_path(path)
+    assert _contents(loaded) == ["prima sessione 1", "seconda sessione 1", "prima sessione 2"]
+    assert len(_lines(path)) == 2
@@ -0,0 +1,90 @@
+import os
+import threading
+import pytest
+from filelock import Timeout
+from global_settings import STORAGE_PATH, INDEX_STORAGE, SESSION_FILE, NAMESPACES_DIR
+from namespaces import (namespace_token, verify_namespace_token, migrate_default_namespace,
+                        namespace_lock, user_path)
+
+
+def test_only_signed_namespaces_are_accepted(workdir):
+    token = namespace_token("a1b2c3")
+    assert verify_namespace_token(token) == "a1b2c3"
+    assert verify_namespace_token("a1b2c3") is None
+    assert verify_namespace_token("mario") is None
+    assert verify_namespace_token(f"mario.{token.rpartition('.')[2]}") is None
+    assert verify_namespace_token(namespace_token("default")) is None
+    assert verify_namespace_token(None) is None
+
+
+def test_signatures_depend_on_the_server_secret(workdir, monkeypatch):
+    token = namespace_token("a1b2c3")
+    monkeypatch.setenv("LEARNY_NAMESPACE_SECRET", "un'altra chiave")
+    assert verify_namespace_token(token) is None
+
+
+def test_migrate_moves_root_data_into_a_new_namespace(workdir):
+    with open(os.path.join(STORAGE_PATH, "favola.txt"), "w") as file:
+        file.write("C'era una volta")
+    with open(os.path.join(INDEX_STORAGE, "index_store.json"), "w") as file:
+        file.write("{}")
+    os.makedirs(os.path.dirname(SESSION_FILE))
+    with open(SESSION_FILE, "w") as file:
+        file.write("user_name: Mario\n")
+
+    name = verify_namespace_token(migrate_default_namespace())
+    assert name is not None
+    assert not os.path.exists(STORAGE_PATH) and not os.path.exists(SESSION_FILE)
+    assert os.path.exists(os.path.join(user_path(STORAGE_PATH, name), "favola.txt"))
+    assert os.path.exists(os.path.join(user_path(INDEX_STORAGE, name), "index_store.json"))
+    assert os.path.exists(user_path(SESSION_FILE, name))
+    assert os.listdir(NAMESPACES_DIR) == [name]
+
+
+def test_ingestion_lock_excludes_other_sessions(workdir):
+    from ingestion_manifest import ingestion_lock
+    errors = []
+
+    def other_session():
+        try:
+            with namespace_lock(user_path(STORAGE_PATH)).acquire(timeout=0.1):
+                pass
+        except Timeout as e:
+            errors.append(e)
+
+    with ingestion_lock():
+        thread = threading.Thread(target=other_session)
+        thread.start()
+        thread.join()
+    assert len(errors) == 1
+
+
+def test_pipeline_cache_is_shared_across_namespaces(workdir, mock_models):
+    from llama_index.core.ingestion.cache import DEFAULT_CACHE_NAME
+    from document_uploader import ingest_documents
+    from global_settings import INGESTION_CACHE_DB
+    from namespaces import set_namespace
+    from sqlite_kv_store import SQLiteKVStore
+
+    def ingest_as(name):
+        set_namespace(name)
+        os.makedirs(user_path(STORAGE_PATH))
+        with open(os.path.join(user_path(STORAGE_PATH), "favola.txt"), "w") as file:
+            file.write("Dino è un triceratopo che vive nella foresta. " * 20)
+        nodes, _ = ingest_documents()
+        cache_store = SQLiteKVStore(INGESTION_CACHE_DB)
+        cached = len(cache_store.get_all(DEFAULT_CACHE_NAME))
+        cache_store.close()
+        return nodes, cached
+
+    try:
+        first_nodes, first_cached = ingest_as("a1b2c3")
+        second_nodes, second_cached = ingest_as("d4e5f6")
+    finally:
+        set_namespace("default")
+    # Il secondo spazio non aggiunge nulla alla cache: tutte le trasformazioni sono lette
+    # dai risultati del primo.
+    assert first_cached > 0 and second_cached == first_cached
+    assert [node.ref_doc_id for node in second_nodes] == ["favola.txt"] * len(first_nodes)
+    assert [node.embedding for node in second_nodes] == [node.embedding for node in first_nodes]
+    assert "a1b2c3" not in second_nodes[0].get_content(metadata_mode="all")
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from mock_backends import LatencyMockLLM, LatencyMockEmbedding, MockRateLimitError
+from pipeline_benchmark import run_benchmark, compare, _percentile
+
+
+STORIES = {
+    "dino.txt": "Dino è un triceratopo che vive nella foresta e ha paura dei brufoli. " * 20,
+    "paolo.txt": "Paolo costruisce una macchina volante con le ruote della bicicletta. " * 20,
+}
+
+
+def test_mock_backends_are_deterministic_and_meaningful():
+    llm = LatencyMockLLM()
+    prompt = "Riassumi il testo.\n\nDino è un triceratopo"
+    assert llm.complete(prompt).text == llm.complete(prompt).text == "Dino è un triceratopo"
+
+    embed_model = LatencyMockEmbedding()
+    dino, paolo, question = embed_model.get_text_embedding_batch(
+        [STORIES["dino.txt"], STORIES["paolo.txt"], "Perché il triceratopo ha i brufoli?"])
+    assert dino == embed_model.get_text_embedding(STORIES["dino.txt"])
+    assert np.dot(question, dino) > np.dot(question, paolo)
+
+
+def test_mock_backends_simulate_rate_limits():
+    llm = LatencyMockLLM(failure_rate=0.5, seed=1)
+    outcomes = []
+    for _ in range(20):
+        try:
+            llm.complete("Ciao")
+            outcomes.append(True)
+        except MockRateLimitError as e:
+            assert e.status_code == 429
+            outcomes.append(False)
+    assert True in outcomes and False in outcomes
+    with pytest.raises(MockRateLimitError):
+        LatencyMockEmbedding(failure_rate=1.0).get_text_embedding("Ciao")
+
+
+def test_benchmark_runs_the_whole_pipeline_offline(workdir, tmp_path_factory):
+    corpus_dir = tmp_path_factory.mktemp("corpus")
+    for name, story in STORIES.items():
+        (corpus_dir / name).write_text(story, encoding="utf-8")
+
+    metrics = run_benchmark(str(corpus_dir), scale=2, latency=0.0, queries=3, quiz_size=2)
+    # Le copie del corpus sono acquisite, ma i loro nodi sono eliminati come quasi identici.
+    assert metrics["pages"] == 4 and metrics["nodes"] == 2
+    for name in ("ingest_seconds", "index_build_seconds", "index_load_seconds",
+                 "retrieve_p95_ms", "query_p95_ms", "quiz_seconds", "peak_rss_mb"):
+        assert metrics[name] > 0
+    assert metrics["retrieve_p50_ms"] <= metrics["retrieve_p95_ms"]
+
+
+def test_compare_uses_the_last_run_of_another_commit(capsys):
+    params = {"scale": 1}
+    previous = [
+        {"commit": "aaa", "date": "1", "params": params, "metrics": {"quiz_seconds": 4.0}},
+        {"commit": "bbb", "date": "2", "params": {"scale": 2}, "metrics": {"quiz_seconds": 1.0}},
+        {"commit": "ccc", "date": "3", "params": params, "metrics": {"quiz_seconds": 2.0}},
+    ]
+    compare({"commit": "ccc", "params": params, "metrics": {"quiz_seconds": 3.0}}, previous)
+    output = capsys.readouterr().out
+    assert "Confronto con aaa" in output and "-25.0%" in output
+
+    assert _percentile([5, 1, 4, 2, 3], 0.5) == 3
+    assert _percentile([5, 1, 4, 2, 3], 0.95) == 5
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from quiz_bank import (QUIZ_COLUMNS, register_quiz, select_quiz, record_answers,
+                       score_answers)
+from global_settings import DEFAULT_NAMESPACE
+from namespaces import set_namespace
+
+
+def _quiz(prefix, count):
+    return pd.DataFrame(
+        [{"Question_no": number, "Question_text": f"{prefix} domanda {number}?",
+          "Option1": "1865", "Option2": "rosso", "Option3": "verde", "Option4": "blu",
+          "Correct_answer": "1865", "Rationale": "perché sì", "Source_node_id": f"n{number}"}
+         for number in range(1, count + 1)],
+        columns=QUIZ_COLUMNS + ["Source_node_id"])
+
+
+def _register(tmp_path, db_path, prefix, count):
+    quiz_file = str(tmp_path / f"{prefix}.csv")
+    _quiz(prefix, count).to_csv(quiz_file, index=False)
+    return register_quiz("favole", quiz_file, db_path=db_path)
+
+
+def test_registered_quizzes_are_selected(tmp_path):
+    db_path = str(tmp_path / "quiz_bank.sqlite")
+    assert select_quiz("favole", 2, namespace="mario", db_path=db_path) is None
+
+    served = _register(tmp_path, db_path, "proposto", 3)
+    assert pd.read_csv(tmp_path / "proposto.csv")["Question_id"].tolist() == \
+        served["Question_id"].tolist()
+    quiz = select_quiz("favole", 3, namespace="mario", db_path=db_path)
+    assert set(quiz["Question_text"]) == set(served["Question_text"])
+    assert list(quiz["Question_no"]) == [1, 2, 3]
+    # Registrare di nuovo le stesse domande non le duplica.
+    assert _register(tmp_path, db_path, "proposto", 3)["Question_id"].tolist() == \
+        served["Question_id"].tolist()
+
+
+def test_answers_are_kept_per_namespace(tmp_path):
+    db_path = str(tmp_path / "quiz_bank.sqlite")
+    served = _register(tmp_path, db_path, "proposto", 3)
+    record_answers(served["Question_id"], [True, True, False], namespace="mario",
+                   db_path=db_path)
+
+    quiz = select_quiz("favole", 1, namespace="mario", db_path=db_path)
+    assert quiz["Question_text"].tolist() == ["proposto domanda 3?"]
+    assert select_quiz("favole", 2, namespace="mario", db_path=db_path) is None
+    assert len(select_quiz("favole", 3, namespace="anna", db_path=db_path)) == 3
+
+    # Senza namespace viene usato lo spazio corrente.
+    set_namespace("mario")
+    try:
+        assert select_quiz("favole", 2, db_path=db_path) is None
+    finally:
+        set_namespace(DEFAULT_NAMESPACE)
+
+
+def test_score_answers():
+    quiz = _quiz("q", 3)
+    correct = score_answers(quiz, {1: "1865", 2: "rosso"})
+    assert correct.tolist() == [True, False, False]
+    assert isinstance(correct, np.ndarray)
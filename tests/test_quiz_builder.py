@@ -0,0 +1,56 @@
+import os
+import pytest
+import quiz_builder
+from global_settings import QUIZ_BANK_DB
+from quiz_bank import select_quiz
+from pipeline_benchmark import MockQuizProgram
+
+
+STORY_A = "Dino è un triceratopo che vive nella foresta e ha paura dei brufoli. " * 20
+STORY_B = "Margo e Ornella piantano un albero magico nel giardino della nonna. " * 20
+
+
+@pytest.fixture
+def indexed_material(write_material, mock_models):
+    from document_uploader import ingest_documents
+    from index_builder import build_index
+    write_material("a.txt", STORY_A)
+    write_material("b.txt", STORY_B)
+    build_index(*ingest_documents())
+
+
+def _failing_program(topic, context):
+    raise ValueError("risposta del LLM non valida")
+
+
+def test_parallel_quiz_covers_different_documents(indexed_material):
+    quiz = quiz_builder.build_quiz_parallel("favole", output_file="quiz.csv", size=2,
+                                            program=MockQuizProgram(0))
+    assert list(quiz["Question_no"]) == [1, 2]
+    assert os.path.exists("quiz.csv")
+    texts = " ".join(quiz["Question_text"])
+    assert "triceratopo" in texts and "albero" in texts
+    # Le domande entrano nell'archivio solo quando il quiz viene proposto (register_quiz):
+    # un quiz preparato per la riserva non deve essere servito come domande mai viste.
+    assert select_quiz("favole", 1, db_path=os.path.abspath(QUIZ_BANK_DB)) is None
+
+
+def test_diverse_chunks_use_the_shared_query_engine(indexed_material, monkeypatch):
+    retrieved = []
+    original = quiz_builder.get_query_engine
+
+    def query_engine(**kwargs):
+        engine = original(**kwargs)
+        retrieved.append(kwargs)
+        return engine
+    monkeypatch.setattr(quiz_builder, "get_query_engine", query_engine)
+    chunks = quiz_builder._diverse_chunks("favole", 2)
+    assert retrieved == [{"similarity_top_k": 6}]
+    assert len({chunk.ref_doc_id for chunk in chunks}) == 2
+
+
+def test_parallel_quiz_without_valid_questions_is_not_saved(indexed_material):
+    with pytest.raises(ValueError):
+        quiz_builder.build_quiz_parallel("favole", output_file="quiz.csv", size=2,
+                                         program=_failing_program)
+    assert not os.path.exists("quiz.csv")
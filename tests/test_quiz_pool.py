@@ -0,0 +1,72 @@
+import os
+import pytest
+import quiz_pool
+from global_settings import QUIZ_POOL_SIZE
+from index_registry import bump_generation
+
+
+# Il quiz viene "generato" scrivendo il numero della chiamata: nessuna chiamata al LLM.
+@pytest.fixture
+def built_quizzes(workdir, monkeypatch):
+    subjects = []
+
+    def build_quiz(subject, output_file):
+        subjects.append(subject)
+        with open(output_file, "w", encoding="utf-8") as file:
+            file.write(f"quiz {len(subjects)}")
+
+    monkeypatch.setattr(quiz_pool, "build_quiz", build_quiz)
+    return subjects
+
+
+# Attende che il thread in background abbia completato i riempimenti in coda.
+def _wait():
+    quiz_pool._executor.submit(lambda: None).result(timeout=10)
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+
+def test_pool_is_filled_in_background_and_popped_instantly(built_quizzes, workdir):
+    assert not quiz_pool.pop_quiz("Dinosauri", destination="quiz.csv")
+    _wait()
+    assert built_quizzes == ["Dinosauri"] * QUIZ_POOL_SIZE
+    assert len(quiz_pool._ready_quizzes("Dinosauri")) == QUIZ_POOL_SIZE
+
+    # Il quiz prelevato è il più vecchio, e la riserva viene riempita di nuovo.
+    assert quiz_pool.pop_quiz("Dinosauri", destination="quiz.csv")
+    assert _read("quiz.csv") == "quiz 1"
+    _wait()
+    assert len(built_quizzes) == QUIZ_POOL_SIZE + 1
+    assert len(quiz_pool._ready_quizzes("Dinosauri")) == QUIZ_POOL_SIZE
+    assert not quiz_pool._pending
+
+    # Una riserva già piena non viene riempita.
+    quiz_pool.refill_pool("Dinosauri")
+    _wait()
+    assert len(built_quizzes) == QUIZ_POOL_SIZE + 1
+
+
+def test_quizzes_of_an_old_index_are_discarded(built_quizzes, workdir):
+    quiz_pool.refill_pool("Dinosauri")
+    _wait()
+    old_quizzes = quiz_pool._ready_quizzes("Dinosauri")
+
+    bump_generation()
+    assert quiz_pool._ready_quizzes("Dinosauri") == []
+    assert not any(os.path.exists(path) for path in old_quizzes)
+    assert not quiz_pool.pop_quiz("Dinosauri", destination="quiz.csv")
+    _wait()
+    assert quiz_pool.pop_quiz("Dinosauri", destination="quiz.csv")
+    assert _read("quiz.csv") == f"quiz {QUIZ_POOL_SIZE + 1}"
+
+
+def test_each_subject_has_its_own_pool(built_quizzes, workdir):
+    quiz_pool.refill_pool("Dinosauri")
+    quiz_pool.refill_pool("Piante")
+    _wait()
+    assert sorted(set(built_quizzes)) == ["Dinosauri", "Piante"]
+    assert quiz_pool._subject_dir("Dinosauri") != quiz_pool._subject_dir("Piante")
+    assert len(quiz_pool._ready_quizzes("Piante")) == QUIZ_POOL_SIZE
@@ -0,0 +1,139 @@
+import os
+import fakeredis
+import numpy as np
+import pytest
+from llama_index.core.llms import ChatMessage
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+from llama_index.core.vector_stores.types import VectorStoreQuery
+import bm25_index
+import index_registry
+import redis_stores
+import storage_factory
+from redis_stores import (RedisKVStore, RedisVectorStore, RedisChatStore, set_redis_client,
+                          redis_key)
+
+
+@pytest.fixture
+def redis_client():
+    client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    set_redis_client(client)
+    yield client
+    set_redis_client(None)
+
+
+@pytest.fixture
+def redis_backend(redis_client, monkeypatch):
+    monkeypatch.setattr(storage_factory, "STORAGE_BACKEND", "redis")
+    monkeypatch.setattr(index_registry, "STORAGE_BACKEND", "redis")
+    monkeypatch.setattr(bm25_index, "STORAGE_BACKEND", "redis")
+    return redis_client
+
+
+def _nodes(vectors, ref_doc_id, prefix):
+    nodes = []
+    for i, vector in enumerate(vectors):
+        node = TextNode(id_=f"{prefix}{i}", text=f"testo {prefix}{i}",
+                        embedding=list(map(float, vector)))
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=ref_doc_id)
+        nodes.append(node)
+    return nodes
+
+
+def test_kv_store_round_trip(redis_client):
+    store = RedisKVStore("learny:test")
+    store.put_all([(f"k{i}", {"i": i}) for i in range(5)], collection="c")
+    store.put("k5", {"i": 5}, collection="c")
+    assert store.get("k3", collection="c") == {"i": 3}
+    assert store.get("k3") is None
+    assert store.get_all("c") == {f"k{i}": {"i": i} for i in range(6)}
+    assert store.delete("k0", collection="c")
+    assert not store.delete("k0", collection="c")
+    # Un altro processo (un altro archivio sullo stesso server) vede gli stessi dati.
+    assert len(RedisKVStore("learny:test", client=redis_client).get_all("c")) == 5
+
+
+def test_vector_store_persists_only_changed_rows(redis_client, monkeypatch):
+    store = RedisVectorStore("learny:test:index")
+    store.add(_nodes(np.eye(4)[:2], "a.txt", "a") + _nodes(np.eye(4)[2:], "b.txt", "b"))
+    store.persist()
+
+    commands = []
+    original = redis_stores.pipelined
+
+    def recording_pipelined(client, sent, *args):
+        sent = list(sent)
+        commands.extend(sent)
+        original(client, sent, *args)
+    monkeypatch.setattr(redis_stores, "pipelined", recording_pipelined)
+    loaded = RedisVectorStore.from_redis("learny:test:index")
+    loaded.delete("a.txt")
+    loaded.add(_nodes([[1, 1, 0, 0]], "c.txt", "c"))
+    loaded.persist()
+    assert sorted((name, args[1]) for name, *args in commands) == [
+        ("hdel", "a0"), ("hdel", "a0"), ("hdel", "a1"), ("hdel", "a1"),
+        ("hset", "c0"), ("hset", "c0")]
+
+    reloaded = RedisVectorStore.from_redis("learny:test:index")
+    assert sorted(reloaded._ids) == ["b0", "b1", "c0"]
+    result = reloaded.query(VectorStoreQuery(query_embedding=[1.0, 0.9, 0, 0],
+                                             similarity_top_k=1))
+    assert result.ids == ["c0"]
+    assert redis_client.hlen("learny:test:index:vectors") == 3
+
+
+def test_chat_store_is_shared_between_clients(redis_client):
+    first = RedisChatStore("learny:test:chat")
+    second = RedisChatStore("learny:test:chat")
+    first.add_message("0", ChatMessage(role="user", content="ciao"))
+    first.add_message("0", ChatMessage(role="assistant", content="ciao a te"))
+
+    messages = second.get_messages("0")
+    assert [message.content for message in messages] == ["ciao", "ciao a te"]
+    # Le letture successive scaricano solo i nuovi messaggi, mantenendo gli stessi oggetti.
+    first.add_message("0", ChatMessage(role="user", content="come stai?"))
+    again = second.get_messages("0")
+    assert again[0] is messages[0] and again[2].content == "come stai?"
+
+    # Un'operazione diversa da un'aggiunta obbliga a rileggere la conversazione.
+    assert first.delete_last_message("0").content == "come stai?"
+    assert [message.content for message in second.get_messages("0")] == ["ciao", "ciao a te"]
+    first.set_messages("0", [ChatMessage(role="user", content="nuova")])
+    assert [message.content for message in second.get_messages("0")] == ["nuova"]
+
+    assert second.get_keys() == ["0"]
+    assert [message.content for message in second.delete_messages("0")] == ["nuova"]
+    assert first.get_messages("0") == [] and first.get_keys() == []
+    assert first.delete_messages("0") is None
+
+
+def test_index_is_built_and_updated_in_redis(redis_backend, write_material, mock_models):
+    from document_uploader import ingest_documents
+    from index_builder import build_index
+    from storage_factory import index_exists, new_storage_context
+    from global_settings import INDEX_STORAGE, BM25_INDEX_FILE
+
+    assert not index_exists()
+    write_material("a.txt", "Dino è un triceratopo che vive nella foresta. " * 20)
+    write_material("b.txt", "Margo e Ornella piantano un albero magico. " * 20)
+    build_index(*ingest_documents())
+    assert index_exists()
+    vectors = redis_backend.hlen(f"{redis_key(INDEX_STORAGE, 'index')}:vectors")
+    assert vectors > 0
+
+    # Un indice salvato non viene mai ricreato (cancellando i dati in Redis).
+    with pytest.raises(ValueError):
+        new_storage_context()
+    assert redis_backend.hlen(f"{redis_key(INDEX_STORAGE, 'index')}:vectors") == vectors
+
+    write_material("c.txt", "Paolo costruisce una macchina volante. " * 20)
+    index = build_index(*ingest_documents())
+    files = {node.metadata["file_name"] for node in index.docstore.docs.values()}
+    assert files == {"a.txt", "b.txt", "c.txt"}
+    assert index_registry.read_generation() == 2
+
+    # Anche l'indice BM25 è in Redis: un processo su un'altra macchina (senza i file locali)
+    # lo trova insieme al resto dell'indice.
+    assert not os.path.exists(os.path.join(INDEX_STORAGE, BM25_INDEX_FILE))
+    index_registry.invalidate()
+    results = index_registry.get_bm25_index().search("macchina volante", top_k=1)
+    assert index.docstore.docs[results[0][0]].metadata["file_name"] == "c.txt"
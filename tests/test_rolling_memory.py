@@ -0,0 +1,82 @@
+import threading
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.storage.chat_store import SimpleChatStore
+import rolling_memory
+from rolling_memory import RollingSummaryMemory
+from jsonl_chat_store import JsonlChatStore
+
+
+def _wait_for_summaries():
+    rolling_memory._executor.submit(lambda: None).result()
+
+
+def _memory(chat_store, token_limit=200):
+    return RollingSummaryMemory.from_defaults(
+        chat_store=chat_store, chat_store_key="0", token_limit=token_limit,
+        summary_token_limit=40, tokenizer_fn=str.split)
+
+
+def _turn(memory, number):
+    memory.put(ChatMessage(role=MessageRole.USER, content=f"domanda {number} " + "parola " * 10))
+    memory.put(ChatMessage(role=MessageRole.ASSISTANT,
+                           content=f"risposta {number} " + "parola " * 20))
+
+
+def test_window_stays_within_the_token_limit(mock_models):
+    memory = _memory(SimpleChatStore())
+    for number in range(60):
+        _turn(memory, number)
+        window = memory.get()
+        assert sum(memory.count_tokens(message) for message in window) <= memory.token_limit
+        assert window[-1].content.startswith(f"risposta {number}")
+        _wait_for_summaries()
+
+    summary, covered = memory.get_summary()
+    assert summary.role == MessageRole.SYSTEM
+    assert 0 < covered < len(memory.get_all())
+    window = memory.get()
+    assert window[0] is summary
+    assert window[1].role == MessageRole.USER
+    # La finestra inizia dove finisce il riassunto, oppure dopo.
+    assert len(window) - 1 <= len(memory.get_all()) - covered
+
+
+def test_token_counts_are_computed_once_per_message(mock_models):
+    calls = []
+
+    def tokenizer(text):
+        calls.append(text)
+        return text.split()
+    memory = _memory(SimpleChatStore(), token_limit=10000)
+    memory.tokenizer_fn = tokenizer
+    for number in range(10):
+        _turn(memory, number)
+        memory.get()
+    assert len(calls) == 20
+
+
+def test_reset_removes_the_summary(mock_models):
+    chat_store = SimpleChatStore()
+    memory = _memory(chat_store, token_limit=60)
+    for number in range(10):
+        _turn(memory, number)
+        memory.get()
+        _wait_for_summaries()
+    assert memory.get_summary()[0] is not None
+    memory.reset()
+    assert memory.get_summary() == (None, 0)
+    assert chat_store.get_keys() == []
+
+
+def test_background_summary_writes_wait_for_compaction(tmp_path):
+    chat_store = JsonlChatStore.from_persist_path(str(tmp_path / "chat.jsonl"))
+    summary = [ChatMessage(role=MessageRole.SYSTEM, content="riassunto")]
+    # Il lock è quello preso da compact: finché è occupato il riassunto scritto dal thread
+    # in background non deve modificare la conversazione.
+    with chat_store._lock:
+        thread = threading.Thread(target=chat_store.set_messages, args=("0:summary", summary))
+        thread.start()
+        thread.join(timeout=0.2)
+        assert "0:summary" not in chat_store.store
+    thread.join()
+    assert chat_store.get_messages("0:summary") == summary
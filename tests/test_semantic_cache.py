@@ -0,0 +1,71 @@
+import numpy as np
+from llama_index.core.base.response.schema import Response
+from llama_index.core.query_engine import CustomQueryEngine
+from global_settings import INDEX_STORAGE
+from index_registry import bump_generation
+from mock_backends import LatencyMockEmbedding
+from namespaces import set_namespace, user_path
+from semantic_cache import SemanticCache, SemanticCacheQueryEngine, get_semantic_cache
+
+
+def _unit(values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+# Motore di query che conta le domande ricevute.
+class CountingQueryEngine(CustomQueryEngine):
+    queries: list = []
+
+    def custom_query(self, query_str: str):
+        self.queries.append(query_str)
+        return Response(response=f"risposta {len(self.queries)}")
+
+
+def test_only_questions_above_the_threshold_hit(workdir):
+    cache = SemanticCache(threshold=0.95)
+    cache.store(_unit([1, 0, 0]), "risposta", latency=2.0)
+    assert cache.lookup(_unit([1, 0.1, 0])) == "risposta"
+    assert cache.lookup(_unit([1, 1, 0])) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    assert cache.stats()["saved_seconds"] == 2.0
+
+
+def test_engine_configurations_do_not_share_answers(workdir):
+    cache = SemanticCache()
+    config = (("compress_context", True), ("similarity_top_k", 5))
+    cache.store(_unit([1, 0]), "compressa", latency=1.0, config=config)
+    assert cache.lookup(_unit([1, 0]), (("similarity_top_k", 2),)) is None
+    assert cache.lookup(_unit([1, 0]), config) == "compressa"
+
+    cache, embed_model = SemanticCache(), LatencyMockEmbedding()
+    compressed = SemanticCacheQueryEngine(
+        CountingQueryEngine(queries=[]), cache=cache, embed_model=embed_model,
+        config={"similarity_top_k": 5, "compress_context": True})
+    plain = SemanticCacheQueryEngine(
+        CountingQueryEngine(queries=[]), cache=cache, embed_model=embed_model,
+        config={"similarity_top_k": 2})
+    assert str(compressed.query("Chi è Dino?")) == "risposta 1"
+    assert str(compressed.query("Chi è Dino?")) == "risposta 1"
+    assert str(plain.query("Chi è Dino?")) == "risposta 1"
+    assert len(plain._query_engine.queries) == 1
+
+
+def test_a_new_index_generation_empties_the_cache(workdir):
+    cache = get_semantic_cache()
+    cache.store(_unit([1, 0]), "vecchia", latency=1.0)
+    assert cache.lookup(_unit([1, 0])) == "vecchia"
+    bump_generation()
+    assert cache.lookup(_unit([1, 0])) is None
+
+
+def test_namespaces_have_separate_caches(workdir):
+    get_semantic_cache().store(_unit([0, 1]), "default", latency=1.0)
+    try:
+        set_namespace("a1b2c3")
+        cache = get_semantic_cache()
+        assert cache.persist_dir == user_path(INDEX_STORAGE)
+        assert cache.lookup(_unit([0, 1])) is None
+    finally:
+        set_namespace("default")
+    assert get_semantic_cache().lookup(_unit([0, 1])) == "default"
@@ -0,0 +1,77 @@
+import itertools
+import os
+import pytest
+import sqlite_kv_store
+from sqlite_kv_store import SQLiteKVStore, import_json_cache
+from llama_index.core.storage.kvstore import SimpleKVStore
+
+
+class _Clock:
+    def __init__(self):
+        self._ticks = itertools.count()
+
+    def time(self):
+        return float(next(self._ticks))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(sqlite_kv_store, "time", _Clock())
+
+
+# Valori di circa 22 KB dopo la compressione (testo casuale, poco comprimibile).
+def _value(i):
+    return {"i": i, "data": os.urandom(20000).hex()}
+
+
+def test_put_get_delete_round_trip(tmp_path):
+    store = SQLiteKVStore(str(tmp_path / "cache.sqlite"))
+    store.put_all([("a", {"x": 1}), ("b", {"x": 2})], collection="c")
+    assert store.get("a", collection="c") == {"x": 1}
+    assert store.get("a") is None
+    assert store.get_all("c") == {"a": {"x": 1}, "b": {"x": 2}}
+    assert store.delete("a", collection="c")
+    assert not store.delete("a", collection="c")
+    store.close()
+
+    reopened = SQLiteKVStore(str(tmp_path / "cache.sqlite"))
+    assert reopened.get_all("c") == {"b": {"x": 2}}
+
+
+def test_eviction_removes_least_recently_read_entries(tmp_path, clock):
+    store = SQLiteKVStore(str(tmp_path / "cache.sqlite"), max_size_mb=0.2)
+    for i in range(8):
+        store.put(f"k{i}", _value(i))
+    # Le prime due voci vengono lette: ora sono le più recenti.
+    assert store.get("k0")["i"] == 0
+    assert store.get("k1")["i"] == 1
+
+    for i in range(8, 12):
+        store.put(f"k{i}", _value(i))
+    keys = set(store.get_all())
+    assert {"k0", "k1", "k11"} <= keys
+    assert "k2" not in keys
+    assert store._total_size <= store.max_size
+
+
+def test_total_size_survives_reopening_and_replacements(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    store = SQLiteKVStore(path)
+    store.put("k", _value(0))
+    store.put("k", _value(1))
+    size = store._total_size
+    store.close()
+    assert SQLiteKVStore(path)._total_size == size
+
+
+def test_import_json_cache(tmp_path):
+    json_path = str(tmp_path / "pipeline_cache.json")
+    simple = SimpleKVStore()
+    simple.put("k", {"x": 1}, collection="pipeline")
+    simple.persist(json_path)
+
+    store = SQLiteKVStore(str(tmp_path / "cache.sqlite"))
+    assert import_json_cache(json_path, store) == 1
+    assert store.get("k", collection="pipeline") == {"x": 1}
+    assert os.path.exists(f"{json_path}.imported")
+    assert import_json_cache(json_path, store) == 0
@@ -0,0 +1,12 @@
+import statistics
+from global_settings import STARTUP_BUDGET_SECONDS
+from startup_benchmark import measure_cold_start
+
+
+# La pagina di benvenuto si apre entro il budget, senza errori e senza importare i moduli
+# pesanti (STARTUP_LAZY_MODULES). Viene usata la mediana di tre avvii a freddo.
+def test_cold_start_is_within_budget():
+    runs = [measure_cold_start() for _ in range(3)]
+    assert [run["errors"] for run in runs] == [[], [], []]
+    assert [run["loaded"] for run in runs] == [[], [], []]
+    assert statistics.median(run["seconds"] for run in runs) <= STARTUP_BUDGET_SECONDS
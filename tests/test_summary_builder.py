@@ -0,0 +1,56 @@
+import os
+from typing import Any
+from llama_index.core import Settings
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
+from llama_index.core.schema import TextNode
+import summary_builder
+from global_settings import SUMMARY_STORAGE
+from summary_builder import build_summary
+
+
+# LLM che registra i prompt ricevuti e risponde con un riassunto numerato.
+class RecordingLLM(CustomLLM):
+    _prompts: list = PrivateAttr(default_factory=list)
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata()
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        self._prompts.append(prompt)
+        return CompletionResponse(text=f"riassunto {len(self._prompts)}")
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError
+
+
+def _nodes(sections):
+    return [TextNode(text=summary, metadata={"file_name": name, "section_summary": summary})
+            for name, summaries in sections.items() for summary in summaries]
+
+
+def test_summary_is_map_reduced_and_cached(workdir, monkeypatch):
+    monkeypatch.setattr(summary_builder, "SUMMARY_REDUCE_GROUP", 2)
+    llm = Settings.llm = RecordingLLM()
+    sections = {"a.pdf": ["Dino ha un brufolo.", "Dino va dal dottore.", "Dino guarisce."],
+                "b.pdf": ["Margo pianta un albero."]}
+
+    overview = build_summary(_nodes(sections))
+    # a.pdf: due gruppi e la loro riduzione; b.pdf ha un solo sommario, usato così com'è;
+    # infine la panoramica.
+    assert len(llm._prompts) == 4
+    assert "riassunto" in overview
+    assert os.path.getsize(os.path.join(SUMMARY_STORAGE, "sommario.pdf")) > 0
+    prompts = "\n".join(llm._prompts)
+    assert all(summary in prompts for summaries in sections.values() for summary in summaries)
+
+    # Gli stessi documenti vengono letti dalla cache, senza chiamare il LLM.
+    assert build_summary(_nodes(sections)) == overview
+    assert len(llm._prompts) == 4
+
+    # Se cambia un documento, vengono riassunti solo quel documento e la panoramica.
+    sections["b.pdf"] = ["Margo pianta un albero.", "L'albero diventa magico."]
+    build_summary(_nodes(sections))
+    assert len(llm._prompts) == 6
+    assert "Dino" not in llm._prompts[4] and "riassunto 5" in llm._prompts[5]
@@ -0,0 +1,37 @@
+from llama_index.core import Document
+from text_cleaner import BoilerplateCleaner
+
+
+def _pages(texts, file_name="libro.pdf"):
+    return [Document(text=text, metadata={"file_name": file_name}) for text in texts]
+
+
+def _contents(nodes):
+    return [node.get_content() for node in nodes]
+
+
+def test_phrases_are_removed_longest_first():
+    cleaner = BoilerplateCleaner(phrases=["favole.com", "Iscriviti su favole.com oggi"])
+    nodes = cleaner(_pages(["C'era una volta. Iscriviti su favole.com oggi", "Fine. favole.com"]))
+    assert _contents(nodes) == ["C'era una volta.", "Fine."]
+
+
+def test_lines_repeated_on_most_pages_are_removed():
+    cleaner = BoilerplateCleaner(phrases=[], min_pages=3, page_fraction=0.5)
+    stories = ["Dino si sveglia.", "Dino ha un brufolo.", "Dino va dal dottore.", "Dino guarisce."]
+    texts = [f"Le avventure di Dino\n{story}\n  Edizioni Favola - pag. {i}  \n"
+             for i, story in enumerate(stories, 1)]
+    nodes = cleaner(_pages(texts))
+    # Intestazione e piè di pagina (con il numero di pagina) vengono eliminati.
+    assert _contents(nodes) == stories
+
+
+def test_short_documents_and_rare_lines_are_kept():
+    cleaner = BoilerplateCleaner(phrases=[], min_pages=3, page_fraction=0.5)
+    texts = ["Titolo\nPrima pagina.", "Titolo\nSeconda pagina."]
+    assert _contents(cleaner(_pages(texts))) == texts
+
+    # Le righe ripetute vengono cercate all'interno di ciascun documento.
+    texts = ["Titolo\nUno.", "Titolo\nDue.", "Altro\nTre.", "Altro\nQuattro."]
+    pages = _pages(texts[:2], "a.pdf") + _pages(texts[2:], "b.pdf")
+    assert _contents(cleaner(pages)) == texts
@@ -0,0 +1,36 @@
+import json
+import os
+import tracing
+from global_settings import TRACE_FILE
+from tracing import span, get_trace, flush
+
+
+def _spans(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line)["name"] for line in file]
+
+
+def test_spans_are_kept_in_memory_without_writing_files(workdir):
+    with span("richiesta") as parent:
+        with span("richiesta.llm"):
+            pass
+    flush()
+    assert [child.name for child in get_trace(parent.trace_id)] == ["richiesta", "richiesta.llm"]
+    assert not os.path.exists(TRACE_FILE)
+
+
+def test_exported_spans_are_written_in_batches_and_rotated(workdir, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_EXPORT", True)
+    monkeypatch.setattr(tracing, "TRACE_FILE_MAX_MB", 200 / (1024 * 1024))
+    for i in range(3):
+        with span(f"operazione_{i}"):
+            pass
+    flush()
+    assert _spans(TRACE_FILE) == ["operazione_0", "operazione_1", "operazione_2"]
+
+    # Il file ha superato il limite: alla scrittura successiva viene rinominato.
+    with span("operazione_3"):
+        pass
+    flush()
+    assert _spans(f"{TRACE_FILE}.1") == ["operazione_0", "operazione_1", "operazione_2"]
+    assert _spans(TRACE_FILE) == ["operazione_3"]
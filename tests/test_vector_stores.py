@@ -0,0 +1,115 @@
+import os
+import numpy as np
+import pytest
+from llama_index.core import StorageContext, VectorStoreIndex
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from mmap_vector_store import (MmapVectorStore, EMBEDDINGS_PREFIX, SIMPLE_VECTOR_STORE_FNAME,
+                               migrate_from_simple)
+from ivf_vector_store import IVFVectorStore
+import storage_factory
+
+
+def _nodes(vectors, ref_doc_id="doc", prefix="n"):
+    nodes = []
+    for i, vector in enumerate(vectors):
+        node = TextNode(id_=f"{prefix}{i}", text=f"testo {prefix}{i}",
+                        embedding=list(map(float, vector)), metadata={"file_name": ref_doc_id})
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=ref_doc_id)
+        nodes.append(node)
+    return nodes
+
+
+def _query(store, vector, top_k=3):
+    return store.query(VectorStoreQuery(query_embedding=list(map(float, vector)),
+                                        similarity_top_k=top_k))
+
+
+def _versioned_files(folder):
+    return sorted(f for f in os.listdir(folder) if f.startswith(EMBEDDINGS_PREFIX))
+
+
+def test_add_delete_query_and_persist_round_trip(tmp_path):
+    store = MmapVectorStore()
+    store.add(_nodes(np.eye(4)[:3], "a.txt", "a") + _nodes(np.eye(4)[3:], "b.txt", "b"))
+
+    result = _query(store, [0, 0.1, 1, 0], top_k=2)
+    assert result.ids == ["a2", "a1"]
+    assert result.similarities[0] == pytest.approx(1 / np.sqrt(1.01))
+
+    store.delete("a.txt")
+    assert _query(store, [1, 0, 0, 0]).ids == ["b0"]
+
+    store.persist(os.path.join(tmp_path, "default__vector_store.json"))
+    loaded = MmapVectorStore.from_persist_dir(tmp_path)
+    assert loaded._ids == ["b0"]
+    assert isinstance(loaded._embeddings, np.memmap)
+    assert loaded.get("b0") == [0, 0, 0, 1]
+
+
+def test_persist_keeps_the_previous_version(tmp_path):
+    store = MmapVectorStore()
+    store.add(_nodes(np.eye(2)))
+    persist_path = os.path.join(tmp_path, "default__vector_store.json")
+
+    store.persist(persist_path)
+    first = _versioned_files(tmp_path)
+    reader = MmapVectorStore.from_persist_dir(tmp_path)
+    store.persist(persist_path)
+    # Un processo che ha aperto la prima versione continua a leggerla.
+    assert set(first) < set(_versioned_files(tmp_path))
+    assert _query(reader, [1, 0]).ids[0] == "n0"
+
+    store.persist(persist_path)
+    assert len(_versioned_files(tmp_path)) == 2
+    assert not set(first) & set(_versioned_files(tmp_path))
+
+
+def test_simple_index_is_migrated_only_on_request(tmp_path, monkeypatch):
+    simple = SimpleVectorStore()
+    simple.add(_nodes(np.eye(3)))
+    simple.persist(os.path.join(tmp_path, SIMPLE_VECTOR_STORE_FNAME))
+    StorageContext.from_defaults(vector_store=simple).index_store.persist(
+        os.path.join(tmp_path, "index_store.json"))
+    StorageContext.from_defaults().docstore.persist(os.path.join(tmp_path, "docstore.json"))
+    monkeypatch.setattr(storage_factory, "VECTOR_STORE_BACKEND", "mmap")
+
+    context = storage_factory.load_storage_context(str(tmp_path))
+    assert isinstance(context.vector_store, SimpleVectorStore)
+    assert os.path.exists(os.path.join(tmp_path, SIMPLE_VECTOR_STORE_FNAME))
+    with pytest.raises(ValueError):
+        MmapVectorStore.from_persist_dir(tmp_path)
+
+    migrate_from_simple(tmp_path)
+    context = storage_factory.load_storage_context(str(tmp_path))
+    assert isinstance(context.vector_store, MmapVectorStore)
+    assert _query(context.vector_store, [0, 1, 0]).ids[0] == "n1"
+
+
+def test_ivf_search_finds_the_nearest_clusters(tmp_path):
+    rng = np.random.default_rng(0)
+    centers = np.eye(8)
+    vectors = np.repeat(centers, 50, axis=0) + rng.normal(0, 0.05, (400, 8))
+    store = IVFVectorStore(nprobe=2)
+    store.add(_nodes(vectors))
+    store.train(nlist=8)
+
+    exact = MmapVectorStore()
+    exact.add(_nodes(vectors))
+    query = vectors[123]
+    assert _query(store, query, top_k=5).ids == _query(exact, query, top_k=5).ids
+
+    store.persist(os.path.join(tmp_path, "default__vector_store.json"))
+    loaded = IVFVectorStore.from_persist_dir(tmp_path)
+    assert loaded._centroids is not None
+    assert _query(loaded, query, top_k=5).ids == _query(exact, query, top_k=5).ids
+
+
+def test_index_without_stored_text_uses_the_docstore(mock_models):
+    nodes = [TextNode(id_=f"n{i}", text=text)
+             for i, text in enumerate(["fotosintesi clorofilliana", "rivoluzione francese"])]
+    index = VectorStoreIndex(nodes, storage_context=StorageContext.from_defaults(
+        vector_store=MmapVectorStore()))
+    retrieved = index.as_retriever(similarity_top_k=1).retrieve("rivoluzione")
+    assert retrieved[0].node.text == "rivoluzione francese"
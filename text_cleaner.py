@@ -0,0 +1,117 @@
+import re
+import sys
+import time
+from collections import Counter
+from typing import Any, List, Sequence
+from llama_index.core.schema import BaseNode, TransformComponent
+from global_settings import (BOILERPLATE_PHRASES, BOILERPLATE_MIN_PAGES,
+                             BOILERPLATE_PAGE_FRACTION)
+
+# Questo modulo implementa una fase di pulizia del testo per la pipeline di acquisizione
+# (document_uploader.py), che elimina le parti ripetitive dei materiali: intestazioni, piè
+# di pagina, pubblicità dell'editore.
+#
+# Le frasi da escludere (BOILERPLATE_PHRASES) vengono eliminate con str.replace, che cerca
+# ogni frase nel testo con un'unica scansione in C, più velocemente di un'espressione regolare
+# con le frasi in alternativa. Inoltre, per ogni documento di almeno BOILERPLATE_MIN_PAGES
+# pagine, vengono individuate automaticamente le righe che si ripetono in almeno
+# BOILERPLATE_PAGE_FRACTION delle pagine (i numeri, ad esempio quelli di pagina, possono
+# variare): ogni riga viene normalizzata una sola volta, e le righe ripetute vengono eliminate
+# con una ricerca nell'insieme delle righe da escludere, senza espressioni regolari.
+#
+# Esempio di benchmark: python text_cleaner.py Libri
+
+_DIGITS = re.compile(r"[0-9]+")
+
+
+# Righe del testo senza spazi iniziali e finali e con i numeri sostituiti da "#", nello stesso
+# ordine di text.splitlines() (la sostituzione viene fatta una sola volta sull'intero testo).
+def _normalized_lines(text):
+    return [line.strip() for line in _DIGITS.sub("#", text).splitlines()]
+
+
+class BoilerplateCleaner(TransformComponent):
+    phrases: List[str] = BOILERPLATE_PHRASES
+    min_pages: int = BOILERPLATE_MIN_PAGES
+    page_fraction: float = BOILERPLATE_PAGE_FRACTION
+
+    # Le frasi più lunghe vengono eliminate per prime: alcune frasi contengono le più brevi.
+    def remove_phrases(self, text):
+        for phrase in sorted(self.phrases, key=len, reverse=True):
+            if phrase in text:
+                text = text.replace(phrase, "")
+        return text
+
+    # Restituisce le righe (normalizzate) che si ripetono in molte pagine dello stesso
+    # documento; lines contiene le righe normalizzate di ciascuna pagina.
+    def repeated_lines(self, lines):
+        if len(lines) < self.min_pages:
+            return set()
+        counts = Counter()
+        for page_lines in lines:
+            counts.update({line for line in page_lines if line})
+        threshold = max(2, self.page_fraction * len(lines))
+        return {line for line, count in counts.items() if count >= threshold}
+
+    def __call__(self, nodes: Sequence[BaseNode], **kwargs: Any) -> Sequence[BaseNode]:
+        documents = {}
+        for node in nodes:
+            documents.setdefault(node.metadata.get("file_name", node.ref_doc_id), []).append(node)
+        for pages in documents.values():
+            texts = [self.remove_phrases(page.get_content()) for page in pages]
+            if len(pages) >= self.min_pages:
+                lines = [_normalized_lines(text) for text in texts]
+                repeated = self.repeated_lines(lines)
+                if repeated:
+                    print(f"### BoilerplateCleaner -> {len(repeated)} righe ripetute in "
+                          f"{pages[0].metadata.get('file_name', '')}")
+                    texts = ["".join(line for line, normalized
+                                     in zip(text.splitlines(keepends=True), page_lines)
+                                     if normalized not in repeated)
+                             for text, page_lines in zip(texts, lines)]
+            for page, text in zip(pages, texts):
+                page.set_content(text)
+        return nodes
+
+
+# Il filtro precedente, mantenuto solo per il confronto nel benchmark.
+def _replace_loop(text, phrases):
+    for phrase in phrases:
+        text = text.replace(phrase, "")
+    return text
+
+
+if __name__ == "__main__":
+    from llama_index.core import Document, SimpleDirectoryReader
+    folder = sys.argv[1] if len(sys.argv) > 1 else "Libri"
+    repeat = 20
+    documents = SimpleDirectoryReader(folder, filename_as_id=True).load_data()
+    texts = [document.get_content() for document in documents]
+    characters = sum(len(text) for text in texts)
+    print(f"{len(documents)} pagine, {characters} caratteri")
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        replaced = [_replace_loop(text, BOILERPLATE_PHRASES) for text in texts]
+    loop_time = (time.perf_counter() - start) / repeat
+    print(f"str.replace per frase: {loop_time * 1000:.2f} ms, "
+          f"{characters - sum(len(text) for text in replaced)} caratteri rimossi")
+
+    cleaner = BoilerplateCleaner()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        replaced = [cleaner.remove_phrases(text) for text in texts]
+    phrases_time = (time.perf_counter() - start) / repeat
+    print(f"Solo frasi:            {phrases_time * 1000:.2f} ms, "
+          f"{characters - sum(len(text) for text in replaced)} caratteri rimossi")
+
+    # Ogni ripetizione lavora su una copia dei documenti, preparata fuori dalla misura.
+    copies = [[Document(text=text, metadata=document.metadata)
+               for document, text in zip(documents, texts)] for _ in range(repeat)]
+    start = time.perf_counter()
+    for copy in copies:
+        cleaned = cleaner(copy)
+    cleaner_time = (time.perf_counter() - start) / repeat
+    print(f"BoilerplateCleaner:    {cleaner_time * 1000:.2f} ms, "
+          f"{characters - sum(len(node.get_content()) for node in cleaned)} caratteri rimossi "
+          f"(incluse le righe ripetute)")
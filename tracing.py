@@ -0,0 +1,309 @@
+import atexit
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from llama_index.core import Settings
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from global_settings import (TRACING, TRACE_EXPORT, TRACE_FILE, TRACE_FILE_MAX_MB,
+                             TRACE_FLUSH_SECONDS, TRACE_HISTORY, TRACE_SERVICE_NAME)
+from namespaces import user_path
+
+# Questo modulo implementa un semplice sistema di tracciamento (tracing) delle operazioni
+# dell'applicazione, compatibile con il formato di OpenTelemetry ma senza dipendenze esterne.
+#
+# Ogni operazione misurata è uno "span": ha un nome, un istante di inizio e di fine, alcuni
+# attributi (numero di documenti, token, risultati letti dalla cache...) e un eventuale span
+# padre. Gli span annidati nella stessa esecuzione formano una traccia (trace), ad esempio
+# tutte le fasi di una risposta della chat.
+# - span(name, **attributes): context manager che misura un blocco di codice;
+# - traced(name): decoratore che misura un'intera funzione;
+# - count(name, amount): incrementa un contatore dello span corrente (ad es. cache_hits).
+# Lo span corrente è conservato in una ContextVar: i thread creati con ThreadPoolExecutor
+# lo ereditano solo se la funzione viene eseguita con propagate().
+#
+# TracingCallbackHandler registra come span anche gli eventi di llama_index (chiamate al LLM
+# con i token utilizzati, embedding, recupero dei nodi, chiamate ai tool dell'agent), come
+# figli dello span corrente. instrument_llama_index() lo aggiunge a Settings.callback_manager.
+#
+# Gli span conclusi restano in memoria (gli ultimi TRACE_HISTORY, per la barra laterale di
+# Streamlit). Con TRACE_EXPORT vengono anche accodati a TRACE_FILE, nello spazio dell'utente,
+# uno per riga, nel formato JSON degli span di OpenTelemetry (OTLP). La scrittura non avviene
+# durante l'operazione misurata: gli span vengono raccolti in memoria e scritti a gruppi da un
+# thread in background ogni TRACE_FLUSH_SECONDS (e all'uscita del processo, o con flush()).
+# Quando il file supera TRACE_FILE_MAX_MB viene rinominato in "<TRACE_FILE>.1" (sostituendo
+# il precedente) e ne viene iniziato uno nuovo. otlp_payload raccoglie gli span nel documento
+# accettato da un collector OpenTelemetry (POST /v1/traces):
+#
+# Esempio: python tracing.py > traces.json
+#          curl -X POST -H "Content-Type: application/json" -d @traces.json http://localhost:4318/v1/traces
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_finished = deque(maxlen=TRACE_HISTORY)
+_lock = threading.Lock()
+# Span da scrivere nei file: (percorso, span). Se la scrittura non riesce a stare al passo,
+# vengono scartati i più vecchi.
+_pending = deque(maxlen=TRACE_HISTORY)
+_write_lock = threading.Lock()
+_writer = None
+
+
+class Span:
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def count(self, name, amount=1):
+        self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            _export(self)
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id, "span_id": self.span_id,
+                "parent_id": self.parent_id, "name": self.name,
+                "duration": self.duration, "attributes": self.attributes,
+                "error": self.error}
+
+    # Rappresentazione dello span nel formato JSON di OpenTelemetry (OTLP).
+    def to_otlp(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": key, "value": _otlp_value(value)}
+                           for key, value in self.attributes.items()],
+            "status": ({"code": 2, "message": self.error} if self.error
+                       else {"code": 1}),
+        }
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _export(span):
+    with _lock:
+        _finished.append(span)
+    if not TRACE_EXPORT or not TRACE_FILE:
+        return
+    # Il percorso è risolto subito: la cartella corrente potrebbe cambiare prima della scrittura.
+    _pending.append((os.path.abspath(user_path(TRACE_FILE)), span))
+    if _writer is None:
+        _start_writer()
+
+
+def _start_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="tracing", daemon=True)
+            _writer.start()
+            atexit.register(flush)
+
+
+def _write_loop():
+    while True:
+        time.sleep(TRACE_FLUSH_SECONDS)
+        flush()
+
+
+# Scrive nei file gli span raccolti in memoria.
+def flush():
+    with _write_lock:
+        lines = {}
+        while _pending:
+            path, span = _pending.popleft()
+            lines.setdefault(path, []).append(json.dumps(span.to_otlp()) + "\n")
+        for path, path_lines in lines.items():
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                if (os.path.exists(path)
+                        and os.path.getsize(path) >= TRACE_FILE_MAX_MB * 1024 * 1024):
+                    os.replace(path, f"{path}.1")
+                with open(path, "a", encoding="utf-8") as file:
+                    file.writelines(path_lines)
+            except OSError as e:
+                print(f"### tracing -> impossibile salvare {len(path_lines)} span in {path}: {e}")
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    if not TRACING:
+        yield Span(name, attributes=attributes)
+        return
+    new_span = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except Exception as e:
+        new_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        new_span.end()
+
+
+def traced(name=None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Incrementa un contatore dello span corrente, se presente.
+def count(name, amount=1):
+    current = _current_span.get()
+    if current is not None:
+        current.count(name, amount)
+
+
+# Restituisce una funzione che esegue function nel contesto corrente (span e spazio
+# dell'utente), da passare a un ThreadPoolExecutor.
+def propagate(function):
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return wrapper
+
+
+# Restituisce gli span conclusi di una traccia, in ordine di inizio.
+def get_trace(trace_id):
+    with _lock:
+        spans = [span for span in _finished if span.trace_id == trace_id]
+    return sorted(spans, key=lambda span: span.start_ns)
+
+
+# Documento OTLP/JSON con gli span indicati, nel formato accettato da un collector OpenTelemetry.
+def otlp_payload(spans):
+    return {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "learny.tracing"}, "spans": spans}],
+    }]}
+
+
+# Registra gli eventi di llama_index come span figli dello span corrente.
+class TracingCallbackHandler(BaseCallbackHandler):
+    def __init__(self):
+        # La suddivisione in chunk e la formattazione dei prompt sono troppo frequenti e brevi
+        # per essere utili nella traccia.
+        ignored = [CBEventType.CHUNKING, CBEventType.TEMPLATING]
+        super().__init__(event_starts_to_ignore=ignored, event_ends_to_ignore=ignored)
+        self._open = {}
+        self._token_counter = None
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs):
+        if not TRACING:
+            return event_id
+        # Il padre è l'evento di llama_index che contiene questo, se è tracciato,
+        # altrimenti lo span corrente dell'applicazione.
+        parent = self._open.get(parent_id) or _current_span.get()
+        event_span = Span(f"llama_index.{event_type.value}", parent)
+        if event_type == CBEventType.FUNCTION_CALL and payload:
+            tool = payload.get(EventPayload.TOOL)
+            event_span.set(tool=getattr(tool, "name", str(tool)))
+        self._open[event_id] = event_span
+        return event_id
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs):
+        event_span = self._open.pop(event_id, None)
+        if event_span is None:
+            return
+        payload = payload or {}
+        if event_type == CBEventType.LLM:
+            event_span.set(**self._llm_tokens(payload))
+        elif event_type == CBEventType.EMBEDDING:
+            event_span.set(chunks=len(payload.get(EventPayload.CHUNKS, [])))
+        elif event_type == CBEventType.RETRIEVE:
+            event_span.set(nodes=len(payload.get(EventPayload.NODES, [])))
+        if EventPayload.EXCEPTION in payload:
+            event_span.error = str(payload[EventPayload.EXCEPTION])
+        event_span.end()
+
+    # Token utilizzati dalla chiamata al LLM: quelli riportati da OpenAI, se presenti,
+    # altrimenti una stima con il tokenizzatore di llama_index.
+    def _llm_tokens(self, payload):
+        response = payload.get(EventPayload.RESPONSE) or payload.get(EventPayload.COMPLETION)
+        usage = (getattr(response, "raw", None) or {})
+        usage = usage.get("usage") if isinstance(usage, dict) else getattr(usage, "usage", None)
+        if usage is not None:
+            usage = usage if isinstance(usage, dict) else usage.model_dump()
+            return {"prompt_tokens": usage.get("prompt_tokens", 0),
+                    "completion_tokens": usage.get("completion_tokens", 0)}
+        if self._token_counter is False:
+            return {}
+        try:
+            from llama_index.core.callbacks.token_counting import get_llm_token_counts
+            from llama_index.core.utilities.token_counting import TokenCounter
+            self._token_counter = self._token_counter or TokenCounter()
+            counts = get_llm_token_counts(self._token_counter, payload)
+            return {"prompt_tokens": counts.prompt_token_count,
+                    "completion_tokens": counts.completion_token_count}
+        except Exception as e:
+            # Tokenizzatore non disponibile (ad esempio senza rete): niente stima.
+            print(f"### TracingCallbackHandler -> conteggio dei token non disponibile: {e}")
+            self._token_counter = False
+            return {}
+
+    def start_trace(self, trace_id=None):
+        pass
+
+    def end_trace(self, trace_id=None, trace_map=None):
+        pass
+
+
+# Aggiunge (una sola volta) TracingCallbackHandler al callback manager globale di llama_index,
+# usato da LLM, modello di embedding, motori di query e agent.
+def instrument_llama_index():
+    manager = Settings.callback_manager
+    if TRACING and not any(isinstance(handler, TracingCallbackHandler)
+                           for handler in manager.handlers):
+        manager.add_handler(TracingCallbackHandler())
+
+
+if __name__ == "__main__":
+    path = user_path(sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE)
+    with open(path, encoding="utf-8") as file:
+        spans = [json.loads(line) for line in file if line.strip()]
+    print(json.dumps(otlp_payload(spans)))
@@ -2,6 +2,12 @@ import streamlit as st
 from conversation_engine import initialize_chatbot, chat_interface, load_chat_store
 from quiz_UI import show_quiz
 from quiz_builder import build_quiz
+from quiz_pool import pop_quiz, refill_pool
+from quiz_bank import select_quiz, register_quiz
+from global_settings import QUIZ_FILE, QUIZ_SIZE
+from namespaces import user_path
+from tracing import instrument_llama_index
+from embedding_provider import configure_embed_model
 
 # Genera con streamlit un'interfaccia con 2 colonne: una per il quiz, l'altra per il chatbot
 
@@ -10,6 +16,12 @@ def show_training_UI(user_name, study_subject):
     print("### show_training_UI(user_name, study_subject)")
     # Mostra il titolo nella barra laterale
     st.sidebar.markdown("## " + "Allenati con un quiz o studia con il chatbot")
+    # Registra come span (tracing.py) le chiamate al LLM, agli embedding e ai tool.
+    instrument_llama_index()
+    # Modello di embedding scelto in global_settings (EMBEDDING_PROVIDER), con la cache.
+    configure_embed_model()
+    # Mantiene piena in background la riserva di quiz pronti sull'argomento di studio.
+    refill_pool(study_subject)
 
     # crea due colonne con una proporzione di 0.4 e 0.6
     col1, col2 = st.columns([0.4, 0.6], gap="medium")
@@ -18,10 +30,10 @@ def show_training_UI(user_name, study_subject):
         # Crea un'intestazione per il chatbot e visualizza un messaggio di
         # benvenuto personalizzato per l'utente, indicando l'argomento di studio.
         st.header("💬 Learny chatbot")
-        st.success(f"Ciao {user_name}. Sono qui per risponderti su: '{
-            study_subject}'")
+        st.success(f"Ciao {user_name}. Sono qui per risponderti su: "
+                   f"'{study_subject}'")
 
-        # Crea un'istanza di SimpleChatStore, per memorizzare i messaggi della chat.
+        # Crea (o recupera) l'archivio della chat, per memorizzare i messaggi della chat.
         chat_store = load_chat_store()
         # crea un contenitore con un'altezza di 550 pixel per visualizzare i messaggi della chat.
         container = st.container(height=550)
@@ -37,10 +49,21 @@ def show_training_UI(user_name, study_subject):
     # mostra il pulsante "Genera un quiz".
     if not 'quiz_running' in st.session_state or not st.session_state['quiz_running']:
         if st.sidebar.button("Genera un quiz"):
-            # Genera il quiz e lo mostra nella seconda colonna
+            # Compone il quiz con le domande dell'archivio (quiz_bank.py) che lo studente
+            # non ha ancora visto o ha sbagliato, senza chiamare il LLM. Se non ce ne sono
+            # abbastanza, preleva un quiz già pronto dalla riserva (quiz_pool.py); solo se
+            # anche la riserva è vuota il quiz viene generato sul momento. Le domande nuove
+            # vengono aggiunte all'archivio solo ora che il quiz viene proposto.
+            # Il quiz viene mostrato nella seconda colonna.
             with col2:
                 st.session_state['quiz_running'] = True
-                quiz = build_quiz(st.session_state['study_subject'])
+                quiz = select_quiz(study_subject, QUIZ_SIZE)
+                if quiz is not None:
+                    quiz.to_csv(user_path(QUIZ_FILE), index=False)
+                else:
+                    if not pop_quiz(st.session_state['study_subject']):
+                        build_quiz(st.session_state['study_subject'])
+                    register_quiz(st.session_state['study_subject'], user_path(QUIZ_FILE))
                 show_quiz(st.session_state['study_subject'])
     else:
         # Quiz già generato: lo mostra nella seconda colonna
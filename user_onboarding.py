@@ -2,12 +2,14 @@ import streamlit as st
 import os
 from session_functions import save_session
 from global_settings import STORAGE_PATH
-from document_uploader import ingest_documents
-from index_builder import build_index
-from summary_builder import build_summary
+from ingestion_manifest import has_changes, ingestion_lock
+from namespaces import user_path
 
 # Chiede ad un nuovo studente l'argomento di studio, acquisisce i materiali e crea l'indice.
 # Aggiorna alcune chiavi di sessione.
+# I moduli di acquisizione, indicizzazione e preparazione del sommario e dei quiz vengono
+# importati solo dopo il caricamento dei materiali: le domande iniziali vengono mostrate
+# senza attendere il caricamento di llama_index.
 
 
 def user_onboarding():
@@ -35,7 +37,8 @@ def user_onboarding():
         if finish_upload and uploaded_files:
             saved_file_names = []
             for uploaded_file in uploaded_files:
-                file_path = os.path.join(STORAGE_PATH, uploaded_file.name)
+                # I materiali vengono salvati nello spazio dell'utente (namespaces.py).
+                file_path = os.path.join(user_path(STORAGE_PATH), uploaded_file.name)
 
                 with open(file_path, "wb") as f:
                     f.write(uploaded_file.getbuffer())
@@ -47,21 +50,39 @@ def user_onboarding():
             st.info('Caricamento dei files...')
 
     if 'finish_upload' in st.session_state:
+        from document_uploader import ingest_documents
+        from index_builder import build_index
+        from summary_builder import build_summary
+        from quiz_pool import refill_pool
+        from tracing import instrument_llama_index
+        from embedding_provider import configure_embed_model
+        instrument_llama_index()
+        configure_embed_model()
         # Avvia l'acquisizione dei materiali di studio.
-        nodes = ingest_documents()
+        # Vengono elaborati solo i file nuovi o modificati: nelle successive esecuzioni
+        # dello script (ad ogni interazione con la pagina) non c'è nulla da rielaborare.
+        # Il lock comprende acquisizione e indicizzazione: un'altra sessione dello stesso
+        # utente attende, e poi trova le modifiche già registrate nel manifesto.
+        with ingestion_lock():
+            nodes, changes = ingest_documents()
+            if changes.get("duplicates_removed"):
+                st.info(f"Eliminate {changes['duplicates_removed']} parti duplicate dei materiali: "
+                        f"risparmiati altrettanti riassunti ed embedding.")
 
-        # Prepara un sommario e lo salva in u file Pdf
-        st.info('Materiali caricati. Preparo il sommario...')
-        summary_text = ''
-        for node in nodes:
-            summary = node.metadata['section_summary']
-            summary_text += summary + '\n\n'
+            st.info('Materiali caricati. Preparo l\'indice...')
+            # Avvia l'indicizzazione, sostituendo nell'indice i documenti modificati.
+            vector_index = build_index(nodes, changes)
 
-        build_summary(summary_text)
-
-        st.info('Sommario generato. Preparo l\'indice...')
-        # Avvia l'indicizzazione.
-        vector_index = build_index(nodes)
+        # Prepara un sommario e lo salva in u file Pdf.
+        # Il sommario comprende tutti i nodi presenti nell'indice (non solo quelli appena
+        # acquisiti) e viene rigenerato solo se i materiali sono cambiati; i riassunti dei
+        # documenti non modificati vengono letti dalla cache (summary_builder.py).
+        if has_changes(changes):
+            st.info('Indice aggiornato. Preparo il sommario...')
+            build_summary(vector_index.docstore.docs.values())
+        # Avvia in background la preparazione dei quiz sull'argomento di studio, in modo
+        # che il pulsante "Genera un quiz" trovi un quiz già pronto.
+        refill_pool(study_subject)
         st.info('Indicizzazione completata.')
         # Attende che l'utente clicchi sul pulsante 'Procedi' per proseguire.
         proceed_button = st.button('Procedi')